@@ -5,29 +5,71 @@ from dotenv import load_dotenv
 import asyncio
 import aiohttp
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import requests
 from io import BytesIO
 import urllib.parse
 import random
 import string
-import pdfkit
 from bs4 import BeautifulSoup
 import re
+import sqlite3
+import threading
+import time
+import ast
+from array import array
+import functools
+import math
+import operator
+import heapq
+import hashlib
+import html
+import shutil
+import tempfile
+import sys
+from collections import deque, OrderedDict
+
+# ✅ NOVO: Extração de texto de PDFs é opcional (sem ela só o nome do arquivo é indexado)
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+    print("⚠️ pypdf não instalado, !search PDF buscará só pelo nome. Instale com: pip install pypdf")
 
 load_dotenv()
 
 intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+# ✅ NOVO: 429 com espera longa vira discord.RateLimited em vez de prender a requisição
+# (as curtas continuam sendo repetidas pelo próprio discord.py)
+LIMITE_ESPERA_RATELIMIT = 10.0
+bot = commands.Bot(command_prefix='!', intents=intents, help_command=None,
+                   max_ratelimit_timeout=LIMITE_ESPERA_RATELIMIT)
 
 # ✅ CORREÇÃO: Adicionar setup_hook para inicialização assíncrona
 @bot.event
 async def setup_hook():
     """Hook de inicialização assíncrona do discord.py"""
     print("🔄 Iniciando sistemas de segurança assincronamente...")
+    await db.iniciar_write_behind()
+    await cliente_http.iniciar()
+    fila_ia.iniciar()
+    agendador.iniciar()
+    await indice_busca.iniciar()
+    await indice_pdfs.iniciar()
     await sistema_seguranca.setup()
     print("✅ Todos os sistemas de segurança ativados!")
 
+# ✅ NOVO: Fechar a sessão HTTP compartilhada junto com o bot
+_close_original = bot.close
+
+@bot.event
+async def close():
+    await cliente_http.fechar()
+    await indice_busca.flush()
+    await agendador.fechar()
+    indice_pdfs.fechar()
+    await _close_original()
+
 # CONFIGURAÇÕES COMPLETAS
 CONFIG = {
     "cargos_linguagens": {
@@ -79,7 +121,9 @@ CONFIG = {
         "pontuacao": "📊・pontuacao"
     },
     
+    # Tipos de canal configuráveis (valores por servidor ficam em CanaisServidor)
     "canais_automaticos": {
+        "tickets": None,
         "self_roles": None,
         "entrada_saida": None,
         "mod_logs": None,
@@ -96,86 +140,901 @@ CONFIG = {
 }
 
 # BANCO DE DADOS COMPLETO - MOVIDO PARA ANTES DO SISTEMA DE SEGURANÇA
+class ColecaoPersistente(dict):
+    """Dict que registra quais chaves foram tocadas desde o último salvamento.
+
+    Leituras também marcam a chave como candidata, porque os valores são
+    aninhados (ex: db.pontuacao[uid]["pontos"] += 1) e podem ser alterados sem
+    passar por __setitem__. Na gravação cada candidata é comparada com a
+    assinatura do que já está no banco, então só o que mudou de fato é
+    escrito; iterar por values()/items() só torna todas as chaves candidatas.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chaves_tocadas = set()
+        self.chaves_removidas = set()
+        self.tudo_tocado = False  # Grava tudo, mesmo sem mudança (migração)
+        self.iterada = False  # values()/items() desde a última gravação
+        self.assinaturas = {}  # chave -> hash do JSON gravado
+
+    def _tocar(self, chave):
+        self.chaves_tocadas.add(chave)
+        self.chaves_removidas.discard(chave)
+
+    def _remover(self, chave):
+        self.chaves_tocadas.discard(chave)
+        self.chaves_removidas.add(chave)
+
+    def __getitem__(self, chave):
+        valor = super().__getitem__(chave)
+        self._tocar(chave)
+        return valor
+
+    def __setitem__(self, chave, valor):
+        super().__setitem__(chave, valor)
+        self._tocar(chave)
+
+    def __delitem__(self, chave):
+        super().__delitem__(chave)
+        self._remover(chave)
+
+    def get(self, chave, padrao=None):
+        if chave in self:
+            self._tocar(chave)
+        return super().get(chave, padrao)
+
+    def setdefault(self, chave, padrao=None):
+        self._tocar(chave)
+        return super().setdefault(chave, padrao)
+
+    def pop(self, chave, *padrao):
+        if chave in self:
+            self._remover(chave)
+        return super().pop(chave, *padrao)
+
+    def popitem(self):
+        chave, valor = super().popitem()
+        self._remover(chave)
+        return chave, valor
+
+    def update(self, *args, **kwargs):
+        for chave, valor in dict(*args, **kwargs).items():
+            self[chave] = valor
+
+    def clear(self):
+        self.chaves_removidas.update(self.keys())
+        self.chaves_tocadas.clear()
+        super().clear()
+
+    def values(self):
+        # Iterar pelos valores permite alterá-los: a gravação compara todas as chaves
+        self.iterada = True
+        return super().values()
+
+    def items(self):
+        self.iterada = True
+        return super().items()
+
+    def alteracoes(self):
+        """Retorna [(chave, json)] do que mudou desde a última gravação"""
+        if self.tudo_tocado or self.iterada:
+            chaves = list(dict.keys(self))
+        else:
+            chaves = [c for c in self.chaves_tocadas if dict.__contains__(self, c)]
+        
+        alteradas = []
+        for chave in chaves:
+            serializado = json.dumps(dict.__getitem__(self, chave))
+            assinatura = hash(serializado)
+            if self.tudo_tocado or self.assinaturas.get(chave) != assinatura:
+                self.assinaturas[chave] = assinatura
+                alteradas.append((chave, serializado))
+        for chave in self.chaves_removidas:
+            self.assinaturas.pop(chave, None)
+        return alteradas
+
+    def limpar_marcas(self):
+        self.chaves_tocadas.clear()
+        self.chaves_removidas.clear()
+        self.tudo_tocado = False
+        self.iterada = False
+
+
 class Database:
+    # ✅ NOVO: Coleções persistidas no SQLite (uma linha por chave)
+    COLECOES = [
+        'advertencias', 'convites', 'config', 'contadores', 'historico_ia',
+        'pontuacao', 'config_canais', 'lembretes_anuncios', 'missoes_cyber',
+        'conversas_ativas', 'rate_limit_data', 'comandos_personalizados',
+        'whitelist_tokens'
+    ]
+
     def __init__(self):
-        self.advertencias = {}
-        self.convites = {}
-        self.config = {}
-        self.contadores = {}
-        self.historico_ia = {}
-        self.pontuacao = {}
-        self.config_canais = {}
-        self.lembretes_anuncios = {}
-        self.missoes_cyber = {}
-        self.conversas_ativas = {}
-        self.rate_limit_data = {}
-        self.comandos_personalizados = {}
-        self.whitelist_tokens = {}  # ✅ NOVO: Sistema de tokens para whitelist
+        self.arquivo_db = 'data.db'
+        self.arquivo_legado = 'data.json'
+        self.conexao = None
+        self.lock_conexao = threading.Lock()
+        # ✅ NOVO: Write-behind (salvar_dados só marca como sujo)
+        self.intervalo_flush = 5       # segundos entre gravações
+        self.max_mutacoes = 50         # grava antes se acumular isso
+        self.mutacoes_pendentes = 0
+        self.evento_flush = None
+        self.task_flush = None
+        for colecao in self.COLECOES:
+            setattr(self, colecao, ColecaoPersistente())
         self.criar_banco_automatico()
     
     def criar_banco_automatico(self):
         """Cria o banco de dados automaticamente se não existir"""
+        self.conexao = sqlite3.connect(self.arquivo_db, check_same_thread=False)
+        # WAL: gravações curtas e leitores não bloqueiam o escritor
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self.conexao.execute("""
+            CREATE TABLE IF NOT EXISTS dados (
+                colecao TEXT NOT NULL,
+                chave TEXT NOT NULL,
+                valor TEXT NOT NULL,
+                PRIMARY KEY (colecao, chave)
+            )
+        """)
+        self.conexao.commit()
+        
         try:
             self.carregar_dados()
         except:
             self.salvar_dados()
     
     def salvar_dados(self):
-        with open('data.json', 'w') as f:
-            json.dump({
-                'advertencias': self.advertencias,
-                'convites': self.convites,
-                'config': self.config,
-                'contadores': self.contadores,
-                'historico_ia': self.historico_ia,
-                'pontuacao': self.pontuacao,
-                'config_canais': self.config_canais,
-                'lembretes_anuncios': self.lembretes_anuncios,
-                'missoes_cyber': self.missoes_cyber,
-                'conversas_ativas': self.conversas_ativas,
-                'rate_limit_data': self.rate_limit_data,
-                'comandos_personalizados': self.comandos_personalizados,
-                'whitelist_tokens': self.whitelist_tokens  # ✅ NOVO
-            }, f, indent=2)
+        """Marca o banco como alterado; a gravação real acontece em segundo plano"""
+        if not self.task_flush or self.task_flush.done():
+            # Write-behind ainda não iniciado (ou já encerrado): grava direto
+            self.gravar_pendencias()
+            return
+        
+        self.mutacoes_pendentes += 1
+        if self.mutacoes_pendentes >= self.max_mutacoes:
+            self.evento_flush.set()
+    
+    def coletar_alteracoes(self):
+        """Serializa as chaves alteradas e limpa as marcas das coleções"""
+        gravar = []
+        remover = []
+        
+        for colecao in self.COLECOES:
+            dados = getattr(self, colecao)
+            for chave, serializado in dados.alteracoes():
+                gravar.append((colecao, str(chave), serializado))
+            for chave in dados.chaves_removidas:
+                remover.append((colecao, str(chave)))
+            
+            dados.limpar_marcas()
+        
+        return gravar, remover
+    
+    def escrever_alteracoes(self, gravar, remover):
+        """Grava as alterações numa única transação (pode rodar em thread)"""
+        if not gravar and not remover:
+            return
+        
+        with self.lock_conexao:
+            with self.conexao:
+                if remover:
+                    self.conexao.executemany("DELETE FROM dados WHERE colecao = ? AND chave = ?", remover)
+                if gravar:
+                    self.conexao.executemany("INSERT OR REPLACE INTO dados (colecao, chave, valor) VALUES (?, ?, ?)", gravar)
+    
+    def remarcar_alteracoes(self, gravar, remover):
+        """Devolve as marcas de alteração se a gravação falhou"""
+        for colecao, chave, _ in gravar:
+            dados = getattr(self, colecao)
+            # Sem assinatura a chave é regravada mesmo que não mude de novo
+            dados.assinaturas.pop(chave, None)
+            if dict.__contains__(dados, chave):
+                dados.chaves_tocadas.add(chave)
+            else:
+                dados.iterada = True
+        for colecao, chave in remover:
+            getattr(self, colecao).chaves_removidas.add(chave)
+    
+    def gravar_pendencias(self):
+        """Gravação síncrona de tudo que estiver pendente"""
+        gravar, remover = self.coletar_alteracoes()
+        self.mutacoes_pendentes = 0
+        self.escrever_alteracoes(gravar, remover)
+    
+    async def flush(self):
+        """Gravação assíncrona: serializa no loop, escreve no executor"""
+        gravar, remover = self.coletar_alteracoes()
+        self.mutacoes_pendentes = 0
+        if not gravar and not remover:
+            return
+        
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.escrever_alteracoes, gravar, remover)
+        except Exception as e:
+            print(f"❌ Erro ao gravar banco de dados: {e}")
+            self.remarcar_alteracoes(gravar, remover)
+    
+    async def iniciar_write_behind(self):
+        """Inicia a task que grava o banco periodicamente"""
+        if self.task_flush and not self.task_flush.done():
+            return
+        self.evento_flush = asyncio.Event()
+        self.task_flush = asyncio.create_task(self.loop_flush())
+    
+    async def loop_flush(self):
+        """Grava a cada intervalo_flush segundos ou após max_mutacoes"""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.evento_flush.wait(), timeout=self.intervalo_flush)
+                except asyncio.TimeoutError:
+                    pass
+                self.evento_flush.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            # Encerramento: grava o que faltou antes de sair
+            self.gravar_pendencias()
+            raise
     
     def carregar_dados(self):
         try:
-            with open('data.json', 'r') as f:
-                data = json.load(f)
-                self.advertencias = data.get('advertencias', {})
-                self.convites = data.get('convites', {})
-                self.config = data.get('config', {})
-                self.contadores = data.get('contadores', {})
-                self.historico_ia = data.get('historico_ia', {})
-                self.pontuacao = data.get('pontuacao', {})
-                self.config_canais = data.get('config_canais', {})
-                self.lembretes_anuncios = data.get('lembretes_anuncios', {})
-                self.missoes_cyber = data.get('missoes_cyber', {})
-                self.conversas_ativas = data.get('conversas_ativas', {})
-                self.rate_limit_data = data.get('rate_limit_data', {})
-                self.comandos_personalizados = data.get('comandos_personalizados', {})
-                self.whitelist_tokens = data.get('whitelist_tokens', {})  # ✅ NOVO
-                
-                # Carregar configurações de canais
-                if 'canais_automaticos' in self.config_canais:
-                    CONFIG['canais_automaticos'] = self.config_canais['canais_automaticos']
+            linhas = self.conexao.execute("SELECT colecao, chave, valor FROM dados").fetchall()
+            
+            # Migração automática do data.json antigo
+            if not linhas and os.path.exists(self.arquivo_legado):
+                self.migrar_json_legado()
+                return
+            
+            for colecao in self.COLECOES:
+                setattr(self, colecao, ColecaoPersistente())
+            for colecao, chave, valor in linhas:
+                if colecao in self.COLECOES:
+                    dados = getattr(self, colecao)
+                    dict.__setitem__(dados, chave, json.loads(valor))
+                    dados.assinaturas[chave] = hash(valor)
+            self.config_canais.limpar_marcas()
         except:
-            self.advertencias = {}
-            self.convites = {}
-            self.config = {}
-            self.contadores = {}
-            self.historico_ia = {}
-            self.pontuacao = {}
-            self.config_canais = {}
-            self.lembretes_anuncios = {}
-            self.missoes_cyber = {}
-            self.conversas_ativas = {}
-            self.rate_limit_data = {}
-            self.comandos_personalizados = {}
-            self.whitelist_tokens = {}  # ✅ NOVO
+            for colecao in self.COLECOES:
+                setattr(self, colecao, ColecaoPersistente())
+    
+    def migrar_json_legado(self):
+        """Importa o data.json antigo para o SQLite"""
+        with open(self.arquivo_legado, 'r') as f:
+            data = json.load(f)
+        
+        for colecao in self.COLECOES:
+            dados = ColecaoPersistente(data.get(colecao, {}))
+            dados.tudo_tocado = True
+            setattr(self, colecao, dados)
+        
+        self.salvar_dados()
+        print(f"✅ Dados migrados de {self.arquivo_legado} para {self.arquivo_db}")
+    
+    def fechar(self):
+        """Grava pendências e fecha a conexão"""
+        if self.task_flush and not self.task_flush.done():
+            self.task_flush.cancel()
+        if self.conexao:
+            self.gravar_pendencias()
+            self.conexao.close()
+            self.conexao = None
 
 db = Database()
 
+# ✅ NOVO: Armazém de snapshots com deduplicação por conteúdo (mesmo formato do CAT BOT)
+class ArmazemSnapshots:
+    """Snapshots de estrutura do servidor com histórico.
+
+    Cada item (categoria, canal...) é gravado uma vez em snapshots/objetos/<sha256>.json
+    e o snapshot é só um manifesto com os hashes - itens iguais entre backups não
+    ocupam espaço de novo. Guarda os max_snapshots mais recentes por servidor/tipo.
+    O diretório é compartilhado com o CAT BOT: a coleta de órfãos não apaga
+    objetos gravados ou reaproveitados há menos de `carencia` segundos, que
+    podem pertencer a um manifesto que o outro processo ainda vai gravar.
+    """
+
+    def __init__(self, raiz='snapshots', max_snapshots=20, carencia=3600):
+        self.dir_objetos = os.path.join(raiz, 'objetos')
+        self.dir_manifestos = os.path.join(raiz, 'manifestos')
+        self.max_snapshots = max_snapshots
+        self.carencia = carencia
+        os.makedirs(self.dir_objetos, exist_ok=True)
+        os.makedirs(self.dir_manifestos, exist_ok=True)
+
+    @staticmethod
+    def _serializar(valor):
+        return json.dumps(valor, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def _gravar_atomico(self, caminho, conteudo):
+        temporario = f"{caminho}.{os.getpid()}.tmp"  # Dois bots podem gravar o mesmo objeto
+        with open(temporario, 'wb') as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+
+    def _guardar_objeto(self, valor, novos):
+        conteudo = self._serializar(valor)
+        digest = hashlib.sha256(conteudo).hexdigest()
+        caminho = os.path.join(self.dir_objetos, f"{digest}.json")
+        try:
+            # Reaproveitado: renova o mtime para a coleta respeitar a carência
+            os.utime(caminho)
+        except FileNotFoundError:
+            self._gravar_atomico(caminho, conteudo)
+            novos.append(digest)
+        return digest
+
+    def _ler_objeto(self, digest):
+        with open(os.path.join(self.dir_objetos, f"{digest}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _decompor(self, valor, novos):
+        # Listas de dicts viram listas de hashes (um objeto por item)
+        if isinstance(valor, list) and valor and all(isinstance(item, dict) for item in valor):
+            return {'itens': [self._guardar_objeto(item, novos) for item in valor]}
+        if isinstance(valor, dict) and valor and all(isinstance(item, list) for item in valor.values()):
+            return {'grupos': {chave: self._decompor(item, novos) for chave, item in valor.items()}}
+        if isinstance(valor, (dict, list)):
+            return {'objeto': self._guardar_objeto(valor, novos)}
+        return {'valor': valor}
+
+    def _recompor(self, secao):
+        if 'itens' in secao:
+            return [self._ler_objeto(digest) for digest in secao['itens']]
+        if 'grupos' in secao:
+            return {chave: self._recompor(item) for chave, item in secao['grupos'].items()}
+        if 'objeto' in secao:
+            return self._ler_objeto(secao['objeto'])
+        return secao['valor']
+
+    def _hashes(self, secao):
+        if 'itens' in secao:
+            return list(secao['itens'])
+        if 'grupos' in secao:
+            return [digest for item in secao['grupos'].values() for digest in self._hashes(item)]
+        if 'objeto' in secao:
+            return [secao['objeto']]
+        return []
+
+    def _ler_manifesto(self, snapshot_id):
+        caminho = os.path.join(self.dir_manifestos, f"{os.path.basename(snapshot_id)}.json")
+        if not os.path.exists(caminho):
+            return None
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def salvar(self, guild_id, dados, tipo='backup_canais'):
+        """Grava o snapshot e retorna o manifesto (sem as seções)"""
+        criado_em = time.time()
+        snapshot_id = f"{tipo}_{guild_id}_{int(criado_em)}"
+        sufixo = 1
+        while os.path.exists(os.path.join(self.dir_manifestos, f"{snapshot_id}.json")):
+            sufixo += 1
+            snapshot_id = f"{tipo}_{guild_id}_{int(criado_em)}_{sufixo}"
+
+        novos = []
+        secoes = {chave: self._decompor(valor, novos) for chave, valor in dados.items()}
+        total = sum(len(self._hashes(secao)) for secao in secoes.values())
+
+        manifesto = {
+            'id': snapshot_id,
+            'guild_id': str(guild_id),
+            'tipo': tipo,
+            'rotulo': None,
+            'criado_em': criado_em,
+            'delta': {'objetos': total, 'novos': len(novos), 'reaproveitados': total - len(novos)},
+            'secoes': secoes
+        }
+        self._gravar_atomico(os.path.join(self.dir_manifestos, f"{snapshot_id}.json"), self._serializar(manifesto))
+
+        self._podar(guild_id, tipo)
+        return {chave: valor for chave, valor in manifesto.items() if chave != 'secoes'}
+
+    def carregar(self, snapshot_id, guild_id=None, tipo=None):
+        """Dados completos do snapshot; None se não existir ou for de outro servidor/tipo"""
+        manifesto = self._ler_manifesto(snapshot_id)
+        if manifesto is None:
+            return None
+        if guild_id is not None and manifesto['guild_id'] != str(guild_id):
+            return None
+        if tipo is not None and manifesto['tipo'] != tipo:
+            return None
+        return {chave: self._recompor(secao) for chave, secao in manifesto['secoes'].items()}
+
+    def listar(self, guild_id=None, tipo=None):
+        """Snapshots do mais recente para o mais antigo"""
+        manifestos = []
+        for nome in os.listdir(self.dir_manifestos):
+            if not nome.endswith('.json'):
+                continue
+            try:
+                manifesto = self._ler_manifesto(nome[:-5])
+            except Exception as e:
+                print(f"❌ Manifesto de snapshot ilegível ({nome}): {e}")
+                continue
+            if guild_id is not None and manifesto['guild_id'] != str(guild_id):
+                continue
+            if tipo is not None and manifesto['tipo'] != tipo:
+                continue
+            manifestos.append({chave: valor for chave, valor in manifesto.items() if chave != 'secoes'})
+        return sorted(manifestos, key=lambda m: m['criado_em'], reverse=True)
+
+    def _podar(self, guild_id, tipo):
+        excedentes = self.listar(guild_id, tipo)[self.max_snapshots:]
+        if not excedentes:
+            return
+
+        for manifesto in excedentes:
+            os.remove(os.path.join(self.dir_manifestos, f"{manifesto['id']}.json"))
+
+        # Coleta de objetos sem referência em nenhum manifesto (inclusive os do CAT BOT)
+        referenciados = set()
+        for nome in os.listdir(self.dir_manifestos):
+            if nome.endswith('.json'):
+                manifesto = self._ler_manifesto(nome[:-5])
+                if manifesto:  # Pode ter sido podado pelo outro bot
+                    for secao in manifesto['secoes'].values():
+                        referenciados.update(self._hashes(secao))
+
+        limite = time.time() - self.carencia
+        for nome in os.listdir(self.dir_objetos):
+            if not nome.endswith('.json') or nome[:-5] in referenciados:
+                continue
+            caminho = os.path.join(self.dir_objetos, nome)
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+armazem_snapshots = ArmazemSnapshots()
+
+# ✅ NOVO: Contador de janela deslizante reutilizável (flood, rate limit)
+class ContadorJanelaDeslizante:
+    """Conta eventos por chave dentro de uma janela de tempo.
+
+    Cada chave guarda um deque de timestamps monotônicos; registrar é O(1)
+    amortizado (só descarta do início) e chaves ociosas são removidas
+    periodicamente para a memória não crescer com cada usuário visto.
+    """
+
+    def __init__(self, janela_segundos, intervalo_limpeza=60):
+        self.janela = janela_segundos
+        self.intervalo_limpeza = intervalo_limpeza
+        self.eventos = {}
+        self.ultima_limpeza = time.monotonic()
+
+    def _descartar_antigos(self, fila, agora):
+        limite = agora - self.janela
+        while fila and fila[0] <= limite:
+            fila.popleft()
+
+    def registrar(self, chave, agora=None):
+        """Registra um evento e retorna quantos existem na janela"""
+        agora = time.monotonic() if agora is None else agora
+        fila = self.eventos.get(chave)
+        if fila is None:
+            fila = self.eventos[chave] = deque()
+        fila.append(agora)
+        self._descartar_antigos(fila, agora)
+        
+        if agora - self.ultima_limpeza >= self.intervalo_limpeza:
+            self.limpar_ociosos(agora)
+        
+        return len(fila)
+
+    def contar(self, chave, agora=None):
+        """Quantos eventos a chave tem na janela atual"""
+        fila = self.eventos.get(chave)
+        if not fila:
+            return 0
+        self._descartar_antigos(fila, time.monotonic() if agora is None else agora)
+        return len(fila)
+
+    def limpar_ociosos(self, agora=None):
+        """Remove chaves sem eventos dentro da janela"""
+        agora = time.monotonic() if agora is None else agora
+        limite = agora - self.janela
+        ociosas = [chave for chave, fila in self.eventos.items() if not fila or fila[-1] <= limite]
+        for chave in ociosas:
+            del self.eventos[chave]
+        self.ultima_limpeza = agora
+
+    def __len__(self):
+        return len(self.eventos)
+
+# ✅ NOVO: Correlacionador de audit log (evita audit_logs() a cada evento)
+class CorrelacionadorAuditoria:
+    """Guarda as entradas recentes do audit log recebidas pelo gateway.
+
+    on_audit_log_entry_create alimenta um índice (guild, ação, alvo) com TTL;
+    os handlers aguardam a entrada com timeout em vez de consultar a API.
+    Só quando a entrada não chega é feita uma consulta REST, compartilhada
+    entre todos os handlers esperando a mesma (guild, ação).
+    Entradas anteriores ao evento (um kick antigo do mesmo membro, por
+    exemplo) nunca são aceitas.
+    """
+
+    def __init__(self, ttl=30, max_entradas=5000, timeout=3.0, tolerancia=5.0):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.timeout = timeout
+        self.tolerancia = tolerancia    # atraso aceito entre o evento e o handler
+        self.entradas = OrderedDict()   # (guild_id, ação, alvo_id) -> (recebida, entry)
+        self.aguardando = {}            # (guild_id, ação, alvo_id) -> [(future, desde)]
+        self.buscas_rest = {}           # (guild_id, ação) -> task
+        self.estatisticas = {'gateway': 0, 'cache': 0, 'rest': 0, 'nao_encontrado': 0}
+
+    def _limpar_expiradas(self):
+        limite = time.monotonic() - self.ttl
+        while self.entradas:
+            recebida, _ = next(iter(self.entradas.values()))
+            if recebida > limite and len(self.entradas) <= self.max_entradas:
+                break
+            self.entradas.popitem(last=False)
+
+    def registrar(self, entry):
+        """Indexa a entrada e acorda os handlers esperando por ela"""
+        alvo_id = getattr(entry.target, 'id', None)
+        if alvo_id is None:
+            return
+        
+        # O gateway pode mandar a entrada sem o autor em cache
+        if entry.user is None and getattr(entry, 'user_id', None):
+            entry.user = entry.guild.get_member(entry.user_id) or bot.get_user(entry.user_id)
+        
+        chave = (entry.guild.id, entry.action, alvo_id)
+        self.entradas.pop(chave, None)
+        self.entradas[chave] = (time.monotonic(), entry)
+        self._limpar_expiradas()
+        
+        # Só acorda quem espera por uma entrada a partir daquele momento
+        restantes = []
+        for future, desde in self.aguardando.pop(chave, []):
+            if future.done():
+                continue
+            if entry.created_at >= desde:
+                future.set_result(entry)
+            else:
+                restantes.append((future, desde))
+        if restantes:
+            self.aguardando[chave] = restantes
+
+    def obter_recente(self, guild, acao, alvo_id, desde=None):
+        item = self.entradas.get((guild.id, acao, alvo_id))
+        if item and time.monotonic() - item[0] <= self.ttl:
+            if desde is None or item[1].created_at >= desde:
+                return item[1]
+        return None
+
+    async def aguardar_entrada(self, guild, acao, alvo_id, timeout=None, desde=None, rest=True):
+        """Retorna a entrada do audit log da ação (ou None se não encontrar)
+
+        desde: horário do evento (padrão: agora menos a tolerância); entradas
+        mais antigas são ignoradas. rest=False pula o fallback REST, para
+        eventos que muitas vezes não geram entrada (saídas voluntárias).
+        """
+        if desde is None:
+            desde = discord.utils.utcnow() - timedelta(seconds=self.tolerancia)
+        
+        entry = self.obter_recente(guild, acao, alvo_id, desde)
+        if entry:
+            self.estatisticas['cache'] += 1
+            return await self._garantir_autor(entry)
+        
+        chave = (guild.id, acao, alvo_id)
+        future = asyncio.get_running_loop().create_future()
+        self.aguardando.setdefault(chave, []).append((future, desde))
+        
+        try:
+            entry = await asyncio.wait_for(future, timeout=timeout or self.timeout)
+            self.estatisticas['gateway'] += 1
+            return await self._garantir_autor(entry)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            pendentes = self.aguardando.get(chave)
+            if pendentes:
+                pendentes[:] = [item for item in pendentes if item[0] is not future]
+                if not pendentes:
+                    del self.aguardando[chave]
+        
+        if not rest:
+            self.estatisticas['nao_encontrado'] += 1
+            return None
+        
+        # Fallback REST (uma única busca por guild/ação)
+        await self._buscar_rest(guild, acao)
+        entry = self.obter_recente(guild, acao, alvo_id, desde)
+        if entry:
+            self.estatisticas['rest'] += 1
+            return await self._garantir_autor(entry)
+        
+        self.estatisticas['nao_encontrado'] += 1
+        return None
+
+    async def listar_por_autor(self, guild, acao, autor_id):
+        """Entradas recentes de uma ação feitas por um usuário"""
+        def filtrar():
+            limite = time.monotonic() - self.ttl
+            encontradas = []
+            for (guild_id, acao_entry, _), (recebida, entry) in self.entradas.items():
+                if guild_id != guild.id or acao_entry != acao or recebida <= limite:
+                    continue
+                autor = getattr(entry, 'user_id', None) or (entry.user.id if entry.user else None)
+                if autor == autor_id:
+                    encontradas.append(entry)
+            return encontradas
+        
+        encontradas = filtrar()
+        if not encontradas:
+            await self._buscar_rest(guild, acao, limite=10)
+            encontradas = filtrar()
+        return encontradas
+
+    async def _buscar_rest(self, guild, acao, limite=5):
+        chave = (guild.id, acao)
+        task = self.buscas_rest.get(chave)
+        
+        if not task or task.done():
+            async def buscar():
+                try:
+                    entradas = [entry async for entry in guild.audit_logs(limit=limite, action=acao)]
+                    # Mais antigas primeiro para a mais recente ficar no índice
+                    for entry in reversed(entradas):
+                        self.registrar(entry)
+                except Exception as e:
+                    print(f"❌ Erro ao consultar audit log: {e}")
+                finally:
+                    self.buscas_rest.pop(chave, None)
+            
+            task = asyncio.create_task(buscar())
+            self.buscas_rest[chave] = task
+        
+        await asyncio.shield(task)
+
+    async def _garantir_autor(self, entry):
+        if entry.user is None and getattr(entry, 'user_id', None):
+            try:
+                entry.user = await bot.fetch_user(entry.user_id)
+            except:
+                return None
+        return entry if entry.user else None
+
+correlacionador_auditoria = CorrelacionadorAuditoria()
+
+# ✅ NOVO: Agendador persistente (mutes, lembretes, sorteios, enquetes, quarentenas)
+class AgendadorPersistente:
+    """Um único agendador para todos os timers do bot.
+
+    Os agendamentos ficam na tabela agendamentos do data.db e num heap em
+    memória ordenado pelo horário de execução (inserir e disparar em
+    O(log n)). Uma só task dorme até o próximo vencimento, então timers
+    pendentes não custam tasks ociosas. No setup_hook tudo é recarregado e o
+    que venceu com o bot desligado dispara assim que ele fica pronto. O
+    registro só sai do banco quando o handler termina sem erro; se ele
+    falhar, o agendamento é refeito com backoff exponencial. As gravações no
+    SQLite são write-behind: ficam num lote por id e uma task as escreve no
+    executor, fora do loop.
+    """
+
+    def __init__(self, backoff_base=30, backoff_max=3600, max_tentativas=10):
+        self.heap = []  # (executar_em, sequencia, id)
+        self.agendamentos = {}  # id -> (tipo, executar_em, dados)
+        self.handlers = {}  # tipo -> corrotina(dados)
+        self.tentativas = {}  # id -> falhas seguidas
+        self.disparos = set()  # Referências das tasks em execução
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_tentativas = max_tentativas
+        self.sequencia = 0
+        self.evento = None
+        self.task = None
+        self.escritas = {}  # id -> (tipo, executar_em, dados_json) ou None para apagar
+        self.task_escrita = None
+        self.stats = {'disparados': 0, 'falhas': 0, 'reagendados': 0}
+        self.criar_tabela()
+
+    def criar_tabela(self):
+        with db.lock_conexao:
+            with db.conexao:
+                db.conexao.execute("""
+                    CREATE TABLE IF NOT EXISTS agendamentos (
+                        id TEXT PRIMARY KEY,
+                        tipo TEXT NOT NULL,
+                        executar_em REAL NOT NULL,
+                        dados TEXT NOT NULL
+                    )
+                """)
+
+    def tarefa(self, tipo):
+        """Decorador que registra o handler de um tipo de agendamento"""
+        def registrar(funcao):
+            self.handlers[tipo] = funcao
+            return funcao
+        return registrar
+
+    def _empilhar(self, agendamento_id, executar_em):
+        self.sequencia += 1
+        heapq.heappush(self.heap, (executar_em, self.sequencia, agendamento_id))
+        # Acordar o loop se o novo timer for o próximo a vencer
+        if self.evento and self.heap[0][2] == agendamento_id:
+            self.evento.set()
+
+    def _gravar(self, agendamento_id, tipo, executar_em, dados):
+        self.escritas[agendamento_id] = (tipo, executar_em, json.dumps(dados))
+        self._agendar_escrita()
+
+    def _apagar(self, agendamento_id):
+        self.escritas[agendamento_id] = None
+        self._agendar_escrita()
+
+    def _agendar_escrita(self):
+        """Dispara a task de escrita; sem loop rodando (import/encerramento) grava direto"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.gravar_pendencias()
+            return
+        if not self.task_escrita or self.task_escrita.done():
+            self.task_escrita = asyncio.create_task(self._descarregar())
+
+    def _escrever(self, lote):
+        """Aplica um lote numa única transação (roda no executor)"""
+        gravar = [(agendamento_id, *linha) for agendamento_id, linha in lote.items() if linha is not None]
+        apagar = [(agendamento_id,) for agendamento_id, linha in lote.items() if linha is None]
+        with db.lock_conexao:
+            with db.conexao:
+                if apagar:
+                    db.conexao.executemany("DELETE FROM agendamentos WHERE id = ?", apagar)
+                if gravar:
+                    db.conexao.executemany(
+                        "INSERT OR REPLACE INTO agendamentos (id, tipo, executar_em, dados) VALUES (?, ?, ?, ?)",
+                        gravar
+                    )
+
+    async def _descarregar(self):
+        """Uma task por vez, então os lotes chegam ao banco na ordem em que foram pedidos"""
+        loop = asyncio.get_running_loop()
+        while self.escritas:
+            lote, self.escritas = self.escritas, {}
+            try:
+                await loop.run_in_executor(None, self._escrever, lote)
+            except Exception as e:
+                print(f"❌ Erro ao gravar agendamentos: {e}")
+                # Devolve o lote sem passar por cima do que mudou enquanto isso
+                for agendamento_id, linha in lote.items():
+                    self.escritas.setdefault(agendamento_id, linha)
+                return
+
+    def gravar_pendencias(self):
+        """Gravação síncrona do que estiver pendente"""
+        lote, self.escritas = self.escritas, {}
+        if lote:
+            self._escrever(lote)
+
+    async def fechar(self):
+        """Espera a escrita em andamento e grava o restante"""
+        if self.task_escrita and not self.task_escrita.done():
+            await self.task_escrita
+        self.gravar_pendencias()
+
+    def agendar(self, tipo, segundos, dados, agendamento_id=None):
+        """Agenda `tipo` para daqui a `segundos`; o mesmo id substitui o anterior"""
+        agendamento_id = agendamento_id or f"{tipo}:{time.time()}:{self.sequencia}"
+        executar_em = time.time() + segundos
+        self.agendamentos[agendamento_id] = (tipo, executar_em, dados)
+        self._gravar(agendamento_id, tipo, executar_em, dados)
+        self._empilhar(agendamento_id, executar_em)
+        return agendamento_id
+
+    def cancelar(self, agendamento_id):
+        """Cancela o agendamento (a entrada no heap é descartada ao vencer)"""
+        self.tentativas.pop(agendamento_id, None)
+        if self.agendamentos.pop(agendamento_id, None) is None:
+            return False
+        self._apagar(agendamento_id)
+        return True
+
+    def pendentes(self, tipo=None):
+        return len([1 for t, _, _ in self.agendamentos.values() if tipo is None or t == tipo])
+
+    def migrar_lembretes_legados(self):
+        """Traz os lembretes de anúncio do formato antigo (db.lembretes_anuncios)"""
+        legado = list(dict.items(db.lembretes_anuncios))
+        for lembrete_id, dados in legado:
+            segundos = (datetime.fromisoformat(dados['executar_em']) - datetime.now()).total_seconds()
+            self.agendar('lembrete_anuncio', max(segundos, 0), {
+                'canal_id': dados['canal_id'], 'mensagem': dados['mensagem']
+            }, f"lembrete_anuncio:{lembrete_id}")
+            del db.lembretes_anuncios[lembrete_id]
+        if legado:
+            db.salvar_dados()
+            print(f"✅ {len(legado)} lembretes de anúncio migrados para o agendador")
+
+    def iniciar(self):
+        if self.task and not self.task.done():
+            return
+        with db.lock_conexao:
+            linhas = db.conexao.execute("SELECT id, tipo, executar_em, dados FROM agendamentos").fetchall()
+        for agendamento_id, tipo, executar_em, dados in linhas:
+            if agendamento_id in self.agendamentos:
+                continue  # Agendado nesta execução antes de iniciar
+            self.agendamentos[agendamento_id] = (tipo, executar_em, json.loads(dados))
+            self.sequencia += 1
+            self.heap.append((executar_em, self.sequencia, agendamento_id))
+        heapq.heapify(self.heap)
+        self.migrar_lembretes_legados()
+        self.evento = asyncio.Event()
+        self.task = asyncio.create_task(self._loop())
+        if linhas:
+            print(f"⏰ {len(linhas)} agendamentos restaurados")
+
+    async def _loop(self):
+        await bot.wait_until_ready()
+        while True:
+            self.evento.clear()
+            espera = None
+            while self.heap:
+                executar_em, _, agendamento_id = self.heap[0]
+                atual = self.agendamentos.get(agendamento_id)
+                if atual is None or atual[1] != executar_em:
+                    heapq.heappop(self.heap)  # Cancelado ou reagendado
+                    continue
+                espera = executar_em - time.time()
+                if espera > 0:
+                    break
+                heapq.heappop(self.heap)
+                task = asyncio.create_task(self._disparar(agendamento_id, atual))
+                self.disparos.add(task)
+                task.add_done_callback(self.disparos.discard)
+                espera = None
+
+            try:
+                await asyncio.wait_for(self.evento.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _disparar(self, agendamento_id, agendamento):
+        tipo, _, dados = agendamento
+        handler = self.handlers.get(tipo)
+        try:
+            if handler:
+                await handler(dados)
+                self.stats['disparados'] += 1
+            else:
+                print(f"⚠️ Agendamento sem handler: {tipo}")
+        except Exception as e:
+            self.stats['falhas'] += 1
+            print(f"❌ Erro no agendamento {agendamento_id}: {e}")
+            # Só reagenda se não foi substituído/cancelado enquanto rodava
+            if self.agendamentos.get(agendamento_id) is agendamento:
+                self._reagendar(agendamento_id, tipo, dados)
+            return
+        
+        self.tentativas.pop(agendamento_id, None)
+        if self.agendamentos.get(agendamento_id) is agendamento:
+            self.cancelar(agendamento_id)
+
+    def _reagendar(self, agendamento_id, tipo, dados):
+        tentativas = self.tentativas.get(agendamento_id, 0) + 1
+        if tentativas > self.max_tentativas:
+            print(f"❌ Agendamento {agendamento_id} descartado após {self.max_tentativas} tentativas")
+            self.tentativas.pop(agendamento_id, None)
+            self.cancelar(agendamento_id)
+            return
+        
+        self.tentativas[agendamento_id] = tentativas
+        atraso = min(self.backoff_base * 2 ** (tentativas - 1), self.backoff_max)
+        self.agendar(tipo, atraso, dados, agendamento_id)
+        self.stats['reagendados'] += 1
+        print(f"🔁 Agendamento {agendamento_id} reagendado em {atraso}s (tentativa {tentativas})")
+
+agendador = AgendadorPersistente()
+
 # SISTEMA DE SEGURANÇA MULTIFACETADO (SSM) - CORRIGIDO
 class SistemaSegurancaMultifacetado:
     def __init__(self, bot):
@@ -183,6 +1042,7 @@ class SistemaSegurancaMultifacetado:
         self.whitelist_bots = set()
         self.quarentena_usuarios = {}
         self.rate_limit_actions = {}
+        self.contador_flood = ContadorJanelaDeslizante(10)  # mensagens por (usuário, canal)
         self.cargo_quarentena = None
         self.contador_acoes_bot = {}
         self.auto_destruicao_ativa = False
@@ -199,8 +1059,13 @@ class SistemaSegurancaMultifacetado:
     # ✅ CORREÇÃO: Adicionar método de inicialização assíncrona
     async def setup(self):
         """Inicialização assíncrona para criar tasks"""
-        # Iniciar loop de limpeza automática
-        self.bot.loop.create_task(self.loop_auto_liberacao())
+        # ✅ NOVO: Liberação automática via agendador (uma entrada por quarentena)
+        for user_id, dados in self.quarentena_usuarios.items():
+            agendamento_id = self._id_agendamento(user_id, dados.get("guild_id"))
+            if agendamento_id not in agendador.agendamentos:
+                segundos = (datetime.fromisoformat(dados["tempo_fim"]) - datetime.now()).total_seconds()
+                agendador.agendar('quarentena', max(segundos, 0),
+                                  {'user_id': user_id, 'guild_id': dados.get("guild_id")}, agendamento_id)
         self.bot.loop.create_task(self.monitorar_uso_bot())
         print("🛡️ Sistema de Segurança Multifacetado Ativado!")
 
@@ -280,9 +1145,13 @@ class SistemaSegurancaMultifacetado:
         self.quarentena_usuarios[str(member.id)] = {
             "tempo_fim": tempo_fim.isoformat(),
             "motivo": motivo,
-            "cargos_anteriores": [role.id for role in cargos_anteriores]
+            "cargos_anteriores": [role.id for role in cargos_anteriores],
+            "guild_id": member.guild.id
         }
         self.salvar_dados_seguranca()
+        agendador.agendar('quarentena', duracao_minutos * 60,
+                          {'user_id': str(member.id), 'guild_id': member.guild.id},
+                          self._id_agendamento(member.id, member.guild.id))
         
         # Log da ação
         await log_system.log_moderacao("QUARENTENA", self.bot.user, member, 
@@ -313,6 +1182,7 @@ class SistemaSegurancaMultifacetado:
                 
                 del self.quarentena_usuarios[user_id]
                 self.salvar_dados_seguranca()
+                agendador.cancelar(self._id_agendamento(user_id, dados.get("guild_id")))
                 
                 await log_system.log_moderacao("QUARENTENA REMOVIDA", self.bot.user, member, 
                                              "Quarentena expirada/removida")
@@ -323,32 +1193,25 @@ class SistemaSegurancaMultifacetado:
         
         return False
 
-    async def loop_auto_liberacao(self):
-        """Loop para liberação automática da quarentena"""
-        await self.bot.wait_until_ready()
-        
-        while not self.bot.is_closed():
-            try:
-                agora = datetime.now()
-                usuarios_remover = []
-                
-                for user_id, dados in self.quarentena_usuarios.items():
-                    tempo_fim = datetime.fromisoformat(dados["tempo_fim"])
-                    if agora >= tempo_fim:
-                        usuarios_remover.append(user_id)
-                
-                for user_id in usuarios_remover:
-                    for guild in self.bot.guilds:
-                        member = guild.get_member(int(user_id))
-                        if member:
-                            await self.remover_quarentena(member)
-                            break
-                
-                await asyncio.sleep(60)  # Verificar a cada minuto
-                
-            except Exception as e:
-                print(f"Erro no loop de liberação: {e}")
-                await asyncio.sleep(60)
+    @staticmethod
+    def _id_agendamento(user_id, guild_id):
+        return f"quarentena:{guild_id or '*'}:{user_id}"
+
+    async def liberar_quarentena_agendada(self, dados):
+        """Handler do agendador: libera a quarentena vencida"""
+        if dados['user_id'] not in self.quarentena_usuarios:
+            return
+        guild = self.bot.get_guild(dados['guild_id']) if dados.get('guild_id') else None
+        # Quarentenas antigas não guardavam o servidor
+        guilds = [guild] if guild else self.bot.guilds
+        for guild in guilds:
+            member = guild.get_member(int(dados['user_id']))
+            if member:
+                if not await self.remover_quarentena(member):
+                    raise RuntimeError(f"falha ao remover a quarentena de {member}")
+                return
+        # Membro fora do cache (ou servidor indisponível): o agendador tenta de novo
+        raise RuntimeError(f"membro {dados['user_id']} não encontrado para liberar a quarentena")
 
     async def verificar_bot_entrada(self, member):
         """Verifica se um bot que entrou está na whitelist - CORRIGIDO"""
@@ -406,18 +1269,20 @@ class SistemaSegurancaMultifacetado:
                 return
                 
             # Reverter canais criados recentemente
-            async for entry in guild.audit_logs(limit=10, action=discord.AuditLogAction.channel_create):
-                if entry.user.id == author.id:
+            for entry in await correlacionador_auditoria.listar_por_autor(guild, discord.AuditLogAction.channel_create, author.id):
+                canal = guild.get_channel(entry.target.id)
+                if canal:
                     try:
-                        await entry.target.delete()
+                        await canal.delete()
                     except:
                         continue
             
             # Reverter cargos criados recentemente
-            async for entry in guild.audit_logs(limit=10, action=discord.AuditLogAction.role_create):
-                if entry.user.id == author.id:
+            for entry in await correlacionador_auditoria.listar_por_autor(guild, discord.AuditLogAction.role_create, author.id):
+                cargo = guild.get_role(entry.target.id)
+                if cargo:
                     try:
-                        await entry.target.delete()
+                        await cargo.delete()
                     except:
                         continue
         except:
@@ -429,33 +1294,11 @@ class SistemaSegurancaMultifacetado:
         if message.author.bot and message.author.id in self.whitelist_bots:
             return False
             
-        user_id = str(message.author.id)
-        
-        if user_id not in self.rate_limit_actions:
-            self.rate_limit_actions[user_id] = []
-        
-        # Registrar mensagem
-        self.rate_limit_actions[user_id].append({
-            "acao": "message_send",
-            "timestamp": datetime.now().isoformat(),
-            "channel_id": message.channel.id
-        })
-        
-        # Manter apenas ações dos últimos 10 segundos (aumentado)
-        agora = datetime.now()
-        self.rate_limit_actions[user_id] = [
-            a for a in self.rate_limit_actions[user_id]
-            if (agora - datetime.fromisoformat(a["timestamp"])).total_seconds() <= 10
-        ]
-        
-        # ✅ CORREÇÃO: LIMITES MAIS FLEXÍVEIS
-        mensagens_no_canal = [
-            a for a in self.rate_limit_actions[user_id] 
-            if a.get('channel_id') == message.channel.id and a['acao'] == 'message_send'
-        ]
+        # ✅ CORREÇÃO: Janela deslizante de 10 segundos por (usuário, canal)
+        mensagens_no_canal = self.contador_flood.registrar((message.author.id, message.channel.id))
         
         # ✅ CORREÇÃO: APENAS AVISAR, NÃO DELETAR
-        if len(mensagens_no_canal) >= 10:  # 10 mensagens em 10 segundos
+        if mensagens_no_canal >= 10:  # 10 mensagens em 10 segundos
             try:
                 await message.channel.send(
                     f"{message.author.mention} 🚨 **Detectado flood de mensagens!** Diminua a velocidade.",
@@ -466,7 +1309,7 @@ class SistemaSegurancaMultifacetado:
                 pass
         
         # ✅ CORREÇÃO: QUARENTENA APENAS EM CASOS EXTREMOS
-        if len(mensagens_no_canal) >= 15:  # 15 mensagens em 10 segundos
+        if mensagens_no_canal >= 15:  # 15 mensagens em 10 segundos
             await self.colocar_quarentena(message.author, 2, "Flood extremo de mensagens")
             
         return False  # ✅ SEMPRE RETORNA FALSE PARA NÃO BLOQUEAR MENSAGENS
@@ -594,11 +1437,9 @@ class SistemaTickets:
     
     async def setup_canal_tickets(self, guild):
         """Configura o canal de tickets automático"""
-        canal_id = CONFIG['canais_automaticos'].get('tickets')
-        if canal_id:
-            canal = guild.get_channel(canal_id)
-            if canal:
-                return canal
+        canal = canais_servidor.obter(guild, 'tickets')
+        if canal:
+            return canal
         
         # Criar canal se não existir
         canal = await guild.create_text_channel("🎫・abra-seu-ticket")
@@ -611,9 +1452,7 @@ class SistemaTickets:
         await canal.edit(overwrites=overwrites)
         
         # Salvar configuração
-        CONFIG['canais_automaticos']['tickets'] = canal.id
-        db.config_canais['canais_automaticos'] = CONFIG['canais_automaticos']
-        db.salvar_dados()
+        canais_servidor.definir(guild, 'tickets', canal.id)
         
         # Enviar mensagem de boas-vindas
         embed = discord.Embed(
@@ -688,13 +1527,30 @@ class SistemaTickets:
                 break
         
         if ticket_id:
-            embed = discord.Embed(
-                title="🎫 TICKET FECHADO",
-                description=f"Ticket fechado por {member.mention}",
-                color=0xff0000,
-                timestamp=datetime.now()
-            )
-            await channel.send(embed=embed)
+            dados = self.tickets_ativos[ticket_id]
+            # Um novo !close depois de falha retoma a exportação sem repetir o aviso
+            if not dados.get("fechamento_anunciado"):
+                embed = discord.Embed(
+                    title="🎫 TICKET FECHADO",
+                    description=f"Ticket fechado por {member.mention}",
+                    color=0xff0000,
+                    timestamp=datetime.now()
+                )
+                await channel.send(embed=embed)
+                dados["fechamento_anunciado"] = True
+            
+            # ✅ NOVO: Salvar transcrição antes de apagar o canal
+            # (se falhar, o canal fica e um novo !close continua a exportação)
+            resultado = await exportador_transcricoes.exportar(channel, 'html', titulo=f"Ticket #{ticket_id}")
+            canal_mod = await log_system.get_log_channel(channel.guild, "moderacao")
+            if canal_mod:
+                await exportador_transcricoes.enviar(
+                    canal_mod, resultado,
+                    f"🧾 **Transcrição do Ticket #{ticket_id}**\n"
+                    f"**Aberto por:** <@{dados['member_id']}> | **Fechado por:** {member.mention}\n"
+                    f"**Mensagens:** {resultado['total']}",
+                    channel.guild.filesize_limit
+                )
             
             # Agendar deleção do canal
             await asyncio.sleep(5)
@@ -724,6 +1580,53 @@ class SistemaTickets:
             await canal_mod.send(embed=embed)
 
 # SISTEMA DE DETECÇÃO PROATIVA AVANÇADA - CORRIGIDO
+# ✅ NOVO: Matcher de palavras pré-compilado (uma única passada por mensagem)
+class MatcherPalavras:
+    """Encontra todas as palavras de um conjunto contidas num texto.
+
+    As palavras viram uma trie convertida numa única regex com lookahead, então
+    o texto é percorrido uma vez só (em C) em vez de um `in` por palavra.
+    Cada posição devolve a palavra mais longa que começa ali; as palavras
+    contidas nela (ex: 'destroy' em 'destroyall') vêm de um mapa
+    pré-calculado, mantendo o mesmo resultado do `palavra in conteudo`.
+    """
+
+    def __init__(self, palavras):
+        self.palavras = frozenset(p for p in palavras if p)
+        self.contidas = {
+            palavra: [outra for outra in self.palavras if outra in palavra]
+            for palavra in self.palavras
+        }
+        self.regex = re.compile('(?=(' + self._montar_trie(self.palavras) + '))') if self.palavras else None
+
+    @staticmethod
+    def _montar_trie(palavras):
+        trie = {}
+        for palavra in palavras:
+            no = trie
+            for letra in palavra:
+                no = no.setdefault(letra, {})
+            no[''] = True
+        
+        def montar(no):
+            fim = '' in no
+            ramos = [re.escape(letra) + montar(no[letra]) for letra in sorted(k for k in no if k)]
+            if not ramos:
+                return ''
+            corpo = ramos[0] if len(ramos) == 1 else '(?:' + '|'.join(ramos) + ')'
+            return '(?:' + corpo + ')?' if fim else corpo
+        
+        return montar(trie)
+
+    def buscar(self, texto):
+        """Retorna a lista de palavras encontradas no texto"""
+        if not self.regex:
+            return []
+        encontradas = set()
+        for match in self.regex.finditer(texto):
+            encontradas.update(self.contidas[match.group(1)])
+        return list(encontradas)
+
 class SistemaDeteccaoAvancada:
     def __init__(self, bot):
         self.bot = bot
@@ -779,6 +1682,12 @@ class SistemaDeteccaoAvancada:
             'tokens': r'[a-zA-Z0-9]{24}\.[a-zA-Z0-9]{6}\.[a-zA-Z0-9]{27}'
         }
         
+        # ✅ NOVO: Matchers compilados uma vez (refeitos só se as listas mudarem)
+        self.matcher_palavras = None
+        self.padroes_compilados = []
+        self.assinatura_listas = None
+        self.compilar_detectores()
+        
         print("🛡️ Sistema de Detecção Proativa Ativado - Sempre Vigilante!")
 
     async def detectar_painel_suspeito(self, message):
@@ -789,17 +1698,17 @@ class SistemaDeteccaoAvancada:
             
         conteudo = message.content.lower()
         
-        # Verificar palavras maliciosas
-        palavras_encontradas = []
-        for palavra in self.palavras_maliciosas:
-            if palavra in conteudo:
-                palavras_encontradas.append(palavra)
+        if self.assinatura_listas != self.gerar_assinatura_listas():
+            self.compilar_detectores()
+        
+        # Verificar palavras maliciosas (uma passada só)
+        palavras_encontradas = self.matcher_palavras.buscar(conteudo)
         
         # Verificar padrões suspeitos
-        padroes_encontrados = []
-        for nome, padrao in self.padroes_suspeitos.items():
-            if re.search(padrao, conteudo, re.IGNORECASE):
-                padroes_encontrados.append(nome)
+        padroes_encontrados = [
+            nome for nome, padrao in self.padroes_compilados
+            if self.buscar_padrao(nome, padrao, conteudo)
+        ]
         
         # Se encontrou indícios suspeitos
         if palavras_encontradas or padroes_encontrados:
@@ -820,6 +1729,40 @@ class SistemaDeteccaoAvancada:
             
         return False
 
+    def gerar_assinatura_listas(self):
+        """Identifica o estado atual das listas para saber quando recompilar"""
+        return (
+            id(self.palavras_maliciosas), len(self.palavras_maliciosas),
+            id(self.padroes_suspeitos), tuple(self.padroes_suspeitos.items())
+        )
+
+    def compilar_detectores(self):
+        """(Re)compila o matcher de palavras e as regex de padrões"""
+        self.matcher_palavras = MatcherPalavras(self.palavras_maliciosas)
+        self.padroes_compilados = [
+            (nome, re.compile(padrao, re.IGNORECASE))
+            for nome, padrao in self.padroes_suspeitos.items()
+        ]
+        self.assinatura_listas = self.gerar_assinatura_listas()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def regex_repeticao(tamanho_maximo):
+        """spam_caracteres com o tamanho da unidade repetida limitado"""
+        return re.compile(r'(.{2,%d}?)\1{5,}' % tamanho_maximo, re.IGNORECASE)
+
+    def buscar_padrao(self, nome, padrao, conteudo):
+        """Executa um padrão compilado no conteúdo"""
+        if nome == 'spam_caracteres' and padrao.pattern == r'(.{2,}?)\1{5,}':
+            # A unidade repetida 6+ vezes nunca passa de len/6 caracteres;
+            # limitar o quantificador dá o mesmo resultado sem testar
+            # unidades impossíveis (a regex original é quadrática)
+            if len(conteudo) < 12:
+                return False
+            limite = -(-(len(conteudo) // 6) // 32) * 32
+            return self.regex_repeticao(limite).search(conteudo) is not None
+        return padrao.search(conteudo) is not None
+
     async def detectar_ataque_em_andamento(self, guild, author, acao):
         """Detecta se um ataque está em andamento baseado em padrões - CORRIGIDO"""
         # ✅ CORREÇÃO: Ignorar bots da whitelist
@@ -995,27 +1938,144 @@ class SistemaDeteccaoAvancada:
         """Monitora criação de canais suspeitos - CORRIGIDO"""
         if not self.modo_emergencia:
             # Verificar se é criação suspeita
-            async for entry in channel.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_create):
-                if entry.target.id == channel.id:
-                    autor = entry.user
+            entry = await correlacionador_auditoria.aguardar_entrada(channel.guild, discord.AuditLogAction.channel_create, channel.id)
+            if entry:
+                autor = entry.user
                     
-                    # ✅ CORREÇÃO: Ignorar bots da whitelist
-                    if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
-                        return False
+                # ✅ CORREÇÃO: Ignorar bots da whitelist
+                if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
+                    return False
                         
-                    # Verificar se é bot ou usuário suspeito
-                    if autor.bot or await self.detectar_ataque_em_andamento(channel.guild, autor, "channel_create"):
-                        await self.ativar_protecao_emergencial(channel.guild, autor, "CRIACAO_CANAL_SUSPEITA")
-                        return True
-                    break
+                # Verificar se é bot ou usuário suspeito
+                if autor.bot or await self.detectar_ataque_em_andamento(channel.guild, autor, "channel_create"):
+                    await self.ativar_protecao_emergencial(channel.guild, autor, "CRIACAO_CANAL_SUSPEITA")
+                    return True
         return False
 
 # Inicializar sistemas
 sistema_seguranca = SistemaSegurancaMultifacetado(bot)
+agendador.tarefa('quarentena')(sistema_seguranca.liberar_quarentena_agendada)
 sistema_tickets = SistemaTickets(bot)
 sistema_deteccao = SistemaDeteccaoAvancada(bot)
 
 # SISTEMA DE RATE LIMIT COMPLETO E CORRIGIDO
+# ✅ NOVO: Executor de ações em lote (punições, lockdown, sincronizações)
+class ExecutorAcoesLote:
+    """Executa muitas mutações do Discord com concorrência limitada por rota.
+
+    Cada ação é (bucket, descrição, fábrica) - a fábrica cria a corrotina, para
+    poder repetir. Cada bucket tem um limite de concorrência que sobe um a
+    cada lote de sucessos. Os 429 curtos são repetidos dentro do discord.py;
+    os longos (acima de LIMITE_ESPERA_RATELIMIT) chegam como discord.RateLimited
+    e aí o limite cai pela metade e o bucket pausa pelo retry_after.
+    O resultado vem num único dicionário.
+    """
+
+    def __init__(self, concorrencia_inicial=3, concorrencia_maxima=8, max_tentativas=3):
+        self.concorrencia_inicial = concorrencia_inicial
+        self.concorrencia_maxima = concorrencia_maxima
+        self.max_tentativas = max_tentativas
+        self.limites = {}  # bucket -> concorrência atual (aprendida entre execuções)
+
+    async def executar(self, acoes, progresso=None, intervalo_progresso=2.0):
+        """Executa as ações e retorna {'total', 'sucesso', 'falhas', 'rate_limits', 'duracao'}"""
+        resultado = {'total': len(acoes), 'sucesso': 0, 'falhas': [], 'rate_limits': 0, 'duracao': 0.0}
+        inicio = time.monotonic()
+        
+        por_bucket = {}
+        for acao in acoes:
+            por_bucket.setdefault(acao[0], deque()).append(acao)
+        
+        estado_progresso = {'concluidas': 0, 'ultimo': 0.0}
+        
+        async def notificar(forcar=False):
+            if not progresso:
+                return
+            agora = time.monotonic()
+            if forcar or agora - estado_progresso['ultimo'] >= intervalo_progresso:
+                estado_progresso['ultimo'] = agora
+                try:
+                    await progresso(estado_progresso['concluidas'], resultado['total'])
+                except:
+                    pass
+        
+        async def processar_bucket(bucket, fila):
+            self.limites.setdefault(bucket, self.concorrencia_inicial)
+            estado = {'ativos': 0, 'pausa_ate': 0.0, 'sucessos_seguidos': 0}
+            condicao = asyncio.Condition()
+            
+            async def trabalhador():
+                while fila:
+                    async with condicao:
+                        await condicao.wait_for(lambda: estado['ativos'] < self.limites[bucket])
+                        if not fila:
+                            return
+                        _, descricao, fabrica = fila.popleft()
+                        estado['ativos'] += 1
+                    
+                    try:
+                        erro = await self._executar_acao(bucket, fabrica, estado, resultado)
+                    finally:
+                        async with condicao:
+                            estado['ativos'] -= 1
+                            condicao.notify_all()
+                    
+                    if erro is None:
+                        resultado['sucesso'] += 1
+                    else:
+                        resultado['falhas'].append((descricao, erro))
+                    estado_progresso['concluidas'] += 1
+                    await notificar()
+            
+            trabalhadores = min(self.concorrencia_maxima, len(fila))
+            await asyncio.gather(*(trabalhador() for _ in range(trabalhadores)))
+        
+        await asyncio.gather(*(processar_bucket(bucket, fila) for bucket, fila in por_bucket.items()))
+        
+        resultado['duracao'] = time.monotonic() - inicio
+        await notificar(forcar=True)
+        return resultado
+
+    async def _executar_acao(self, bucket, fabrica, estado, resultado):
+        """Executa uma ação com retentativas; retorna None ou a mensagem de erro"""
+        for tentativa in range(self.max_tentativas):
+            espera = estado['pausa_ate'] - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            
+            try:
+                await fabrica()
+                estado['sucessos_seguidos'] += 1
+                if estado['sucessos_seguidos'] >= self.limites[bucket]:
+                    estado['sucessos_seguidos'] = 0
+                    self.limites[bucket] = min(self.concorrencia_maxima, self.limites[bucket] + 1)
+                return None
+            except (discord.Forbidden, discord.NotFound) as e:
+                return str(e)
+            except discord.RateLimited as e:
+                # Só chega aqui com max_ratelimit_timeout no client (ver LIMITE_ESPERA_RATELIMIT)
+                resultado['rate_limits'] += 1
+                retry_after = e.retry_after or 1.0
+                estado['pausa_ate'] = max(estado['pausa_ate'], time.monotonic() + retry_after)
+                estado['sucessos_seguidos'] = 0
+                self.limites[bucket] = max(1, self.limites[bucket] // 2)
+            except Exception as e:
+                status = getattr(e, 'status', None)
+                if status == 429:
+                    resultado['rate_limits'] += 1
+                    retry_after = getattr(e, 'retry_after', None) or 1.0
+                    estado['pausa_ate'] = max(estado['pausa_ate'], time.monotonic() + retry_after)
+                    estado['sucessos_seguidos'] = 0
+                    self.limites[bucket] = max(1, self.limites[bucket] // 2)
+                elif status and status >= 500:
+                    await asyncio.sleep(0.5 * (2 ** tentativa))
+                else:
+                    return str(e)
+        
+        return "Limite de tentativas excedido"
+
+executor_lote = ExecutorAcoesLote()
+
 class RateLimitSystem:
     def __init__(self):
         self.rate_limit_active = False
@@ -1035,6 +2095,8 @@ class RateLimitSystem:
         self.rate_limit_active = True
         self.rate_limit_token = self.generate_token()
         
+        acoes = []
+        
         # Salvar permissões originais dos canais de texto
         for channel in guild.text_channels:
             self.original_permissions[channel.id] = {
@@ -1042,15 +2104,7 @@ class RateLimitSystem:
                 'slowmode_delay': channel.slowmode_delay,
                 'send_messages': channel.overwrites_for(guild.default_role).send_messages
             }
-            
-            # Aplicar rate limit de 15s CORRETAMENTE
-            await channel.edit(slowmode_delay=15)
-            
-            # Remover permissão de enviar mensagens para @everyone
-            overwrites = channel.overwrites_for(guild.default_role)
-            overwrites.send_messages = False
-            overwrites.add_reactions = False
-            await channel.set_permissions(guild.default_role, overwrite=overwrites)
+            acoes.append(('canais', f"#{channel.name}", lambda c=channel: self.bloquear_canal(c, guild)))
         
         # Salvar e remover permissões de gerenciar canais/cargos de TODOS os cargos
         for role in guild.roles:
@@ -1076,10 +2130,12 @@ class RateLimitSystem:
                     manage_emojis=False,
                     manage_events=False
                 )
-                try:
-                    await role.edit(permissions=new_perms)
-                except:
-                    continue
+                acoes.append(('cargos', f"@{role.name}", lambda r=role, p=new_perms: r.edit(permissions=p)))
+        
+        # ✅ NOVO: Canais e cargos em paralelo, com limite por rota
+        resultado = await executor_lote.executar(acoes)
+        if resultado['falhas']:
+            print(f"⚠️ Rate limit: {len(resultado['falhas'])} falhas de {resultado['total']} ações")
         
         # ENVIAR TOKEN NO PRIVADO - CORREÇÃO APLICADA
         try:
@@ -1096,42 +2152,51 @@ class RateLimitSystem:
         
         return self.rate_limit_token
     
+    async def bloquear_canal(self, channel, guild):
+        """Aplica slowmode de 15s e tira o envio de mensagens do @everyone"""
+        await channel.edit(slowmode_delay=15)
+        
+        overwrites = channel.overwrites_for(guild.default_role)
+        overwrites.send_messages = False
+        overwrites.add_reactions = False
+        await channel.set_permissions(guild.default_role, overwrite=overwrites)
+    
+    async def restaurar_canal(self, channel, original_data):
+        """Restaura slowmode e permissões originais de um canal"""
+        await channel.edit(slowmode_delay=original_data['slowmode_delay'])
+        
+        for target, overwrite in original_data['overwrites'].items():
+            await channel.set_permissions(target, overwrite=overwrite)
+    
     async def deactivate_rate_limit(self, guild):
         """Desativa o sistema de rate limit e restaura tudo"""
         self.rate_limit_active = False
         
+        acoes = []
+        
         # Restaurar permissões dos canais
         for channel_id, original_data in self.original_permissions.items():
             channel = guild.get_channel(channel_id)
             if channel:
-                try:
-                    # Restaurar slowmode
-                    await channel.edit(slowmode_delay=original_data['slowmode_delay'])
-                    
-                    # Restaurar permissões
-                    for target, overwrite in original_data['overwrites'].items():
-                        await channel.set_permissions(target, overwrite=overwrite)
-                except:
-                    continue
+                acoes.append(('canais', f"#{channel.name}", lambda c=channel, d=original_data: self.restaurar_canal(c, d)))
         
         # Restaurar permissões dos cargos
         for role_id, original_perms in self.rate_limit_roles.items():
             role = guild.get_role(role_id)
             if role:
-                try:
-                    new_perms = role.permissions
-                    new_perms.update(
-                        manage_channels=original_perms['manage_channels'],
-                        manage_roles=original_perms['manage_roles'],
-                        administrator=original_perms['administrator'],
-                        manage_messages=original_perms['manage_messages'],
-                        manage_webhooks=original_perms['manage_webhooks'],
-                        manage_emojis=original_perms['manage_emojis'],
-                        manage_events=original_perms['manage_events']
-                    )
-                    await role.edit(permissions=new_perms)
-                except:
-                    continue
+                new_perms = role.permissions
+                new_perms.update(
+                    manage_channels=original_perms['manage_channels'],
+                    manage_roles=original_perms['manage_roles'],
+                    administrator=original_perms['administrator'],
+                    manage_messages=original_perms['manage_messages'],
+                    manage_webhooks=original_perms['manage_webhooks'],
+                    manage_emojis=original_perms['manage_emojis'],
+                    manage_events=original_perms['manage_events']
+                )
+                acoes.append(('cargos', f"@{role.name}", lambda r=role, p=new_perms: r.edit(permissions=p)))
+        
+        await executor_lote.executar(acoes)
         
         # Limpar dados
         self.original_permissions.clear()
@@ -1141,33 +2206,638 @@ class RateLimitSystem:
 rate_system = RateLimitSystem()
 
 # SISTEMA DE IA GROQ ORIGINAL - CONVERSA NATURAL CORRIGIDA
+# ✅ NOVO: Cliente HTTP compartilhado (uma sessão aiohttp para o bot inteiro)
+class ClienteHTTP:
+    """Sessão aiohttp única com pool de conexões keep-alive.
+
+    Reaproveita conexões TCP/TLS entre chamadas (Groq, downloads, html2pdf),
+    limita conexões por host, faz cache de DNS e mede a latência por host
+    através dos hooks de trace do aiohttp.
+    """
+
+    def __init__(self, limite_total=100, limite_por_host=10, ttl_dns=300, keepalive=30):
+        self.limite_total = limite_total
+        self.limite_por_host = limite_por_host
+        self.ttl_dns = ttl_dns
+        self.keepalive = keepalive
+        self._sessao = None
+        self.metricas = {}  # host -> {'requisicoes', 'erros', 'latencias', ...}
+
+    def _metricas_host(self, host):
+        if host not in self.metricas:
+            self.metricas[host] = {
+                'requisicoes': 0,
+                'erros': 0,
+                'conexoes_novas': 0,
+                'conexoes_reusadas': 0,
+                'latencias': deque(maxlen=200)
+            }
+        return self.metricas[host]
+
+    def _criar_trace(self):
+        trace = aiohttp.TraceConfig()
+
+        async def inicio(session, ctx, params):
+            ctx.inicio = time.monotonic()
+
+        async def fim(session, ctx, params):
+            metricas = self._metricas_host(params.url.host)
+            metricas['requisicoes'] += 1
+            metricas['latencias'].append(time.monotonic() - ctx.inicio)
+
+        async def erro(session, ctx, params):
+            self._metricas_host(params.url.host)['erros'] += 1
+
+        async def conexao_nova(session, ctx, params):
+            ctx.conexao_nova = True
+
+        async def conexao_reusada(session, ctx, params):
+            ctx.conexao_nova = False
+
+        async def cabecalhos_enviados(session, ctx, params):
+            chave = 'conexoes_novas' if getattr(ctx, 'conexao_nova', True) else 'conexoes_reusadas'
+            self._metricas_host(params.url.host)[chave] += 1
+
+        trace.on_request_start.append(inicio)
+        trace.on_request_end.append(fim)
+        trace.on_request_exception.append(erro)
+        trace.on_connection_create_end.append(conexao_nova)
+        trace.on_connection_reuseconn.append(conexao_reusada)
+        trace.on_request_headers_sent.append(cabecalhos_enviados)
+        return trace
+
+    def _criar_sessao(self):
+        conector = aiohttp.TCPConnector(
+            limit=self.limite_total,
+            limit_per_host=self.limite_por_host,
+            ttl_dns_cache=self.ttl_dns,
+            keepalive_timeout=self.keepalive
+        )
+        return aiohttp.ClientSession(
+            connector=conector,
+            timeout=aiohttp.ClientTimeout(total=60),
+            trace_configs=[self._criar_trace()]
+        )
+
+    async def iniciar(self):
+        if self._sessao is None or self._sessao.closed:
+            self._sessao = self._criar_sessao()
+            print("✅ Cliente HTTP compartilhado iniciado")
+
+    @property
+    def sessao(self):
+        # Cria sob demanda caso algum comando rode antes do setup_hook
+        if self._sessao is None or self._sessao.closed:
+            self._sessao = self._criar_sessao()
+        return self._sessao
+
+    async def fechar(self):
+        if self._sessao and not self._sessao.closed:
+            await self._sessao.close()
+        self._sessao = None
+
+    def estatisticas(self):
+        """Latência por host: média, p95 e máxima (em ms) sobre as últimas requisições"""
+        resultado = {}
+        for host, metricas in self.metricas.items():
+            latencias = sorted(metricas['latencias'])
+            resultado[host] = {
+                'requisicoes': metricas['requisicoes'],
+                'erros': metricas['erros'],
+                'conexoes_novas': metricas['conexoes_novas'],
+                'conexoes_reusadas': metricas['conexoes_reusadas'],
+                'media_ms': round(sum(latencias) / len(latencias) * 1000, 1) if latencias else 0,
+                'p95_ms': round(latencias[max(0, int(len(latencias) * 0.95) - 1)] * 1000, 1) if latencias else 0,
+                'max_ms': round(latencias[-1] * 1000, 1) if latencias else 0
+            }
+        return resultado
+
+cliente_http = ClienteHTTP()
+
+# ✅ NOVO: Memória de conversas com orçamento de tokens e despejo para o disco
+class MemoriaConversas:
+    """Histórico da IA por usuário, limitado em tokens e em memória.
+
+    Cada usuário tem um resumo + os turnos recentes que cabem em
+    `orcamento_tokens`; turnos que saem do orçamento viram resumo (extrativo na
+    hora, refinado pela IA em segundo plano). Só os usuários ativos ficam em
+    RAM (LRU com limite de usuários e de tokens); os ociosos ficam na tabela
+    memoria_ia do data.db e são recarregados quando voltam a conversar.
+    As gravações em segundo plano levam uma versão por usuário: uma gravação
+    atrasada nunca sobrescreve uma mais nova nem ressuscita um limpar().
+    """
+
+    def __init__(self, orcamento_tokens=1500, max_tokens_turno=600, max_tokens_resumo=300,
+                 max_usuarios_ativos=200, max_tokens_global=150000, tempo_ocioso=1800):
+        self.orcamento_tokens = orcamento_tokens
+        self.max_tokens_turno = max_tokens_turno
+        self.max_tokens_resumo = max_tokens_resumo
+        self.max_usuarios_ativos = max_usuarios_ativos
+        self.max_tokens_global = max_tokens_global
+        self.tempo_ocioso = tempo_ocioso
+        self.ativos = OrderedDict()  # usuario -> estado (mais recente no fim)
+        self.versoes = {}  # usuario -> versão da última gravação pedida (só enquanto pendente)
+        self.sequencia_gravacao = 0
+        self.lock_versoes = threading.Lock()
+        self.tokens_residentes = 0
+        self.resumidor = None  # corrotina texto -> resumo (GroqAI)
+        self.stats = {'resumos': 0, 'despejos': 0, 'recarregados': 0}
+        self.criar_tabela()
+        self.migrar_historico_legado()
+
+    @staticmethod
+    def estimar_tokens(texto):
+        # ~4 caracteres por token é suficiente para orçamento
+        return len(texto) // 4 + 4
+
+    def criar_tabela(self):
+        with db.lock_conexao:
+            with db.conexao:
+                db.conexao.execute("""
+                    CREATE TABLE IF NOT EXISTS memoria_ia (
+                        usuario TEXT PRIMARY KEY,
+                        dados TEXT NOT NULL,
+                        atualizado_em REAL NOT NULL
+                    )
+                """)
+
+    def migrar_historico_legado(self):
+        """Move o antigo db.historico_ia (turnos crus) para a tabela memoria_ia"""
+        legado = list(dict.items(db.historico_ia))
+        if not legado:
+            return
+        for usuario, turnos in legado:
+            estado = self._estado_vazio()
+            for turno in turnos[-10:]:
+                self._anexar(estado, turno['role'], turno['content'])
+            self._compactar(estado)
+            self._gravar(usuario, estado)
+            del db.historico_ia[usuario]
+        db.salvar_dados()
+        print(f"✅ Memória da IA migrada: {len(legado)} usuários")
+
+    def _estado_vazio(self):
+        return {'resumo': '', 'turnos': [], 'antigos': [], 'tokens': 0, 'ultimo_uso': time.time()}
+
+    def _tokens_estado(self, estado):
+        return self.estimar_tokens(estado['resumo']) + sum(self.estimar_tokens(t['content']) for t in estado['turnos'])
+
+    def _nova_versao(self, usuario):
+        with self.lock_versoes:
+            self.sequencia_gravacao += 1
+            self.versoes[usuario] = self.sequencia_gravacao
+            return self.sequencia_gravacao
+
+    def _gravar(self, usuario, estado, versao=None):
+        dados = json.dumps({'resumo': estado['resumo'], 'turnos': estado['turnos']})
+        with db.lock_conexao:
+            # Sob o lock do banco: só a gravação mais recente pedida chega ao disco
+            with self.lock_versoes:
+                if versao is not None and self.versoes.get(usuario) != versao:
+                    return
+            with db.conexao:
+                db.conexao.execute(
+                    "INSERT OR REPLACE INTO memoria_ia (usuario, dados, atualizado_em) VALUES (?, ?, ?)",
+                    (usuario, dados, estado['ultimo_uso'])
+                )
+            with self.lock_versoes:
+                if versao is not None and self.versoes.get(usuario) == versao:
+                    del self.versoes[usuario]
+
+    def _persistir(self, usuario, estado):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._gravar(usuario, estado)
+            return
+        # Cópia rasa: a thread grava o estado deste momento
+        copia = {'resumo': estado['resumo'], 'turnos': list(estado['turnos']), 'ultimo_uso': estado['ultimo_uso']}
+        loop.run_in_executor(None, self._gravar, usuario, copia, self._nova_versao(usuario))
+
+    def _obter(self, usuario):
+        estado = self.ativos.get(usuario)
+        if estado is not None:
+            self.ativos.move_to_end(usuario)
+            return estado
+
+        with db.lock_conexao:
+            linha = db.conexao.execute("SELECT dados FROM memoria_ia WHERE usuario = ?", (usuario,)).fetchone()
+
+        estado = self._estado_vazio()
+        if linha:
+            dados = json.loads(linha[0])
+            estado['resumo'] = dados.get('resumo', '')
+            estado['turnos'] = dados.get('turnos', [])
+            self.stats['recarregados'] += 1
+        estado['tokens'] = self._tokens_estado(estado)
+
+        self.ativos[usuario] = estado
+        self.tokens_residentes += estado['tokens']
+        return estado
+
+    def _anexar(self, estado, role, conteudo):
+        limite = self.max_tokens_turno * 4
+        if len(conteudo) > limite:
+            conteudo = conteudo[:limite] + " [...]"
+        estado['turnos'].append({"role": role, "content": conteudo})
+
+    def _compactar(self, estado):
+        """Tira turnos antigos até caber no orçamento e resume o que saiu"""
+        saiu = []
+        while len(estado['turnos']) > 1 and self._tokens_estado(estado) > self.orcamento_tokens:
+            saiu.append(estado['turnos'].pop(0))
+        if not saiu:
+            return False
+
+        # Resumo extrativo imediato (a IA refina depois, se disponível)
+        linhas = [estado['resumo']] if estado['resumo'] else []
+        for turno in saiu:
+            autor = "Usuário" if turno['role'] == 'user' else "Você"
+            linhas.append(f"{autor}: {turno['content'][:150]}")
+        estado['resumo'] = "\n".join(linhas)[-self.max_tokens_resumo * 4:]
+        estado['antigos'].extend(saiu)
+        return True
+
+    def _ajustar(self, usuario, estado, tokens_antes):
+        estado['tokens'] = self._tokens_estado(estado)
+        self.tokens_residentes += estado['tokens'] - tokens_antes
+        estado['ultimo_uso'] = time.time()
+
+    def montar_historico(self, user_id, mensagem_atual):
+        """Registra a mensagem do usuário e retorna o histórico para o prompt"""
+        usuario = str(user_id)
+        estado = self._obter(usuario)
+        tokens_antes = estado['tokens']
+
+        self._anexar(estado, "user", mensagem_atual)
+        if self._compactar(estado):
+            self._agendar_resumo(usuario, estado)
+        self._ajustar(usuario, estado, tokens_antes)
+        self.despejar_excedentes()
+
+        mensagens = []
+        if estado['resumo']:
+            mensagens.append({"role": "system", "content": f"Resumo da conversa até aqui:\n{estado['resumo']}"})
+        mensagens.extend(estado['turnos'])
+        return mensagens
+
+    def adicionar(self, user_id, role, conteudo, persistir=False):
+        usuario = str(user_id)
+        estado = self._obter(usuario)
+        tokens_antes = estado['tokens']
+
+        self._anexar(estado, role, conteudo)
+        if self._compactar(estado):
+            self._agendar_resumo(usuario, estado)
+        self._ajustar(usuario, estado, tokens_antes)
+
+        if persistir:
+            self._persistir(usuario, estado)
+        self.despejar_excedentes()
+
+    def _agendar_resumo(self, usuario, estado):
+        if not self.resumidor or estado.get('resumindo'):
+            return
+        try:
+            asyncio.get_running_loop().create_task(self._resumir(usuario, estado))
+            estado['resumindo'] = True
+        except RuntimeError:
+            estado['antigos'] = []
+
+    async def _resumir(self, usuario, estado):
+        antigos, estado['antigos'] = estado['antigos'], []
+        base = estado['resumo']
+        try:
+            texto = "\n".join(
+                f"{'Usuário' if t['role'] == 'user' else 'Você'}: {t['content']}" for t in antigos
+            )
+            resumo = await self.resumidor(f"Resumo atual: {base}\n\nTrecho completo:\n{texto}"[-6000:])
+            if not resumo:
+                return
+
+            # Linhas extrativas que entraram enquanto a IA resumia continuam no fim
+            extra = estado['resumo'][len(base):] if estado['resumo'].startswith(base) else ""
+            tokens_antes = estado['tokens']
+            estado['resumo'] = (resumo.strip() + extra)[-self.max_tokens_resumo * 4:]
+            self.stats['resumos'] += 1
+
+            atual = self.ativos.get(usuario)
+            if atual is estado:
+                self._ajustar(usuario, estado, tokens_antes)
+            if (atual is None and not estado.get('limpo')) or atual is estado:
+                self._persistir(usuario, estado)
+        except Exception as e:
+            print(f"❌ Erro ao resumir conversa de {usuario}: {e}")
+        finally:
+            estado['resumindo'] = False
+
+    def despejar_excedentes(self):
+        """Tira da RAM os usuários ociosos e os mais antigos acima dos limites globais"""
+        agora = time.time()
+        while self.ativos:
+            usuario, estado = next(iter(self.ativos.items()))
+            ocioso = agora - estado['ultimo_uso'] > self.tempo_ocioso
+            acima = len(self.ativos) > self.max_usuarios_ativos or self.tokens_residentes > self.max_tokens_global
+            if not (ocioso or acima) or (len(self.ativos) == 1 and not ocioso):
+                break
+            del self.ativos[usuario]
+            self.tokens_residentes -= estado['tokens']
+            self._persistir(usuario, estado)
+            self.stats['despejos'] += 1
+
+    def limpar(self, user_id):
+        usuario = str(user_id)
+        estado = self.ativos.pop(usuario, None)
+        if estado:
+            self.tokens_residentes -= estado['tokens']
+            estado['limpo'] = True  # Um resumo em andamento não grava mais este estado
+        with db.lock_conexao:
+            # Invalida gravações ainda na fila do executor
+            with self.lock_versoes:
+                self.versoes.pop(usuario, None)
+            with db.conexao:
+                db.conexao.execute("DELETE FROM memoria_ia WHERE usuario = ?", (usuario,))
+
+    def estatisticas(self):
+        return {
+            'usuarios_ativos': len(self.ativos),
+            'tokens_residentes': self.tokens_residentes,
+            **self.stats
+        }
+
+memoria_conversas = MemoriaConversas()
+
+# ✅ NOVO: Cache LRU+TTL de respostas da IA com coalescência de requisições iguais
+class CacheRespostasIA:
+    """Cache das respostas do Groq para requisições sem histórico.
+
+    A chave é (modelo, prompt de sistema do modo, max_tokens, pergunta normalizada),
+    então só entram requisições cujo payload é apenas sistema + uma mensagem.
+    Requisições iguais em andamento compartilham a mesma chamada à API.
+    """
+
+    def __init__(self, max_itens=256, ttl=1800):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.itens = OrderedDict()  # chave -> (expira_em, resposta)
+        self.em_andamento = {}  # chave -> tarefa compartilhada
+        self.acertos = 0
+        self.falhas = 0
+        self.coalescidas = 0
+
+    @staticmethod
+    def normalizar(texto):
+        return re.sub(r'\s+', ' ', texto.lower()).strip(' ?!.,;')
+
+    def chave(self, payload):
+        """Retorna a chave do cache ou None se a requisição tem histórico"""
+        mensagens = payload['messages']
+        if len(mensagens) != 2 or mensagens[0]['role'] != 'system' or mensagens[1]['role'] != 'user':
+            return None
+        sistema = hashlib.sha1(mensagens[0]['content'].encode('utf-8')).hexdigest()
+        return (payload['model'], sistema, payload['max_tokens'], self.normalizar(mensagens[1]['content']))
+
+    def obter(self, chave):
+        item = self.itens.get(chave)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self.itens[chave]
+            self.falhas += 1
+            return None
+        self.itens.move_to_end(chave)
+        self.acertos += 1
+        return item[1]
+
+    def guardar(self, chave, resposta):
+        self.itens[chave] = (time.monotonic() + self.ttl, resposta)
+        self.itens.move_to_end(chave)
+        while len(self.itens) > self.max_itens:
+            self.itens.popitem(last=False)
+
+    async def coalescer(self, chave, fabrica):
+        """Executa fabrica() uma vez por chave; quem chegar durante a chamada espera o mesmo resultado"""
+        tarefa = self.em_andamento.get(chave)
+        if tarefa is None:
+            tarefa = asyncio.ensure_future(fabrica())
+            self.em_andamento[chave] = tarefa
+
+            def concluir(t):
+                self.em_andamento.pop(chave, None)
+                if not t.cancelled() and t.exception() is None and t.result() is not None:
+                    self.guardar(chave, t.result())
+
+            tarefa.add_done_callback(concluir)
+        else:
+            self.coalescidas += 1
+        return await asyncio.shield(tarefa)
+
+    def estatisticas(self):
+        total = self.acertos + self.falhas
+        return {
+            'itens': len(self.itens),
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'coalescidas': self.coalescidas,
+            'taxa_acerto': round(self.acertos / total * 100, 1) if total else 0.0
+        }
+
+# ✅ NOVO: Fila de despacho da IA (workers, prioridade, justiça e 429)
+class LimiteTaxaIA(Exception):
+    """A API da IA respondeu 429; retry_after em segundos"""
+    def __init__(self, retry_after):
+        super().__init__(f"rate limit da IA ({retry_after}s)")
+        self.retry_after = retry_after
+
+class FilaIACheia(Exception):
+    """O usuário já tem pedidos demais esperando na fila"""
+
+class FilaIA:
+    """Despacha as chamadas à IA por um número fixo de workers.
+
+    Prioridade 0 (conversa curta) é servida antes da 1 (modo técnico, 4000
+    tokens), na proporção peso_conversa:1 para a técnica não ficar parada.
+    Dentro de cada prioridade a escolha é rodízio por servidor e depois por
+    usuário, com no máximo um pedido em execução por usuário. Um 429 pausa
+    todos os workers pelo retry_after e o pedido volta para a frente da fila.
+    """
+
+    def __init__(self, workers=4, max_pendentes_usuario=3, max_tentativas=3, peso_conversa=3):
+        self.workers = workers
+        self.max_pendentes_usuario = max_pendentes_usuario
+        self.max_tentativas = max_tentativas
+        self.peso_conversa = peso_conversa
+        self.filas = {0: OrderedDict(), 1: OrderedDict()}  # prioridade -> guild -> usuário -> deque
+        self.pendentes_usuario = {}
+        self.em_execucao = set()
+        self.pausado_ate = 0.0
+        self.evento = None
+        self.tarefas = []
+        self.stats = {'servidos': 0, 'rate_limits': 0, 'rejeitados': 0, 'espera_total': 0.0}
+
+    def iniciar(self):
+        if self.tarefas:
+            return
+        self.evento = asyncio.Event()
+        self.tarefas = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def executar(self, fabrica, user_id=None, guild_id=None, prioridade=0):
+        """Enfileira fabrica() e espera o resultado"""
+        self.iniciar()
+
+        if user_id is not None and self.pendentes_usuario.get(user_id, 0) >= self.max_pendentes_usuario:
+            self.stats['rejeitados'] += 1
+            raise FilaIACheia()
+
+        pedido = {
+            'fabrica': fabrica,
+            'futuro': asyncio.get_running_loop().create_future(),
+            'usuario': user_id,
+            'guild': guild_id,
+            'prioridade': prioridade,
+            'tentativas': 0,
+            'entrada': time.monotonic()
+        }
+        self._enfileirar(pedido)
+        if user_id is not None:
+            self.pendentes_usuario[user_id] = self.pendentes_usuario.get(user_id, 0) + 1
+
+        try:
+            return await pedido['futuro']
+        finally:
+            if user_id is not None:
+                self.pendentes_usuario[user_id] -= 1
+                if self.pendentes_usuario[user_id] <= 0:
+                    del self.pendentes_usuario[user_id]
+
+    def _enfileirar(self, pedido, na_frente=False):
+        por_guild = self.filas[pedido['prioridade']]
+        por_usuario = por_guild.setdefault(pedido['guild'], OrderedDict())
+        fila = por_usuario.setdefault(pedido['usuario'], deque())
+        if na_frente:
+            fila.appendleft(pedido)
+        else:
+            fila.append(pedido)
+        self.evento.set()
+
+    def _retirar(self, prioridade):
+        """Rodízio: primeiro servidor com usuário livre, primeiro usuário livre dele"""
+        por_guild = self.filas[prioridade]
+        for guild_id in list(por_guild):
+            por_usuario = por_guild[guild_id]
+            for usuario in list(por_usuario):
+                if usuario is not None and usuario in self.em_execucao:
+                    continue
+                fila = por_usuario[usuario]
+                pedido = fila.popleft()
+                # Usuário e servidor atendidos vão para o fim do rodízio
+                if fila:
+                    por_usuario.move_to_end(usuario)
+                else:
+                    del por_usuario[usuario]
+                if por_usuario:
+                    por_guild.move_to_end(guild_id)
+                else:
+                    del por_guild[guild_id]
+                return pedido
+        return None
+
+    def _proximo(self):
+        vez_tecnica = self.stats['servidos'] % (self.peso_conversa + 1) == self.peso_conversa
+        ordem = (1, 0) if vez_tecnica else (0, 1)
+        for prioridade in ordem:
+            pedido = self._retirar(prioridade)
+            if pedido is not None:
+                return pedido
+        return None
+
+    async def _worker(self):
+        while True:
+            espera = self.pausado_ate - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+                continue
+
+            pedido = self._proximo()
+            if pedido is None:
+                self.evento.clear()
+                await self.evento.wait()
+                continue
+            if pedido['futuro'].done():
+                continue  # quem pediu desistiu (cancelado)
+
+            usuario = pedido['usuario']
+            if usuario is not None:
+                self.em_execucao.add(usuario)
+            try:
+                if pedido['tentativas'] == 0:
+                    self.stats['espera_total'] += time.monotonic() - pedido['entrada']
+                resultado = await pedido['fabrica']()
+                if not pedido['futuro'].done():
+                    pedido['futuro'].set_result(resultado)
+                self.stats['servidos'] += 1
+            except LimiteTaxaIA as e:
+                self.stats['rate_limits'] += 1
+                self.pausado_ate = max(self.pausado_ate, time.monotonic() + e.retry_after)
+                pedido['tentativas'] += 1
+                if pedido['tentativas'] < self.max_tentativas:
+                    print(f"⚠️ IA com rate limit, pausando {e.retry_after:.1f}s")
+                    self._enfileirar(pedido, na_frente=True)
+                elif not pedido['futuro'].done():
+                    pedido['futuro'].set_exception(e)
+            except Exception as e:
+                if not pedido['futuro'].done():
+                    pedido['futuro'].set_exception(e)
+            finally:
+                self.em_execucao.discard(usuario)
+                self.evento.set()
+
+    def estatisticas(self):
+        servidos = self.stats['servidos']
+        return {
+            'na_fila': sum(len(f) for g in self.filas.values() for u in g.values() for f in u.values()),
+            'em_execucao': len(self.em_execucao),
+            'servidos': servidos,
+            'rate_limits': self.stats['rate_limits'],
+            'rejeitados': self.stats['rejeitados'],
+            'espera_media_ms': round(self.stats['espera_total'] / servidos * 1000) if servidos else 0
+        }
+
+fila_ia = FilaIA()
+
 class GroqAI:
     def __init__(self, api_key):
         self.api_key = api_key
         self.base_url = "https://api.groq.com/openai/v1/chat/completions"
+        self.intervalo_edicao = 1.0  # segundos entre edições no streaming (limite do Discord)
+        self.metricas = {'primeiro_token': deque(maxlen=100), 'streams': 0, 'falhas': 0}
+        self.cache = CacheRespostasIA()
+        memoria_conversas.resumidor = self.resumir_conversa
     
     def obter_historico_usuario(self, user_id, mensagem_atual):
-        user_id_str = str(user_id)
-        
-        if user_id_str not in db.historico_ia:
-            db.historico_ia[user_id_str] = []
-        
-        historico = db.historico_ia[user_id_str]
-        
-        if len(historico) > 10:
-            historico = historico[-10:]
-        
-        historico.append({"role": "user", "content": mensagem_atual})
-        db.historico_ia[user_id_str] = historico
-        db.salvar_dados()
-        
-        return historico
+        # ✅ NOVO: Memória com orçamento de tokens (resumo + turnos recentes)
+        return memoria_conversas.montar_historico(user_id, mensagem_atual)
     
     def limpar_historico_usuario(self, user_id):
-        user_id_str = str(user_id)
-        if user_id_str in db.historico_ia:
-            db.historico_ia[user_id_str] = []
-            db.salvar_dados()
+        memoria_conversas.limpar(user_id)
+    
+    async def resumir_conversa(self, texto):
+        """Resume turnos antigos de uma conversa (usado pela memória de conversas)"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "model": "llama-3.1-8b-instant",
+            "messages": [
+                {"role": "system", "content": "Resuma a conversa abaixo em no máximo 5 frases curtas, mantendo nomes, pedidos e decisões importantes. Responda só com o resumo, em português."},
+                {"role": "user", "content": texto}
+            ],
+            "temperature": 0.3,
+            "max_tokens": 200,
+            "stream": False
+        }
+        # Resumo é trabalho de fundo: entra na fila com a prioridade mais baixa
+        return await fila_ia.executar(lambda: self._chamar_api(headers, payload), prioridade=1)
     
     def is_mensagem_tecnica(self, mensagem):
         palavras_tecnicas = [
@@ -1182,10 +2852,8 @@ class GroqAI:
         mensagem_lower = mensagem.lower()
         return any(palavra in mensagem_lower for palavra in palavras_tecnicas)
     
-    async def gerar_resposta(self, mensagem, user_id=None, modo_tecnico=False, contexto_conversa=False):
-        if not self.api_key:
-            return "Configure a API Key do Groq no arquivo .env"
-        
+    def _montar_requisicao(self, mensagem, user_id=None, modo_tecnico=False, contexto_conversa=False, stream=False):
+        """Monta headers e payload (prompt do modo + histórico) para a API do Groq"""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -1258,65 +2926,332 @@ Responda em português."""
             "temperature": temperature,
             "max_tokens": max_tokens,
             "top_p": 0.9,
-            "stream": False
+            "stream": stream
         }
         
+        return headers, payload
+    
+    def _registrar_resposta(self, user_id, resposta):
+        if user_id:
+            memoria_conversas.adicionar(user_id, "assistant", resposta, persistir=True)
+    
+    @staticmethod
+    def _prioridade(payload):
+        # Conversa curta passa na frente do modo técnico (4000 tokens)
+        return 0 if payload['max_tokens'] <= 200 else 1
+    
+    @staticmethod
+    def _mensagem_limite(erro):
+        return f"Tô recebendo muita mensagem agora 😅 Tenta de novo em uns {int(erro.retry_after) + 1}s."
+    
+    async def gerar_resposta(self, mensagem, user_id=None, modo_tecnico=False, contexto_conversa=False, guild_id=None):
+        if not self.api_key:
+            return "Configure a API Key do Groq no arquivo .env"
+        
+        headers, payload = self._montar_requisicao(mensagem, user_id, modo_tecnico, contexto_conversa)
+        chave = self.cache.chave(payload)
+        
+        def chamar():
+            return fila_ia.executar(lambda: self._chamar_api(headers, payload), user_id, guild_id, self._prioridade(payload))
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, json=payload, headers=headers, timeout=45) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        resposta = data['choices'][0]['message']['content']
-                        
-                        if user_id:
-                            user_id_str = str(user_id)
-                            if user_id_str in db.historico_ia:
-                                db.historico_ia[user_id_str].append({"role": "assistant", "content": resposta})
-                                db.salvar_dados()
-                        
-                        return resposta
-                    else:
-                        # Resposta natural para erro - COMO ERA ANTES
-                        return "Eae, tô com uns probleminhas aqui. Tenta de novo?"
+            if chave is None:
+                resposta = await chamar()
+            else:
+                resposta = self.cache.obter(chave)
+                if resposta is None:
+                    resposta = await self.cache.coalescer(chave, chamar)
+            
+            if resposta is None:
+                # Resposta natural para erro - COMO ERA ANTES
+                return "Eae, tô com uns probleminhas aqui. Tenta de novo?"
+            
+            self._registrar_resposta(user_id, resposta)
+            
+            return resposta
+        except LimiteTaxaIA as e:
+            return self._mensagem_limite(e)
+        except FilaIACheia:
+            return "Calma aí, ainda tô respondendo tuas outras mensagens!"
         except:
             # Resposta natural para erro - COMO ERA ANTES
             return "Ops, deu um tempo aqui. Fala de novo?"
+    
+    @staticmethod
+    def _verificar_limite(response):
+        if response.status == 429:
+            try:
+                retry_after = float(response.headers.get('retry-after', 5))
+            except ValueError:
+                retry_after = 5.0
+            raise LimiteTaxaIA(retry_after)
+    
+    async def _chamar_api(self, headers, payload):
+        """Chamada sem streaming; None se a API respondeu com erro"""
+        async with cliente_http.sessao.post(self.base_url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=45)) as response:
+            self._verificar_limite(response)
+            if response.status == 200:
+                data = await response.json()
+                return data['choices'][0]['message']['content']
+            return None
+    
+    # ✅ NOVO: Streaming (SSE) - o texto aparece enquanto é gerado
+    async def gerar_stream(self, headers, payload):
+        """Gera os pedaços de texto conforme chegam do Groq (stream SSE)"""
+        timeout = aiohttp.ClientTimeout(total=120, sock_read=30)
+        
+        async with cliente_http.sessao.post(self.base_url, json=payload, headers=headers, timeout=timeout) as response:
+            self._verificar_limite(response)
+            if response.status != 200:
+                raise RuntimeError(f"Groq respondeu {response.status}")
+            
+            async for linha in response.content:
+                linha = linha.decode('utf-8').strip()
+                if not linha.startswith('data:'):
+                    continue
+                
+                dados = linha[5:].strip()
+                if dados == '[DONE]':
+                    break
+                
+                pedaco = json.loads(dados)['choices'][0].get('delta', {}).get('content')
+                if pedaco:
+                    yield pedaco
+    
+    async def responder_stream(self, enviar, mensagem, user_id=None, modo_tecnico=False, contexto_conversa=False, guild_id=None):
+        """Responde editando a mensagem no Discord conforme o texto chega.
+
+        `enviar` cria a primeira mensagem (ctx.send, message.reply...). Edições
+        ficam limitadas a uma por `intervalo_edicao` e, ao passar de 2000
+        caracteres, a resposta continua numa nova mensagem.
+        """
+        if not self.api_key:
+            await enviar("Configure a API Key do Groq no arquivo .env")
+            return None
+        
+        inicio = time.monotonic()
+        mensagens = []
+        texto_atual = ""
+        texto_completo = ""
+        ultima_edicao = 0.0
+        
+        async def publicar(forcar=False):
+            nonlocal texto_atual, ultima_edicao
+            
+            # Fechar mensagens cheias e continuar numa nova
+            while len(texto_atual) > 2000:
+                corte = texto_atual.rfind('\n', 1500, 2000)
+                corte = corte if corte != -1 else 2000
+                await mensagens[-1].edit(content=texto_atual[:corte])
+                texto_atual = texto_atual[corte:].lstrip('\n')
+                mensagens.append(await mensagens[-1].channel.send(texto_atual[:2000] or "..."))
+                ultima_edicao = time.monotonic()
+            
+            if forcar or time.monotonic() - ultima_edicao >= self.intervalo_edicao:
+                if texto_atual:
+                    await mensagens[-1].edit(content=texto_atual)
+                elif forcar:
+                    # Continuação ficou vazia (a resposta acabou exatamente no corte)
+                    await mensagens.pop().delete()
+                ultima_edicao = time.monotonic()
+        
+        async def transmitir(fonte):
+            nonlocal texto_atual, texto_completo, ultima_edicao
+            texto_atual = texto_completo = ""
+            
+            async for pedaco in fonte:
+                texto_completo += pedaco
+                texto_atual += pedaco
+                
+                if not mensagens:
+                    if not texto_atual.strip():
+                        continue
+                    # Primeiro token visível (inclui a espera na fila): é isso que o usuário sente
+                    self.metricas['primeiro_token'].append(time.monotonic() - inicio)
+                    mensagens.append(await enviar(texto_atual[:2000]))
+                    ultima_edicao = time.monotonic()
+                
+                await publicar()
+            
+            if not mensagens:
+                raise RuntimeError("resposta vazia")
+            await publicar(forcar=True)
+            return texto_completo
+        
+        try:
+            headers, payload = self._montar_requisicao(mensagem, user_id, modo_tecnico, contexto_conversa, stream=True)
+            chave = self.cache.chave(payload)
+            
+            # Cache ou requisição igual em andamento: publica o texto pronto de uma vez
+            pronta = self.cache.obter(chave) if chave else None
+            if pronta is None and chave in self.cache.em_andamento:
+                pronta = await self.cache.coalescer(chave, None)
+            
+            async def texto_pronto():
+                yield pronta
+            
+            if pronta:
+                await transmitir(texto_pronto())
+            else:
+                # Registrar a chamada como em andamento: pedidos iguais que chegarem
+                # durante o stream esperam o texto final em vez de abrir outro
+                em_andamento = None
+                if chave and chave not in self.cache.em_andamento:
+                    em_andamento = asyncio.get_running_loop().create_future()
+                    self.cache.em_andamento[chave] = em_andamento
+                resultado = None
+                try:
+                    # Um 429 chega antes do primeiro token, então a fila pode repetir o stream inteiro
+                    await fila_ia.executar(
+                        lambda: transmitir(self.gerar_stream(headers, payload)),
+                        user_id, guild_id, self._prioridade(payload)
+                    )
+                    resultado = texto_completo
+                finally:
+                    if em_andamento is not None:
+                        if self.cache.em_andamento.get(chave) is em_andamento:
+                            del self.cache.em_andamento[chave]
+                        # Em caso de falha quem esperava recebe None e faz a própria chamada
+                        em_andamento.set_result(resultado)
+                if chave:
+                    self.cache.guardar(chave, texto_completo)
+            
+            self.metricas['streams'] += 1
+            self._registrar_resposta(user_id, texto_completo)
+            return texto_completo
+            
+        except LimiteTaxaIA as e:
+            self.metricas['falhas'] += 1
+            if not mensagens:
+                await enviar(self._mensagem_limite(e))
+            return None
+        except FilaIACheia:
+            await enviar("Calma aí, ainda tô respondendo tuas outras mensagens!")
+            return None
+        except Exception as e:
+            print(f"❌ Erro no streaming da IA: {e}")
+            self.metricas['falhas'] += 1
+            if not mensagens:
+                # Resposta natural para erro - COMO ERA ANTES
+                await enviar("Ops, deu um tempo aqui. Fala de novo?")
+            return None
 
 groq_ai = GroqAI(CONFIG["groq_api_key"])
 
 # SISTEMA DE LOGS COMPLETO - CORRIGIDO
-class LogSystem:
-    def __init__(self, bot):
-        self.bot = bot
-    
-    async def get_log_channel(self, guild, tipo):
-        # ✅ CORREÇÃO CRÍTICA: Buscar por ID primeiro, depois por nome
-        canal_id = CONFIG["canais_automaticos"].get(tipo)
-        
+# ✅ NOVO: Canais automáticos por servidor + índice de resolução dos canais de log
+class CanaisServidor:
+    """Configuração de canais automáticos por servidor, com cache de resolução.
+
+    Cada servidor guarda seus próprios ids em db.config_canais["guild:<id>"]
+    (antes era um único dicionário global, que misturava servidores). Os ids
+    do formato antigo são adotados pelo servidor que contém o canal na primeira
+    consulta. A resolução de um tipo de log (id configurado → nome exato →
+    parte do nome) é feita uma vez por servidor e fica em cache até algum
+    evento de canal invalidá-la.
+    """
+
+    # Tipos de log que têm nome diferente na configuração de canais
+    ALIASES = {'moderacao': 'mod_logs', 'cargos': 'cargo_logs'}
+
+    def __init__(self):
+        self.cache = {}  # guild_id -> {tipo: canal_id ou None}
+        self.stats = {'acertos': 0, 'resolucoes': 0, 'invalidacoes': 0}
+
+    @staticmethod
+    def _chave(guild_id):
+        return f"guild:{guild_id}"
+
+    def configuracao(self, guild):
+        """Retorna {tipo: canal_id ou None} do servidor"""
+        chave = self._chave(guild.id)
+        config = db.config_canais.get(chave)
+        if config is None:
+            config = dict.fromkeys(CONFIG['canais_automaticos'])
+            legado = db.config_canais.get('canais_automaticos') or {}
+            for tipo, canal_id in legado.items():
+                if canal_id and guild.get_channel(canal_id):
+                    config[tipo] = canal_id
+            db.config_canais[chave] = config
+            db.salvar_dados()
+        return config
+
+    def obter_id(self, guild, tipo):
+        return self.configuracao(guild).get(self.ALIASES.get(tipo, tipo))
+
+    def obter(self, guild, tipo):
+        canal_id = self.obter_id(guild, tipo)
+        return guild.get_channel(canal_id) if canal_id else None
+
+    def definir(self, guild, tipo, canal_id):
+        self.configuracao(guild)[tipo] = canal_id
+        db.config_canais[self._chave(guild.id)] = self.configuracao(guild)
+        db.salvar_dados()
+        self.invalidar(guild.id)
+
+    def resetar(self, guild, tipo=None):
+        config = self.configuracao(guild)
+        for chave in ([tipo] if tipo else list(config)):
+            config[chave] = None
+        db.config_canais[self._chave(guild.id)] = config
+        db.salvar_dados()
+        self.invalidar(guild.id)
+
+    def invalidar(self, guild_id):
+        if self.cache.pop(guild_id, None) is not None:
+            self.stats['invalidacoes'] += 1
+
+    def _resolver(self, guild, tipo):
         # 1. Tentar buscar por ID configurado
-        if canal_id:
-            canal = guild.get_channel(canal_id)
-            if canal:
-                return canal
+        canal = self.obter(guild, tipo)
+        if canal:
+            return canal
         
         # 2. Fallback para busca por nome (com tolerância a fontes personalizadas)
         canal_nome = CONFIG["logs_config"].get(tipo)
         if canal_nome:
-            # Buscar por nome exato primeiro
-            canal = discord.utils.get(guild.text_channels, name=canal_nome)
-            if canal:
-                return canal
-            
-            # ✅ CORREÇÃO: Buscar por parte do nome (para lidar com fontes personalizadas)
+            parte_nome = canal_nome.split('・')[-1]  # Parte após o símbolo
+            parcial = None
             for channel in guild.text_channels:
-                if canal_nome.split('・')[-1] in channel.name:  # Buscar pela parte após o símbolo
+                if channel.name == canal_nome:
                     return channel
+                if parcial is None and parte_nome in channel.name:
+                    parcial = channel
+            if parcial:
+                return parcial
         
         # 3. Fallback final para sistema antigo
         if tipo == "pontuacao":
             return guild.get_channel(CONFIG["canal_pontuacao_id"])
         
         return None
+
+    def canal_log(self, guild, tipo):
+        canais = self.cache.setdefault(guild.id, {})
+        if tipo in canais:
+            canal_id = canais[tipo]
+            if canal_id is None:
+                self.stats['acertos'] += 1
+                return None
+            canal = guild.get_channel(canal_id)
+            if canal:
+                self.stats['acertos'] += 1
+                return canal
+        
+        self.stats['resolucoes'] += 1
+        canal = self._resolver(guild, tipo)
+        canais[tipo] = canal.id if canal else None
+        return canal
+
+canais_servidor = CanaisServidor()
+
+class LogSystem:
+    def __init__(self, bot):
+        self.bot = bot
+    
+    async def get_log_channel(self, guild, tipo):
+        # ✅ NOVO: Resolução em cache por servidor (invalidada nos eventos de canal)
+        return canais_servidor.canal_log(guild, tipo)
     
     async def log_entrada(self, member):
         canal = await self.get_log_channel(member.guild, "entrada_saida")
@@ -1423,6 +3358,196 @@ class LogSystem:
 log_system = LogSystem(bot)
 
 # SISTEMA DE CARGOS AUTOMÁTICO CORRIGIDO
+# ✅ NOVO: Snapshot colunar dos membros (contagens e filtros sem varrer guild.members)
+class SnapshotMembros:
+    """Colunas paralelas com os dados dos membros de um servidor.
+
+    ids/bots/status/criado_em/entrou_em ficam em `array` (memória compacta e
+    sem acesso a atributos de objetos Member) e os cargos em bitsets (um int
+    por membro, um bit por cargo). Remoção troca com o último (O(1)) e as
+    contagens de total/bots/ativos são mantidas a cada evento, então saem em
+    O(1); os filtros por data/cargo/nick percorrem só as colunas necessárias.
+    """
+
+    STATUS = {'offline': 0, 'online': 1, 'idle': 2, 'dnd': 3}
+
+    def __init__(self, guild):
+        self.guild_id = guild.id
+        self.ids = array('Q')
+        self.bots = array('B')
+        self.status = array('B')
+        self.criado_em = array('d')
+        self.entrou_em = array('d')
+        self.cargos = []
+        self.nicks = []
+        self.posicao = {}
+        self.bits_cargos = {}  # role_id -> bit
+        self.bits_livres = []  # Bits de cargos apagados, já zerados em todos os membros
+        self.total_bots = 0
+        self.total_ativos = 0
+        for member in guild.members:
+            self.adicionar(member)
+
+    def _bitset(self, member):
+        bits = 0
+        for role in member.roles:
+            bit = self.bits_cargos.get(role.id)
+            if bit is None:
+                bit = self.bits_livres.pop() if self.bits_livres else len(self.bits_cargos)
+                self.bits_cargos[role.id] = bit
+            bits |= 1 << bit
+        return bits
+
+    def remover_cargo(self, role_id):
+        """Zera o bit do cargo apagado em todos os membros e libera o bit"""
+        bit = self.bits_cargos.pop(role_id, None)
+        if bit is None:
+            return
+        mascara = ~(1 << bit)
+        self.cargos = [bits & mascara for bits in self.cargos]
+        self.bits_livres.append(bit)
+
+    def mascara(self, role_ids):
+        mascara = 0
+        for role_id in role_ids:
+            if role_id in self.bits_cargos:
+                mascara |= 1 << self.bits_cargos[role_id]
+        return mascara
+
+    def _codigo_status(self, member):
+        return self.STATUS.get(str(member.status), 0)
+
+    def adicionar(self, member):
+        if member.id in self.posicao:
+            self.atualizar(member)
+            return
+        self.posicao[member.id] = len(self.ids)
+        self.ids.append(member.id)
+        self.bots.append(int(member.bot))
+        status = self._codigo_status(member)
+        self.status.append(status)
+        self.criado_em.append(member.created_at.timestamp())
+        self.entrou_em.append(member.joined_at.timestamp() if member.joined_at else 0.0)
+        self.cargos.append(self._bitset(member))
+        self.nicks.append(member.nick)
+        self.total_bots += member.bot
+        self.total_ativos += status != 0
+
+    def remover(self, member_id):
+        indice = self.posicao.pop(member_id, None)
+        if indice is None:
+            return
+        self.total_bots -= self.bots[indice]
+        self.total_ativos -= self.status[indice] != 0
+        ultimo = len(self.ids) - 1
+        if indice != ultimo:
+            for coluna in (self.ids, self.bots, self.status, self.criado_em, self.entrou_em, self.cargos, self.nicks):
+                coluna[indice] = coluna[ultimo]
+            self.posicao[self.ids[indice]] = indice
+        for coluna in (self.ids, self.bots, self.status, self.criado_em, self.entrou_em, self.cargos, self.nicks):
+            coluna.pop()
+
+    def atualizar(self, member):
+        indice = self.posicao.get(member.id)
+        if indice is None:
+            self.adicionar(member)
+            return
+        self.cargos[indice] = self._bitset(member)
+        self.nicks[indice] = member.nick
+        self.atualizar_status(member)
+
+    def atualizar_status(self, member):
+        indice = self.posicao.get(member.id)
+        if indice is None:
+            return
+        novo = self._codigo_status(member)
+        self.total_ativos += (novo != 0) - (self.status[indice] != 0)
+        self.status[indice] = novo
+
+    # ---------- Consultas ----------
+
+    def contagens(self):
+        total = len(self.ids)
+        return {'total': total, 'bots': self.total_bots, 'humanos': total - self.total_bots, 'ativos': self.total_ativos}
+
+    def humanos(self):
+        return [member_id for member_id, bot_flag in zip(self.ids, self.bots) if not bot_flag]
+
+    def filtrar(self, humanos=False, offline=None, criado_depois=None, entrou_antes=None):
+        """Ids que passam em todos os filtros (datas em timestamp)"""
+        resultado = []
+        for member_id, bot_flag, status, criado, entrou in zip(self.ids, self.bots, self.status, self.criado_em, self.entrou_em):
+            if humanos and bot_flag:
+                continue
+            if offline is not None and (status == 0) != offline:
+                continue
+            if criado_depois is not None and criado <= criado_depois:
+                continue
+            if entrou_antes is not None and not (0 < entrou < entrou_antes):
+                continue
+            resultado.append(member_id)
+        return resultado
+
+    def sem_cargos_alem(self, role_ids):
+        """Humanos que não têm nenhum cargo fora de `role_ids`"""
+        permitidos = self.mascara(role_ids)
+        return [member_id for member_id, bot_flag, bits in zip(self.ids, self.bots, self.cargos)
+                if not bot_flag and not bits & ~permitidos]
+
+    def com_nick_contendo(self, texto):
+        return [member_id for member_id, nick in zip(self.ids, self.nicks) if nick and texto in nick]
+
+    def criado_em_de(self, member_id):
+        return self.criado_em[self.posicao[member_id]]
+
+class IndiceMembros:
+    """Um SnapshotMembros por servidor, criado na primeira consulta e mantido pelos eventos"""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def snapshot(self, guild):
+        snapshot = self.snapshots.get(guild.id)
+        # Reconstruir se perdeu eventos (ex: cache de membros ainda carregando)
+        if snapshot is None or (guild.member_count and len(snapshot.ids) != guild.member_count
+                                and len(guild.members) != len(snapshot.ids)):
+            snapshot = self.snapshots[guild.id] = SnapshotMembros(guild)
+        return snapshot
+
+    def _existente(self, guild):
+        return self.snapshots.get(guild.id)
+
+    def entrou(self, member):
+        snapshot = self._existente(member.guild)
+        if snapshot:
+            snapshot.adicionar(member)
+
+    def saiu(self, member):
+        snapshot = self._existente(member.guild)
+        if snapshot:
+            snapshot.remover(member.id)
+
+    def atualizado(self, member):
+        snapshot = self._existente(member.guild)
+        if snapshot:
+            snapshot.atualizar(member)
+
+    def presenca(self, member):
+        snapshot = self._existente(member.guild)
+        if snapshot:
+            snapshot.atualizar_status(member)
+
+    def cargo_apagado(self, role):
+        snapshot = self._existente(role.guild)
+        if snapshot:
+            snapshot.remover_cargo(role.id)
+
+    def membros(self, guild, ids):
+        """Converte ids em Members (ignorando quem já saiu)"""
+        return [member for member in map(guild.get_member, ids) if member]
+
+indice_membros = IndiceMembros()
+
 class SistemaCargos:
     def __init__(self, bot):
         self.bot = bot
@@ -1467,23 +3592,36 @@ class SistemaCargos:
         cargo_principal = max(cargos_com_hierarquia, key=lambda c: self.obter_hierarquia_cargo(c))
         return cargo_principal
     
+    async def nick_desejado(self, member):
+        """Retorna (precisa_mudar, novo_nick) pelo cargo principal do membro"""
+        cargo_principal = await self.obter_cargo_principal(member)
+        
+        if cargo_principal:
+            novo_nick = f"{self.extrair_nome_cargo_limpo(cargo_principal.name)} • {member.name}"
+            return member.nick != novo_nick, novo_nick
+        # Sem cargo principal: só reseta nick que foi gerado automaticamente
+        return bool(member.nick and "•" in member.nick), None
+    
+    async def acoes_nick_automatico(self, members):
+        """Ações do executor em lote só para quem precisa mudar (erros da API sobem para o executor)"""
+        acoes = []
+        for member in members:
+            precisa, novo_nick = await self.nick_desejado(member)
+            if precisa:
+                acoes.append(('membros', member.name, lambda m=member, n=novo_nick: m.edit(nick=n)))
+        return acoes
+    
     async def atualizar_nick_automatico(self, member):
         try:
-            cargo_principal = await self.obter_cargo_principal(member)
+            precisa, novo_nick = await self.nick_desejado(member)
+            if not precisa:
+                return
             
-            if cargo_principal:
-                nome_cargo_limpo = self.extrair_nome_cargo_limpo(cargo_principal.name)
-                novo_nick = f"{nome_cargo_limpo} • {member.name}"
-                
-                if member.nick == novo_nick:
-                    return
-                
-                await member.edit(nick=novo_nick)
+            await member.edit(nick=novo_nick)
+            if novo_nick:
                 print(f"✅ Nick atualizado (Staff): {member.name} -> {novo_nick}")
             else:
-                if member.nick and "•" in member.nick:
-                    await member.edit(nick=None)
-                    print(f"✅ Nick resetado: {member.name}")
+                print(f"✅ Nick resetado: {member.name}")
             
         except discord.Forbidden:
             print(f"❌ Sem permissão para atualizar nick de {member.name}")
@@ -1496,13 +3634,10 @@ class SistemaCargos:
             return
         
         membros_atualizados = 0
-        for member in guild.members:
-            if member.bot:
-                continue
-            
-            cargos_nao_basicos = [role for role in member.roles if role.name != "@everyone" and role.name not in ["Membro"]]
-            
-            if not cargos_nao_basicos:
+        # ✅ NOVO: Só os membros sem outros cargos, direto do snapshot
+        ids = indice_membros.snapshot(guild).sem_cargos_alem([guild.default_role.id, cargo_membro.id])
+        for member in indice_membros.membros(guild, ids):
+            if cargo_membro not in member.roles:
                 try:
                     await member.add_roles(cargo_membro)
                     membros_atualizados += 1
@@ -1517,8 +3652,151 @@ sistema_cargos = SistemaCargos(bot)
 
 # SISTEMA DE CONVITES CORRIGIDO
 class SistemaConvites:
-    def __init__(self):
-        self.convites_ativos = {}
+    """Atribuição de entradas a convites, com pontuação e conquistas.
+
+    Cada servidor tem um snapshot dos convites (usos, autor, limite) mantido
+    por on_invite_create/on_invite_delete. Entradas são acumuladas por
+    `janela_lote` segundos e atribuídas em lote com uma única busca de
+    convites comparada ao snapshot, respeitando `intervalo_minimo` entre
+    buscas; durante um raid isso vira uma chamada REST por janela, não uma
+    por entrada. Um lote só é atribuído quando todos os usos novos são de um
+    único convidante; com mais de um não há como saber quem usou qual. Usos
+    que a busca já viu mas cuja entrada ainda não chegou pelo gateway ficam
+    adiantados para o lote seguinte.
+    """
+
+    def __init__(self, janela_lote=2.0, intervalo_minimo=5.0):
+        self.janela_lote = janela_lote
+        self.intervalo_minimo = intervalo_minimo
+        self.convites_ativos = {}  # guild_id -> {code: {'usos', 'autor_id', 'max_usos'}}
+        self.esgotados = {}  # guild_id -> [(code, autor_id, apagado_em)] apagados ao atingir o limite
+        self.usos_adiantados = {}  # guild_id -> ([autor_id], time.monotonic()) sem entrada ainda
+        self.pendentes = {}  # guild_id -> [member]
+        self.inicio_lote = {}  # guild_id -> time.monotonic() da primeira entrada pendente
+        self.tasks = {}  # guild_id -> task de atribuição
+        self.ultima_busca = {}  # guild_id -> time.monotonic()
+        self.stats = {'buscas': 0, 'atribuidos': 0, 'sem_convite': 0}
+    
+    @staticmethod
+    def _dados_convite(invite):
+        return {
+            'usos': invite.uses or 0,
+            'autor_id': invite.inviter.id if invite.inviter else None,
+            'max_usos': invite.max_uses or 0
+        }
+    
+    async def _buscar_convites(self, guild):
+        """Busca os convites atuais; None se o bot não puder ver os convites"""
+        self.ultima_busca[guild.id] = time.monotonic()
+        self.stats['buscas'] += 1
+        try:
+            return {invite.code: self._dados_convite(invite) for invite in await guild.invites()}
+        except discord.Forbidden:
+            return None
+    
+    async def carregar_snapshot(self, guild):
+        convites = await self._buscar_convites(guild)
+        if convites is not None:
+            self.convites_ativos[guild.id] = convites
+    
+    def convite_criado(self, invite):
+        if invite.guild and invite.guild.id in self.convites_ativos:
+            self.convites_ativos[invite.guild.id][invite.code] = self._dados_convite(invite)
+    
+    def convite_apagado(self, invite):
+        if not invite.guild or invite.guild.id not in self.convites_ativos:
+            return
+        dados = self.convites_ativos[invite.guild.id].pop(invite.code, None)
+        # Só conta como uso se faltava exatamente um para o limite; apagado à mão
+        # (ou com snapshot atrasado) o convite só sai do snapshot
+        if dados and dados['max_usos'] and dados['usos'] + 1 == dados['max_usos']:
+            self.esgotados.setdefault(invite.guild.id, []).append(
+                (invite.code, dados['autor_id'], time.monotonic())
+            )
+    
+    def registrar_entrada(self, member):
+        """Enfileira a entrada; a atribuição acontece em lote"""
+        guild = member.guild
+        if not self.pendentes.get(guild.id):
+            self.inicio_lote[guild.id] = time.monotonic()
+        self.pendentes.setdefault(guild.id, []).append(member)
+        task = self.tasks.get(guild.id)
+        if not task or task.done():
+            self.tasks[guild.id] = asyncio.create_task(self._processar_lotes(guild))
+    
+    async def _processar_lotes(self, guild):
+        try:
+            if guild.id not in self.convites_ativos:
+                # Primeira entrada: o snapshot de agora já inclui o uso dela,
+                # então só dá para atribuir a partir das próximas
+                if time.monotonic() - self.ultima_busca.get(guild.id, 0) >= self.intervalo_minimo:
+                    await self.carregar_snapshot(guild)
+                self.pendentes.pop(guild.id, None)
+                self.inicio_lote.pop(guild.id, None)
+                return
+            
+            while self.pendentes.get(guild.id):
+                decorrido = time.monotonic() - self.ultima_busca.get(guild.id, 0)
+                await asyncio.sleep(max(self.janela_lote, self.intervalo_minimo - decorrido))
+                
+                convites = await self._buscar_convites(guild)
+                # Lote tirado depois da busca: quem entrou durante ela já tem o uso contado
+                membros = self.pendentes.pop(guild.id, [])
+                inicio = self.inicio_lote.pop(guild.id, time.monotonic())
+                if convites is None:
+                    continue
+                await self._atribuir(guild, membros, convites, inicio)
+        except Exception as e:
+            print(f"Erro ao verificar convites: {e}")
+    
+    def _autores_por_uso(self, guild, convites, inicio):
+        """Lista de autores, um por uso novo desde o snapshot"""
+        anterior = self.convites_ativos.get(guild.id, {})
+        # Mais antigos que uma janela antes da primeira entrada do lote não têm relação com ele
+        limite = inicio - (self.janela_lote + self.intervalo_minimo)
+        autores = []
+        adiantados, visto_em = self.usos_adiantados.pop(guild.id, ([], 0))
+        if visto_em >= limite:
+            autores.extend(adiantados)
+        for code, dados in convites.items():
+            novos_usos = dados['usos'] - anterior.get(code, {}).get('usos', 0)
+            autores.extend([dados['autor_id']] * max(novos_usos, 0))
+        for code, autor_id, apagado_em in self.esgotados.pop(guild.id, []):
+            if apagado_em >= limite:
+                autores.append(autor_id)
+        return autores
+    
+    async def _atribuir(self, guild, membros, convites, inicio):
+        autores = self._autores_por_uso(guild, convites, inicio)
+        self.convites_ativos[guild.id] = convites
+        
+        convidantes = set(autores)
+        if len(convidantes) != 1 or len(autores) < len(membros):
+            # Lote com mais de um convidante (ou entradas sem uso correspondente):
+            # parear por ordem atribuiria convidados à pessoa errada
+            if autores:
+                print(f"⚠️ Convites ambíguos em {guild.name}: {len(membros)} entradas, "
+                      f"{len(autores)} usos de {len(convidantes)} convidantes; lote não atribuído")
+            self.stats['sem_convite'] += len(membros)
+            return
+        
+        autor_id = convidantes.pop()
+        if len(autores) > len(membros):
+            # Usos de entradas que o gateway ainda não entregou: ficam para o próximo lote
+            self.usos_adiantados[guild.id] = ([autor_id] * (len(autores) - len(membros)), time.monotonic())
+        if not membros:
+            return
+        if not autor_id or autor_id == bot.user.id or not guild.get_member(autor_id):
+            self.stats['sem_convite'] += len(membros)
+            return
+        
+        for member in membros:
+            try:
+                if await self.registrar_convite(member, autor_id):
+                    self.stats['atribuidos'] += 1
+                    print(f"✅ Convite registrado: {autor_id} convidou {member.name}")
+            except Exception as e:
+                print(f"Erro ao registrar convite de {member.name}: {e}")
     
     async def registrar_convite(self, member, convidante_id):
         convidante_id_str = str(convidante_id)
@@ -1596,6 +3874,11 @@ async def on_message(message):
         else:
             return  # Apenas ignora outros bots, não deleta
     
+    # ✅ NOVO: Alimentar o índice de busca
+    indice_busca.indexar(message)
+    if message.attachments:
+        await indice_pdfs.registrar(message)
+    
     # 🛡️ DETECÇÃO PROATIVA - SEMPRE ATIVA
     if not sistema_deteccao.modo_emergencia:
         # Detectar painéis suspeitos (apenas monitoramento)
@@ -1624,12 +3907,13 @@ async def on_message(message):
             mensagem_respondida = await message.channel.fetch_message(message.reference.message_id)
             if mensagem_respondida.author.id == bot.user.id:
                 await message.channel.typing()
-                resposta = await groq_ai.gerar_resposta(
+                await groq_ai.responder_stream(
+                    message.reply,
                     message.content, 
                     user_id=message.author.id, 
-                    contexto_conversa=True
+                    contexto_conversa=True,
+                    guild_id=message.guild.id if message.guild else None
                 )
-                await message.reply(resposta)
                 return await bot.process_commands(message)
         except:
             pass
@@ -1644,11 +3928,14 @@ async def on_message(message):
         if any(nome in mensagem_limpa.lower() for nome in ['criador', 'creator', 'quem te fez', 'tzx']):
             resposta = "Meu criador é o **TzX** (@zrei_helper)! Ele manja de Python, Golang, é exploiter, white hat e atualmente quer ser bug bounty. É um cara fera! 🚀"
         elif mensagem_limpa:
-            resposta = await groq_ai.gerar_resposta(
+            await groq_ai.responder_stream(
+                message.reply,
                 mensagem_limpa, 
                 user_id=message.author.id, 
-                contexto_conversa=True
+                contexto_conversa=True,
+                guild_id=message.guild.id if message.guild else None
             )
+            return await bot.process_commands(message)
         else:
             resposta = "Eae! Tudo bem? Como posso ajudar?"
         
@@ -2047,7 +4334,8 @@ async def substituir_simbolos_nicks(ctx, simbolo_antigo: str, simbolo_novo: str)
     try:
         membros_alterados = 0
         
-        for member in ctx.guild.members:
+        ids = indice_membros.snapshot(ctx.guild).com_nick_contendo(simbolo_antigo)
+        for member in indice_membros.membros(ctx.guild, ids):
             if member.nick and simbolo_antigo in member.nick:
                 try:
                     novo_nick = member.nick.replace(simbolo_antigo, simbolo_novo)
@@ -2134,7 +4422,7 @@ async def ssm_status(ctx):
     status_protecao = "✅ Ativo" if not sistema_deteccao.modo_emergencia else "🚨 EMERGÊNCIA"
     embed.add_field(name="🛡️ Modo de Proteção", value=status_protecao, inline=True)
     embed.add_field(name="⏰ Rate Limit", value="✅ Ativo" if rate_system.rate_limit_active else "❌ Inativo", inline=True)
-    embed.add_field(name="🎫 Sistema de Tickets", value="✅ Configurado" if CONFIG['canais_automaticos'].get('tickets') else "⚙️ Não configurado", inline=True)
+    embed.add_field(name="🎫 Sistema de Tickets", value="✅ Configurado" if canais_servidor.obter_id(ctx.guild, 'tickets') else "⚙️ Não configurado", inline=True)
     
     # Usuários em quarentena
     if sistema_seguranca.quarentena_usuarios:
@@ -2176,9 +4464,15 @@ async def mostrar_meu_id(ctx):
 
 # ========== EVENTOS DE DETECÇÃO PROATIVA CORRIGIDOS ==========
 
+@bot.event
+async def on_audit_log_entry_create(entry):
+    """✅ NOVO: Alimenta o correlacionador com o audit log em tempo real"""
+    correlacionador_auditoria.registrar(entry)
+
 @bot.event
 async def on_guild_channel_create(channel):
     """Detecta criação de canais suspeitos - CORRIGIDO"""
+    canais_servidor.invalidar(channel.guild.id)
     
     # 🛡️ DETECÇÃO PROATIVA - Monitorar criação suspeita
     if not sistema_deteccao.modo_emergencia:
@@ -2187,124 +4481,146 @@ async def on_guild_channel_create(channel):
             return  # Já ativou proteção emergencial
         
         # Sistema de segurança - detectar nuke
-        async for entry in channel.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_create):
-            if entry.target.id == channel.id:
-                # ✅ CORREÇÃO CRÍTICA: Ignorar bots da whitelist
-                if entry.user.id != bot.user.id and not (entry.user.bot and entry.user.id in sistema_seguranca.whitelist_bots):
-                    nuke_detectado = await sistema_seguranca.detectar_nuke(channel.guild, entry.user, "channel_create")
-                    if nuke_detectado:
-                        return
-                break
+        entry = await correlacionador_auditoria.aguardar_entrada(channel.guild, discord.AuditLogAction.channel_create, channel.id)
+        if entry:
+            # ✅ CORREÇÃO CRÍTICA: Ignorar bots da whitelist
+            if entry.user.id != bot.user.id and not (entry.user.bot and entry.user.id in sistema_seguranca.whitelist_bots):
+                nuke_detectado = await sistema_seguranca.detectar_nuke(channel.guild, entry.user, "channel_create")
+                if nuke_detectado:
+                    return
     
     # Sistema original de rate limit
     if rate_system.rate_limit_active:
-        async for entry in channel.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_create):
-            if entry.target.id == channel.id:
-                autor = entry.user
+        entry = await correlacionador_auditoria.aguardar_entrada(channel.guild, discord.AuditLogAction.channel_create, channel.id)
+        if entry:
+            autor = entry.user
                 
-                # ✅ CORREÇÃO: Ignorar bots da whitelist
-                if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
-                    break
+            # ✅ CORREÇÃO: Ignorar bots da whitelist
+            if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
+                return
                     
-                try:
-                    nome_canal = channel.name
-                    tipo_canal = "texto" if isinstance(channel, discord.TextChannel) else "voz" if isinstance(channel, discord.VoiceChannel) else "categoria"
+            try:
+                nome_canal = channel.name
+                tipo_canal = "texto" if isinstance(channel, discord.TextChannel) else "voz" if isinstance(channel, discord.VoiceChannel) else "categoria"
                     
-                    await channel.delete()
+                await channel.delete()
                     
-                    await log_system.log_rate_limit(
-                        channel.guild, 
-                        "CANAL BLOQUEADO", 
-                        autor, 
-                        f"{tipo_canal.capitalize()} '{nome_canal}' criado e automaticamente deletado"
-                    )
+                await log_system.log_rate_limit(
+                    channel.guild, 
+                    "CANAL BLOQUEADO", 
+                    autor, 
+                    f"{tipo_canal.capitalize()} '{nome_canal}' criado e automaticamente deletado"
+                )
                 
-                except Exception as e:
-                    print(f"Erro ao deletar canal durante rate limit: {e}")
-                break
+            except Exception as e:
+                print(f"Erro ao deletar canal durante rate limit: {e}")
+
+# ✅ NOVO: Invalidar o cache de canais de log quando a estrutura muda
+@bot.event
+async def on_guild_channel_delete(channel):
+    canais_servidor.invalidar(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    if before.name != after.name or before.position != after.position:
+        canais_servidor.invalidar(after.guild.id)
 
 @bot.event
 async def on_guild_role_create(role):
     """Detecta criação de cargos suspeitos - CORRIGIDO"""
+    paineis_cargos.invalidar(role.guild)
     
     # 🛡️ DETECÇÃO PROATIVA - Verificar se é ataque
     if not sistema_deteccao.modo_emergencia:
-        async for entry in role.guild.audit_logs(limit=5, action=discord.AuditLogAction.role_create):
-            if entry.target.id == role.id:
-                # ✅ CORREÇÃO CRÍTICA: Ignorar bots da whitelist
-                if entry.user.id != bot.user.id and not (entry.user.bot and entry.user.id in sistema_seguranca.whitelist_bots):
-                    # Detectar padrão de ataque
-                    if await sistema_deteccao.detectar_ataque_em_andamento(role.guild, entry.user, "role_create"):
-                        return  # Já ativou proteção
+        entry = await correlacionador_auditoria.aguardar_entrada(role.guild, discord.AuditLogAction.role_create, role.id)
+        if entry:
+            # ✅ CORREÇÃO CRÍTICA: Ignorar bots da whitelist
+            if entry.user.id != bot.user.id and not (entry.user.bot and entry.user.id in sistema_seguranca.whitelist_bots):
+                # Detectar padrão de ataque
+                if await sistema_deteccao.detectar_ataque_em_andamento(role.guild, entry.user, "role_create"):
+                    return  # Já ativou proteção
                     
-                    # Sistema de segurança
-                    nuke_detectado = await sistema_seguranca.detectar_nuke(role.guild, entry.user, "role_create")
-                    if nuke_detectado:
-                        return
-                break
+                # Sistema de segurança
+                nuke_detectado = await sistema_seguranca.detectar_nuke(role.guild, entry.user, "role_create")
+                if nuke_detectado:
+                    return
     
     # Sistema original de rate limit
     if rate_system.rate_limit_active:
-        async for entry in role.guild.audit_logs(limit=5, action=discord.AuditLogAction.role_create):
-            if entry.target.id == role.id:
-                autor = entry.user
+        entry = await correlacionador_auditoria.aguardar_entrada(role.guild, discord.AuditLogAction.role_create, role.id)
+        if entry:
+            autor = entry.user
                 
-                # ✅ CORREÇÃO: Ignorar bots da whitelist
-                if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
-                    break
+            # ✅ CORREÇÃO: Ignorar bots da whitelist
+            if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
+                return
                     
-                try:
-                    nome_cargo = role.name
-                    await role.delete()
+            try:
+                nome_cargo = role.name
+                await role.delete()
                     
-                    await log_system.log_rate_limit(
-                        role.guild, 
-                        "CARGO BLOQUEADO", 
-                        autor, 
-                        f"Cargo '{nome_cargo}' criado e automaticamente deletado"
-                    )
+                await log_system.log_rate_limit(
+                    role.guild, 
+                    "CARGO BLOQUEADO", 
+                    autor, 
+                    f"Cargo '{nome_cargo}' criado e automaticamente deletado"
+                )
                 
-                except Exception as e:
-                    print(f"Erro ao deletar cargo durante rate limit: {e}")
-                break
+            except Exception as e:
+                print(f"Erro ao deletar cargo durante rate limit: {e}")
+
+# ✅ NOVO: Manter o mapa dos painéis de self-roles em dia com os cargos
+@bot.event
+async def on_guild_role_delete(role):
+    paineis_cargos.invalidar(role.guild)
+    indice_membros.cargo_apagado(role)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name:
+        paineis_cargos.invalidar(after.guild)
 
 @bot.event
 async def on_member_ban(guild, user):
     """Detecta bans em massa - CORRIGIDO"""
     if not sistema_deteccao.modo_emergencia:
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.ban):
-            if entry.target.id == user.id:
-                autor = entry.user
+        entry = await correlacionador_auditoria.aguardar_entrada(guild, discord.AuditLogAction.ban, user.id)
+        if entry:
+            autor = entry.user
                 
-                # ✅ CORREÇÃO: Ignorar bots da whitelist
-                if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
-                    return
+            # ✅ CORREÇÃO: Ignorar bots da whitelist
+            if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
+                return
                     
-                # Detectar padrão de mass ban
-                if await sistema_deteccao.detectar_ataque_em_andamento(guild, autor, "ban"):
-                    return
+            # Detectar padrão de mass ban
+            if await sistema_deteccao.detectar_ataque_em_andamento(guild, autor, "ban"):
+                return
 
 @bot.event
 async def on_member_remove(member):
     """Detecta kicks em massa - CORRIGIDO"""
+    saida = discord.utils.utcnow() - timedelta(seconds=correlacionador_auditoria.tolerancia)
+    indice_membros.saiu(member)
     await log_system.log_saida(member)
     
     if not sistema_deteccao.modo_emergencia:
-        async for entry in member.guild.audit_logs(limit=5, action=discord.AuditLogAction.kick):
-            if entry.target.id == member.id:
-                autor = entry.user
+        # Saídas voluntárias não geram entrada: só o gateway, sem fallback REST
+        entry = await correlacionador_auditoria.aguardar_entrada(member.guild, discord.AuditLogAction.kick, member.id, desde=saida, rest=False)
+        if entry:
+            autor = entry.user
                 
-                # ✅ CORREÇÃO: Ignorar bots da whitelist
-                if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
-                    return
+            # ✅ CORREÇÃO: Ignorar bots da whitelist
+            if autor.bot and autor.id in sistema_seguranca.whitelist_bots:
+                return
                     
-                # Detectar padrão de mass kick
-                if await sistema_deteccao.detectar_ataque_em_andamento(member.guild, autor, "kick"):
-                    return
+            # Detectar padrão de mass kick
+            if await sistema_deteccao.detectar_ataque_em_andamento(member.guild, autor, "kick"):
+                return
 
 @bot.event
 async def on_member_join(member):
     """Verifica bots não autorizados na entrada - CORRIGIDO"""
+    indice_membros.entrou(member)
     await log_system.log_entrada(member)
     
     # Sistema de segurança - verificar bots
@@ -2330,20 +4646,17 @@ async def on_member_join(member):
     await sistema_cargos.atualizar_nick_automatico(member)
     
     # SISTEMA DE CONVITES FUNCIONAL
-    try:
-        invites = await member.guild.invites()
-        for invite in invites:
-            if invite.uses > sistema_convites.convites_ativos.get(invite.code, 0):
-                inviter = invite.inviter
-                if inviter and inviter != bot.user:
-                    success = await sistema_convites.registrar_convite(member, inviter.id)
-                    if success:
-                        print(f"✅ Convite registrado: {inviter.name} convidou {member.name}")
-                    break
-                
-                sistema_convites.convites_ativos[invite.code] = invite.uses
-    except Exception as e:
-        print(f"Erro ao verificar convites: {e}")
+    # ✅ NOVO: Atribuição em lote a partir do snapshot de convites
+    sistema_convites.registrar_entrada(member)
+
+# ✅ NOVO: Snapshot de convites atualizado pelos eventos
+@bot.event
+async def on_invite_create(invite):
+    sistema_convites.convite_criado(invite)
+
+@bot.event
+async def on_invite_delete(invite):
+    sistema_convites.convite_apagado(invite)
 
 @bot.event
 async def on_raw_reaction_add(payload):
@@ -2362,7 +4675,7 @@ async def on_raw_reaction_add(payload):
     canal = guild.get_channel(payload.channel_id)
     
     # Verificar se é o canal de tickets
-    canal_tickets_id = CONFIG['canais_automaticos'].get('tickets')
+    canal_tickets_id = canais_servidor.obter_id(guild, 'tickets')
     if canal_tickets_id and canal.id == canal_tickets_id and str(payload.emoji) == "🎫":
         try:
             mensagem = await canal.fetch_message(payload.message_id)
@@ -2379,6 +4692,134 @@ async def on_raw_reaction_add(payload):
 async def on_raw_reaction_remove(payload):
     await processar_reacao_cargo(payload, "remove")
 
+# ✅ NOVO: Manter o índice de busca em dia com edições e exclusões
+@bot.event
+async def on_raw_message_edit(payload):
+    if payload.guild_id and 'content' in payload.data:
+        indice_busca.editar(payload.message_id, payload.data['content'])
+
+@bot.event
+async def on_raw_message_delete(payload):
+    indice_busca.remover([payload.message_id])
+    await indice_pdfs.remover_mensagens([payload.message_id])
+    paineis_cargos.remover_mensagens({payload.message_id})
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    indice_busca.remover(payload.message_ids)
+    await indice_pdfs.remover_mensagens(list(payload.message_ids))
+    paineis_cargos.remover_mensagens(payload.message_ids)
+
+# ✅ NOVO: Mapa persistente (servidor, mensagem, emoji) -> cargo dos painéis de self-roles
+class PaineisCargos:
+    """Resolve reações de self-roles sem REST e em O(1).
+
+    Quando um painel é postado (ou visto pela primeira vez) cada emoji dele
+    é ligado ao nome do cargo e ao id resolvido; tudo fica na tabela
+    paineis_cargos do data.db e num dict em memória. Eventos de cargo
+    re-resolvem os ids do servidor pelo nome. Mensagens do canal que não são
+    painéis também ficam lembradas para não serem buscadas de novo.
+    """
+
+    def __init__(self):
+        self.paineis = {}  # (guild_id, mensagem_id) -> {emoji: [cargo_nome, role_id]}
+        self.nao_paineis = set()  # (guild_id, mensagem_id)
+        self.stats = {'acertos': 0, 'buscas': 0}
+        self.criar_tabela()
+        self.carregar()
+
+    @staticmethod
+    def normalizar_emoji(emoji):
+        # "🛡️" e "🛡" chegam dos dois jeitos nas reações
+        return str(emoji).replace('\ufe0f', '')
+
+    def criar_tabela(self):
+        with db.lock_conexao:
+            with db.conexao:
+                db.conexao.execute("""
+                    CREATE TABLE IF NOT EXISTS paineis_cargos (
+                        guild_id INTEGER NOT NULL,
+                        mensagem_id INTEGER NOT NULL,
+                        emoji TEXT NOT NULL,
+                        cargo_nome TEXT NOT NULL,
+                        role_id INTEGER,
+                        PRIMARY KEY (guild_id, mensagem_id, emoji)
+                    )
+                """)
+
+    def carregar(self):
+        with db.lock_conexao:
+            linhas = db.conexao.execute(
+                "SELECT guild_id, mensagem_id, emoji, cargo_nome, role_id FROM paineis_cargos"
+            ).fetchall()
+        for guild_id, mensagem_id, emoji, cargo_nome, role_id in linhas:
+            self.paineis.setdefault((guild_id, mensagem_id), {})[emoji] = [cargo_nome, role_id]
+
+    def _gravar(self, guild_id, mensagem_id=None):
+        """Regrava as linhas de um painel (ou de todos os painéis do servidor)"""
+        chaves = [chave for chave in self.paineis if chave[0] == guild_id and mensagem_id in (None, chave[1])]
+        linhas = [(g, m, emoji, nome, role_id)
+                  for g, m in chaves for emoji, (nome, role_id) in self.paineis[(g, m)].items()]
+        with db.lock_conexao:
+            with db.conexao:
+                db.conexao.executemany("INSERT OR REPLACE INTO paineis_cargos VALUES (?, ?, ?, ?, ?)", linhas)
+
+    def registrar_painel(self, guild, mensagem_id, nomes_cargos):
+        """Liga cada emoji do painel ao cargo (nome no formato "<emoji> Nome")"""
+        cargos = {role.name: role.id for role in guild.roles}
+        painel = self.paineis.setdefault((guild.id, mensagem_id), {})
+        for nome in nomes_cargos:
+            painel[self.normalizar_emoji(nome.split(' ')[0])] = [nome, cargos.get(nome)]
+        self.nao_paineis.discard((guild.id, mensagem_id))
+        self._gravar(guild.id, mensagem_id)
+
+    def remover_mensagens(self, mensagem_ids):
+        removidos = [chave for chave in self.paineis if chave[1] in mensagem_ids]
+        for chave in removidos:
+            del self.paineis[chave]
+        if removidos:
+            with db.lock_conexao:
+                with db.conexao:
+                    db.conexao.executemany(
+                        "DELETE FROM paineis_cargos WHERE guild_id = ? AND mensagem_id = ?", removidos
+                    )
+
+    def invalidar(self, guild):
+        """Cargos mudaram: re-resolve os ids pelo nome"""
+        if not any(chave[0] == guild.id for chave in self.paineis):
+            return
+        cargos = {role.name: role.id for role in guild.roles}
+        for (guild_id, _), painel in self.paineis.items():
+            if guild_id == guild.id:
+                for entrada in painel.values():
+                    entrada[1] = cargos.get(entrada[0])
+        self._gravar(guild.id)
+
+    async def resolver(self, guild, canal, mensagem_id, emoji):
+        """Retorna o cargo da reação (ou None)"""
+        chave = (guild.id, mensagem_id)
+        if chave in self.nao_paineis:
+            return None
+        
+        painel = self.paineis.get(chave)
+        if painel is None:
+            # Painel postado antes do mapa existir: buscar a mensagem uma única vez
+            self.stats['buscas'] += 1
+            mensagem = await canal.fetch_message(mensagem_id)
+            if not mensagem.embeds:
+                self.nao_paineis.add(chave)
+                return None
+            self.registrar_painel(guild, mensagem_id,
+                                  list(CONFIG["cargos_linguagens"].keys()) + list(CONFIG["cargos_cyber"].keys()))
+            painel = self.paineis[chave]
+        else:
+            self.stats['acertos'] += 1
+        
+        entrada = painel.get(self.normalizar_emoji(emoji))
+        return guild.get_role(entrada[1]) if entrada and entrada[1] else None
+
+paineis_cargos = PaineisCargos()
+
 async def processar_reacao_cargo(payload, acao):
     if payload.member and payload.member.bot:
         return
@@ -2394,38 +4835,19 @@ async def processar_reacao_cargo(payload, acao):
     canal = guild.get_channel(payload.channel_id)
     
     # Verificar tanto pelo nome quanto pelo ID configurado
-    canal_self_roles_id = CONFIG['canais_automaticos'].get('self_roles')
-    canal_self_roles = guild.get_channel(canal_self_roles_id) if canal_self_roles_id else None
+    canal_self_roles = canais_servidor.obter(guild, 'self_roles')
     
     if not canal or (canal.name != "🎯・self-roles" and canal != canal_self_roles):
         return
     
     try:
-        mensagem = await canal.fetch_message(payload.message_id)
+        cargo_encontrado = await paineis_cargos.resolver(guild, canal, payload.message_id, payload.emoji)
         
-        for embed in mensagem.embeds:
-            titulo = embed.title if embed.title else ""
-            
-            cargo_encontrado = None
-            emoji_str = str(payload.emoji)
-            
-            for cargo_nome in CONFIG["cargos_linguagens"].keys():
-                if cargo_nome.startswith(emoji_str):
-                    cargo_encontrado = discord.utils.get(guild.roles, name=cargo_nome)
-                    break
-            
-            if not cargo_encontrado:
-                for cargo_nome in CONFIG["cargos_cyber"].keys():
-                    if cargo_nome.startswith(emoji_str):
-                        cargo_encontrado = discord.utils.get(guild.roles, name=cargo_nome)
-                        break
-            
-            if cargo_encontrado:
-                if acao == "add":
-                    await member.add_roles(cargo_encontrado)
-                else:
-                    await member.remove_roles(cargo_encontrado)
-                break
+        if cargo_encontrado:
+            if acao == "add":
+                await member.add_roles(cargo_encontrado)
+            else:
+                await member.remove_roles(cargo_encontrado)
                 
     except Exception as e:
         print(f"Erro no sistema de cargos: {e}")
@@ -2545,10 +4967,9 @@ async def backup_canais(ctx):
                 }
                 backup_data["canais"].append(canal_info)
         
-        # Salvar backup
-        backup_id = f"backup_canais_{ctx.guild.id}_{int(datetime.now().timestamp())}"
-        db.config[f'backup_{backup_id}'] = backup_data
-        db.salvar_dados()
+        # ✅ NOVO: Salvar no armazém de snapshots (itens iguais ao backup anterior são reaproveitados)
+        snapshot = armazem_snapshots.salvar(ctx.guild.id, backup_data, tipo='backup_canais')
+        backup_id = snapshot['id']
         
         embed = discord.Embed(
             title="💾 BACKUP DE CANAIS CRIADO",
@@ -2556,7 +4977,8 @@ async def backup_canais(ctx):
             color=0x00ff00
         )
         embed.add_field(name="📊 Estatísticas", 
-                       value=f"• {len(backup_data['categorias'])} categorias\n• {len(backup_data['canais'])} canais", 
+                       value=f"• {len(backup_data['categorias'])} categorias\n• {len(backup_data['canais'])} canais\n"
+                             f"• {snapshot['delta']['reaproveitados']} itens iguais ao backup anterior", 
                        inline=False)
         embed.add_field(name="🆔 ID do Backup", value=backup_id, inline=True)
         
@@ -2572,12 +4994,16 @@ async def restaurar_canais(ctx, backup_id: str):
     await ctx.typing()
     
     try:
-        backup_key = f'backup_{backup_id}'
-        if backup_key not in db.config:
-            await ctx.send("❌ Backup não encontrado!")
-            return
+        # ✅ NOVO: Só aceita backup de canais deste servidor (o armazém é dividido com o CAT BOT)
+        backup_data = armazem_snapshots.carregar(backup_id, ctx.guild.id, 'backup_canais')
+        
+        # Backups antigos ficavam em db.config (o id já trazia o servidor)
+        if backup_data is None and backup_id.startswith(f"backup_canais_{ctx.guild.id}_"):
+            backup_data = db.config.get(f'backup_{backup_id}')
         
-        backup_data = db.config[backup_key]
+        if backup_data is None:
+            await ctx.send("❌ Backup não encontrado! Use `!backups_canais` para ver os disponíveis.")
+            return
         
         embed = discord.Embed(
             title="🔄 RESTAURAÇÃO DE CANAIS",
@@ -2596,6 +5022,31 @@ async def restaurar_canais(ctx, backup_id: str):
     except Exception as e:
         await ctx.send(f"❌ Erro ao restaurar backup: {e}")
 
+@bot.command(name='backups_canais')
+@commands.has_permissions(administrator=True)
+async def backups_canais(ctx):
+    """🕘 Lista o histórico de backups de canais do servidor"""
+    snapshots = armazem_snapshots.listar(ctx.guild.id, 'backup_canais')
+    
+    if not snapshots:
+        await ctx.send("❌ Nenhum backup de canais encontrado!")
+        return
+    
+    embed = discord.Embed(
+        title="🕘 BACKUPS DE CANAIS",
+        description="Use `!restaurar_canais <backup_id>` para restaurar.",
+        color=0x0099ff
+    )
+    for snapshot in snapshots[:10]:
+        embed.add_field(
+            name=snapshot['id'],
+            value=f"📅 {datetime.fromtimestamp(snapshot['criado_em']).strftime('%d/%m/%Y %H:%M')}\n"
+                  f"📦 {snapshot['delta']['novos']} novos / {snapshot['delta']['reaproveitados']} iguais",
+            inline=False
+        )
+    
+    await ctx.send(embed=embed)
+
 @bot.command(name='limpar_canais_inativos')
 @commands.has_permissions(administrator=True)
 async def limpar_canais_inativos(ctx, dias: int = 30):
@@ -2703,20 +5154,16 @@ async def sync_cargos(ctx):
     await ctx.typing()
     
     try:
-        membros_sincronizados = 0
-        erros = 0
+        # ✅ NOVO: Executor em lote no lugar do sleep fixo entre membros
+        acoes = await sistema_cargos.acoes_nick_automatico(
+            indice_membros.membros(ctx.guild, indice_membros.snapshot(ctx.guild).humanos())
+        )
+        resultado = await executor_lote.executar(acoes)
         
-        for member in ctx.guild.members:
-            if member.bot:
-                continue
-                
-            try:
-                await sistema_cargos.atualizar_nick_automatico(member)
-                membros_sincronizados += 1
-                await asyncio.sleep(0.2)  # Rate limit
-            except Exception as e:
-                print(f"Erro ao sincronizar {member.name}: {e}")
-                erros += 1
+        for nome, erro in resultado['falhas']:
+            print(f"Erro ao sincronizar {nome}: {erro}")
+        membros_sincronizados = resultado['sucesso']
+        erros = len(resultado['falhas'])
         
         embed = discord.Embed(
             title="🔄 SINCRONIZAÇÃO DE CARGOS",
@@ -2852,8 +5299,9 @@ async def server_health(ctx):
         
         # Coletar métricas
         total_membros = guild.member_count
-        membros_ativos = len([m for m in guild.members if m.status != discord.Status.offline])
-        bots = len([m for m in guild.members if m.bot])
+        contagens = indice_membros.snapshot(guild).contagens()
+        membros_ativos = contagens['ativos']
+        bots = contagens['bots']
         canais_ativos = len([c for c in guild.text_channels])
         
         # Verificar sistemas
@@ -2864,15 +5312,13 @@ async def server_health(ctx):
         sistemas.append(("🎯 Sistema de Cargos", "✅" if cargo_membro else "❌"))
         
         # Sistema de tickets
-        canal_tickets = CONFIG['canais_automaticos'].get('tickets')
+        canal_tickets = canais_servidor.obter_id(guild, 'tickets')
         sistemas.append(("🎫 Sistema de Tickets", "✅" if canal_tickets else "❌"))
         
         # Sistema de logs
-        logs_ativos = 0
-        for tipo in CONFIG['canais_automaticos']:
-            if CONFIG['canais_automaticos'][tipo]:
-                logs_ativos += 1
-        sistemas.append(("📁 Sistema de Logs", f"{logs_ativos}/7"))
+        config_canais = canais_servidor.configuracao(guild)
+        logs_ativos = len([tipo for tipo, canal_id in config_canais.items() if canal_id])
+        sistemas.append(("📁 Sistema de Logs", f"{logs_ativos}/{len(config_canais)}"))
         
         # Sistema de segurança
         cargo_quarentena = discord.utils.get(guild.roles, name="[SSM - QUARENTENA]")
@@ -3047,14 +5493,24 @@ async def mute(ctx, member: discord.Member, tempo: str = "30m", *, motivo="Não
         await ctx.send(embed=embed)
         await log_system.log_moderacao("MUTE", ctx.author, member, motivo, tempo)
         
-        # Agendar remoção do mute
-        await asyncio.sleep(segundos)
-        if muted_role in member.roles:
-            await member.remove_roles(muted_role)
+        # ✅ NOVO: Remoção do mute fica no agendador (sobrevive a reinícios)
+        agendador.agendar('mute', segundos, {
+            'guild_id': ctx.guild.id, 'member_id': member.id, 'role_id': muted_role.id
+        }, f"mute:{ctx.guild.id}:{member.id}")
             
     except Exception as e:
         await ctx.send(f"❌ Erro ao mutar usuário: {e}")
 
+@agendador.tarefa('mute')
+async def expirar_mute(dados):
+    guild = bot.get_guild(dados['guild_id'])
+    if not guild:
+        return
+    member = guild.get_member(dados['member_id'])
+    muted_role = guild.get_role(dados['role_id'])
+    if member and muted_role and muted_role in member.roles:
+        await member.remove_roles(muted_role, reason="Mute expirado")
+
 @bot.command(name='unmute')
 @commands.has_permissions(manage_roles=True)
 async def unmute(ctx, member: discord.Member):
@@ -3071,6 +5527,7 @@ async def unmute(ctx, member: discord.Member):
             return
         
         await member.remove_roles(muted_role)
+        agendador.cancelar(f"mute:{ctx.guild.id}:{member.id}")
         await log_system.log_moderacao("UNMUTE", ctx.author, member, "Mute removido")
         
         embed = discord.Embed(
@@ -3237,15 +5694,8 @@ async def clear(ctx, quantidade: int = None):
 async def banir_membro(ctx, member: discord.Member, *, motivo="Violação grave das regras"):
     """💀 Banir membro com sistema de múltiplas denúncias"""
     try:
-        # Simular múltiplas denúncias (3 tentativas)
-        denuncias = []
-        for i in range(3):
-            try:
-                denuncia_msg = f"Denúncia #{i+1} processada"
-                denuncias.append(denuncia_msg)
-                await asyncio.sleep(0.2)
-            except:
-                continue
+        # Simular múltiplas denúncias (3 tentativas) - sem pausa, não há chamada à API aqui
+        denuncias = [f"Denúncia #{i+1} processada" for i in range(3)]
         
         # Banir o membro
         await member.ban(reason=f"SYSTEM_KILL: {motivo} | Denúncias: {len(denuncias)}")
@@ -3367,7 +5817,7 @@ async def setup_cargos(ctx):
     
     try:
         # Usar canal configurado ou criar um novo
-        canal_id = CONFIG['canais_automaticos'].get('self_roles')
+        canal_id = canais_servidor.obter_id(ctx.guild, 'self_roles')
         if canal_id:
             canal_cargos = ctx.guild.get_channel(canal_id)
             if not canal_cargos:
@@ -3421,6 +5871,8 @@ async def setup_cargos(ctx):
             await mensagem_ling.add_reaction(emoji)
             await asyncio.sleep(0.5)
         
+        paineis_cargos.registrar_painel(ctx.guild, mensagem_ling.id, CONFIG["cargos_linguagens"].keys())
+        
         embed_cyber = discord.Embed(
             title="🛡️ CYBER SEGURANÇA",
             description="**Especialidades em segurança:**\n\n"
@@ -3452,6 +5904,8 @@ async def setup_cargos(ctx):
             await mensagem_cyber.add_reaction(emoji)
             await asyncio.sleep(0.5)
         
+        paineis_cargos.registrar_painel(ctx.guild, mensagem_cyber.id, CONFIG["cargos_cyber"].keys())
+        
         await progress.edit(content=f"✅ **Sistema de cargos configurado!** {canal_cargos.mention}")
         
     except Exception as e:
@@ -3533,9 +5987,7 @@ async def set_channel(ctx, tipo: str, canal: discord.TextChannel):
         return
     
     # Salvar configuração
-    CONFIG['canais_automaticos'][tipo] = canal.id
-    db.config_canais['canais_automaticos'] = CONFIG['canais_automaticos']
-    db.salvar_dados()
+    canais_servidor.definir(ctx.guild, tipo, canal.id)
     
     embed = discord.Embed(
         title="✅ CANAL CONFIGURADO",
@@ -3553,7 +6005,7 @@ async def view_config(ctx):
         color=0x0099ff
     )
     
-    for tipo, canal_id in CONFIG['canais_automaticos'].items():
+    for tipo, canal_id in canais_servidor.configuracao(ctx.guild).items():
         if canal_id:
             canal = ctx.guild.get_channel(canal_id)
             if canal:
@@ -3586,9 +6038,7 @@ async def reset_config(ctx, tipo: str = None):
     """🔄 Resetar configuração de canais"""
     if tipo:
         if tipo in CONFIG['canais_automaticos']:
-            CONFIG['canais_automaticos'][tipo] = None
-            db.config_canais['canais_automaticos'] = CONFIG['canais_automaticos']
-            db.salvar_dados()
+            canais_servidor.resetar(ctx.guild, tipo)
             
             embed = discord.Embed(
                 title="✅ CONFIGURAÇÃO RESETADA",
@@ -3603,11 +6053,7 @@ async def reset_config(ctx, tipo: str = None):
             )
     else:
         # Resetar tudo
-        for tipo in CONFIG['canais_automaticos']:
-            CONFIG['canais_automaticos'][tipo] = None
-        
-        db.config_canais['canais_automaticos'] = CONFIG['canais_automaticos']
-        db.salvar_dados()
+        canais_servidor.resetar(ctx.guild)
         
         embed = discord.Embed(
             title="✅ CONFIGURAÇÃO COMPLETA RESETADA",
@@ -3659,8 +6105,9 @@ async def estatisticas_seguranca(ctx):
         color=0x0099ff
     )
     
-    total_membros = len(ctx.guild.members)
-    membros_ativos = len([m for m in ctx.guild.members if m.status != discord.Status.offline])
+    contagens = indice_membros.snapshot(ctx.guild).contagens()
+    total_membros = contagens['total']
+    membros_ativos = contagens['ativos']
     total_advertencias = sum(len(adv) for adv in db.advertencias.values())
     
     embed.add_field(name="👥 Total de Membros", value=total_membros, inline=True)
@@ -3719,18 +6166,13 @@ async def scan_membros(ctx):
     await ctx.typing()
     
     try:
-        membros_inativos = []
-        membros_suspeitos = []
-        
-        for member in ctx.guild.members:
-            # Verificar membros inativos (mais de 30 dias)
-            if member.joined_at and (datetime.now() - member.joined_at.replace(tzinfo=None)).days > 30:
-                if member.status == discord.Status.offline:
-                    membros_inativos.append(member)
-            
-            # Verificar contas suspeitas (muito novas)
-            if member.created_at and (datetime.now() - member.created_at.replace(tzinfo=None)).days < 7:
-                membros_suspeitos.append(member)
+        snapshot = indice_membros.snapshot(ctx.guild)
+        agora = time.time()
+        
+        # Membros inativos (entraram há mais de 30 dias e estão offline)
+        membros_inativos = snapshot.filtrar(offline=True, entrou_antes=agora - 31 * 86400)
+        # Contas suspeitas (criadas há menos de 7 dias)
+        membros_suspeitos = snapshot.filtrar(criado_depois=agora - 7 * 86400)
         
         embed = discord.Embed(
             title="🔍 SCAN DE MEMBROS",
@@ -3740,14 +6182,14 @@ async def scan_membros(ctx):
         if membros_inativos:
             embed.add_field(
                 name="💤 Membros Inativos",
-                value="\n".join([f"• {m.name}" for m in membros_inativos[:10]]) + (f"\n... e mais {len(membros_inativos)-10}" if len(membros_inativos) > 10 else ""),
+                value="\n".join([f"• {m.name}" for m in indice_membros.membros(ctx.guild, membros_inativos[:10])]) + (f"\n... e mais {len(membros_inativos)-10}" if len(membros_inativos) > 10 else ""),
                 inline=False
             )
         
         if membros_suspeitos:
             embed.add_field(
                 name="🚨 Contas Suspeitas",
-                value="\n".join([f"• {m.name} (criada há {(datetime.now() - m.created_at.replace(tzinfo=None)).days} dias)" for m in membros_suspeitos[:10]]),
+                value="\n".join([f"• {m.name} (criada há {int((agora - snapshot.criado_em_de(m.id)) // 86400)} dias)" for m in indice_membros.membros(ctx.guild, membros_suspeitos[:10])]),
                 inline=False
             )
         
@@ -4289,14 +6731,13 @@ async def criar_emoji(ctx, nome: str, url: str = None):
     try:
         if url:
             # Baixar imagem da URL
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        image_data = await response.read()
-                        emoji = await ctx.guild.create_custom_emoji(name=nome, image=image_data)
-                        await ctx.send(f"✅ Emoji {emoji} criado com sucesso!")
-                    else:
-                        await ctx.send("❌ Erro ao baixar imagem")
+            async with cliente_http.sessao.get(url) as response:
+                if response.status == 200:
+                    image_data = await response.read()
+                    emoji = await ctx.guild.create_custom_emoji(name=nome, image=image_data)
+                    await ctx.send(f"✅ Emoji {emoji} criado com sucesso!")
+                else:
+                    await ctx.send("❌ Erro ao baixar imagem")
         else:
             # Verificar se há anexo
             if ctx.message.attachments:
@@ -4308,25 +6749,384 @@ async def criar_emoji(ctx, nome: str, url: str = None):
     except Exception as e:
         await ctx.send(f"❌ Erro ao criar emoji: {e}")
 
-@bot.command(name='servericon')
-async def server_icon(ctx):
-    """�️ Mostra o ícone do servidor"""
-    if ctx.guild.icon:
-        embed = discord.Embed(title=f"Ícone do Servidor: {ctx.guild.name}", color=0x0099ff)
-        embed.set_image(url=ctx.guild.icon.url)
-        await ctx.send(embed=embed)
-    else:
-        await ctx.send("❌ Este servidor não tem ícone")
+@bot.command(name='servericon')
+async def server_icon(ctx):
+    """�️ Mostra o ícone do servidor"""
+    if ctx.guild.icon:
+        embed = discord.Embed(title=f"Ícone do Servidor: {ctx.guild.name}", color=0x0099ff)
+        embed.set_image(url=ctx.guild.icon.url)
+        await ctx.send(embed=embed)
+    else:
+        await ctx.send("❌ Este servidor não tem ícone")
+
+@bot.command(name='avatar')
+async def avatar(ctx, member: discord.Member = None):
+    """🖼️ Mostra o avatar de um usuário"""
+    member = member or ctx.author
+    embed = discord.Embed(title=f"Avatar de {member.name}", color=0x0099ff)
+    embed.set_image(url=member.avatar.url if member.avatar else member.default_avatar.url)
+    await ctx.send(embed=embed)
+
+# ========== SISTEMA PDF ORIGINAL ==========
+
+# ✅ NOVO: Exportação de canal para PDF sem travar o bot
+class ExportadorPDF:
+    """Exporta o histórico de um canal para PDF em partes.
+
+    O histórico é paginado do mais novo para o mais antigo em blocos de
+    `mensagens_por_parte`; cada bloco vira um HTML escrito direto no disco
+    (sem concatenar strings) e é renderizado pelo wkhtmltopdf num processo
+    separado, com limite de renders simultâneos e timeout. Enquanto uma parte
+    renderiza, a próxima já está sendo paginada.
+    """
+
+    ESTILO = """
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .message { border-bottom: 1px solid #eee; padding: 10px 0; page-break-inside: avoid; }
+        .author { font-weight: bold; color: #7289DA; }
+        .timestamp { color: #666; font-size: 12px; }
+        .content { margin: 5px 0; white-space: pre-wrap; }
+        .header { text-align: center; border-bottom: 2px solid #7289DA; padding-bottom: 10px; margin-bottom: 20px; }
+    """
+
+    def __init__(self, binario='/usr/bin/wkhtmltopdf', renders_simultaneos=2, timeout_render=180,
+                 mensagens_por_parte=2000, limite_maximo=50000):
+        self.binario = binario
+        self.timeout_render = timeout_render
+        self.mensagens_por_parte = mensagens_por_parte
+        self.limite_maximo = limite_maximo
+        self.semaforo = asyncio.Semaphore(renders_simultaneos)
+
+    def _escrever_parte(self, caminho, canal, guild, linhas):
+        """Escreve o HTML de uma parte (linhas já em ordem cronológica)"""
+        with open(caminho, 'w', encoding='utf-8') as f:
+            f.write('<html><head><meta charset="UTF-8">')
+            f.write(f'<title>Mensagens do Canal #{html.escape(canal)}</title><style>{self.ESTILO}</style></head><body>')
+            f.write('<div class="header">')
+            f.write(f'<h1>💬 Mensagens do Canal #{html.escape(canal)}</h1>')
+            f.write(f'<p>Servidor: {html.escape(guild)} | Gerado em: {datetime.now().strftime("%d/%m/%Y %H:%M")}</p>')
+            f.write(f'<p>Mensagens nesta parte: {len(linhas)} | Período: {linhas[0][1]} - {linhas[-1][1]}</p>')
+            f.write('</div>')
+            for autor, horario, conteudo in linhas:
+                f.write('<div class="message">')
+                f.write(f'<div class="author">{autor}</div>')
+                f.write(f'<div class="timestamp">{horario}</div>')
+                f.write(f'<div class="content">{conteudo}</div>')
+                f.write('</div>')
+            f.write('</body></html>')
+
+    async def _renderizar(self, caminho_html, caminho_pdf):
+        async with self.semaforo:
+            processo = await asyncio.create_subprocess_exec(
+                self.binario, '--quiet', '--encoding', 'utf-8', caminho_html, caminho_pdf,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, erro = await asyncio.wait_for(processo.communicate(), timeout=self.timeout_render)
+            except asyncio.TimeoutError:
+                processo.kill()
+                await processo.wait()
+                raise RuntimeError(f"renderização passou de {self.timeout_render}s")
+            
+            if not os.path.exists(caminho_pdf):
+                raise RuntimeError(erro.decode('utf-8', 'ignore')[:200] or f"wkhtmltopdf saiu com código {processo.returncode}")
+        return caminho_pdf
+
+    async def exportar_canal(self, canal, limite, ignorar_bots=True, progresso=None):
+        """Retorna {'diretorio', 'partes' (PDFs em ordem cronológica), 'total', 'inicio', 'fim'}"""
+        limite = min(limite, self.limite_maximo)
+        diretorio = tempfile.mkdtemp(prefix='pdf_canal_')
+        loop = asyncio.get_running_loop()
+        renders = []
+        bloco = []
+        total = 0
+        inicio = fim = None
+
+        async def fechar_bloco():
+            # Bloco chega do mais novo para o mais antigo
+            bloco.reverse()
+            numero = len(renders)
+            caminho_html = os.path.join(diretorio, f"parte_{numero}.html")
+            await loop.run_in_executor(None, self._escrever_parte, caminho_html, canal.name, canal.guild.name, list(bloco))
+            renders.append(asyncio.ensure_future(
+                self._renderizar(caminho_html, os.path.join(diretorio, f"parte_{numero}.pdf"))
+            ))
+            bloco.clear()
+
+        try:
+            async for message in canal.history(limit=limite):
+                if ignorar_bots and message.author.bot:  # Ignorar mensagens de bots
+                    continue
+
+                horario = message.created_at.strftime('%d/%m/%Y %H:%M')
+                bloco.append((html.escape(message.author.display_name), horario, html.escape(message.content)))
+                total += 1
+                fim = fim or message.created_at
+                inicio = message.created_at
+
+                if len(bloco) >= self.mensagens_por_parte:
+                    await fechar_bloco()
+                    if progresso:
+                        await progresso(total)
+
+            if bloco:
+                await fechar_bloco()
+
+            partes = await asyncio.gather(*renders)
+        except BaseException:
+            for render in renders:
+                render.cancel()
+            shutil.rmtree(diretorio, ignore_errors=True)
+            raise
+
+        partes.reverse()  # Cronológica: a última parte paginada é a mais antiga
+        return {'diretorio': diretorio, 'partes': partes, 'total': total, 'inicio': inicio, 'fim': fim}
+
+exportador_pdf = ExportadorPDF()
+
+# ✅ NOVO: Transcrições de canal (tickets e evidências de moderação)
+class ExportadorTranscricoes:
+    """Exporta o histórico de um canal para JSONL, HTML ou PDF.
+
+    O histórico é lido em ordem cronológica e escrito no disco a cada lote de
+    `tamanho_lote` mensagens, então a memória fica constante. Avatares e anexos
+    viram recursos numerados que aparecem uma única vez no arquivo; as
+    mensagens só guardam a chave. Depois de cada lote o progresso (último id,
+    posição no arquivo e recursos já vistos) vai para um arquivo de estado, e
+    uma exportação interrompida continua de onde parou.
+    """
+
+    FORMATOS = ('jsonl', 'html', 'pdf')
+
+    ESTILO = """
+        body { font-family: Arial, sans-serif; margin: 20px; background: #fff; }
+        .header { border-bottom: 2px solid #7289DA; padding-bottom: 10px; margin-bottom: 20px; }
+        .message { display: flex; border-bottom: 1px solid #eee; padding: 8px 0; page-break-inside: avoid; }
+        .avatar { width: 40px; height: 40px; border-radius: 50%; background-size: cover; flex-shrink: 0; margin-right: 10px; }
+        .author { font-weight: bold; color: #7289DA; }
+        .timestamp { color: #666; font-size: 12px; margin-left: 6px; }
+        .content { margin: 4px 0; white-space: pre-wrap; }
+        .anexo { display: block; font-size: 13px; }
+    """
+
+    def __init__(self, raiz='transcricoes', tamanho_lote=200):
+        self.raiz = raiz
+        self.dir_estado = os.path.join(raiz, 'estado')
+        self.tamanho_lote = tamanho_lote
+        os.makedirs(self.dir_estado, exist_ok=True)
+
+    # ---------- Estado (retomada) ----------
+
+    def _caminho_estado(self, canal_id, formato):
+        return os.path.join(self.dir_estado, f"{canal_id}_{formato}.json")
+
+    def _carregar_estado(self, canal, formato, depois):
+        # O início da janela (`depois`) é relativo a quando o comando rodou, então
+        # não entra no identificador: a retomada usa o valor resolvido na primeira vez
+        identificador = {
+            'canal_id': canal.id,
+            'formato': formato,
+            'com_janela': depois is not None
+        }
+        caminho = self._caminho_estado(canal.id, formato)
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                estado = json.load(f)
+            if estado.get('identificador') == identificador and os.path.exists(estado['arquivo']):
+                return estado
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        extensao = 'html' if formato == 'pdf' else formato
+        nome = f"{canal.guild.id}_{canal.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}"
+        return {
+            'identificador': identificador,
+            'arquivo': os.path.join(self.raiz, nome),
+            'depois': depois.isoformat() if depois else None,
+            'posicao': 0,
+            'ultimo_id': None,
+            'total': 0,
+            'recursos': {},
+            'inicio': None,
+            'fim': None
+        }
+
+    def _salvar_estado(self, estado):
+        caminho = self._caminho_estado(estado['identificador']['canal_id'], estado['identificador']['formato'])
+        temporario = caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(estado, f)
+        os.replace(temporario, caminho)
+
+    def _remover_estado(self, estado):
+        try:
+            os.remove(self._caminho_estado(estado['identificador']['canal_id'], estado['identificador']['formato']))
+        except OSError:
+            pass
+
+    # ---------- Conversão de mensagens ----------
+
+    def _recurso(self, estado, novos, url, **dados):
+        """Retorna a chave do recurso, registrando-o se for a primeira vez"""
+        chave = estado['recursos'].get(url)
+        if chave is None:
+            chave = f"r{len(estado['recursos']) + 1}"
+            estado['recursos'][url] = chave
+            novos.append(dict(chave=chave, url=url, **dados))
+        return chave
+
+    def _registro(self, estado, message):
+        """Converte a mensagem em (registro, recursos novos)"""
+        novos = []
+        autor = message.author
+        avatar = autor.avatar.url if autor.avatar else autor.default_avatar.url
+        registro = {
+            'id': message.id,
+            'autor_id': autor.id,
+            'autor': autor.display_name,
+            'bot': autor.bot,
+            'avatar': self._recurso(estado, novos, avatar, categoria='avatar'),
+            'criado_em': message.created_at.isoformat(),
+            'editado_em': message.edited_at.isoformat() if message.edited_at else None,
+            'conteudo': message.content,
+            'anexos': [
+                self._recurso(estado, novos, anexo.url, categoria='anexo', nome=anexo.filename, tamanho=anexo.size)
+                for anexo in message.attachments
+            ],
+            'embeds': len(message.embeds),
+            'resposta_a': message.reference.message_id if message.reference else None
+        }
+        return registro, novos
+
+    def _linhas_jsonl(self, registro, novos):
+        linhas = [json.dumps({'tipo': 'recurso', **recurso}, ensure_ascii=False) for recurso in novos]
+        linhas.append(json.dumps({'tipo': 'mensagem', **registro}, ensure_ascii=False))
+        return linhas
+
+    def _linhas_html(self, registro, novos):
+        linhas = []
+        for recurso in novos:
+            if recurso['categoria'] == 'avatar':
+                linhas.append(f'<style>.{recurso["chave"]} {{ background-image: url("{html.escape(recurso["url"])}"); }}</style>')
+        
+        anexos = {recurso['chave']: recurso for recurso in novos if recurso['categoria'] == 'anexo'}
+        partes_anexos = []
+        for chave in registro['anexos']:
+            if chave in anexos:
+                recurso = anexos[chave]
+                partes_anexos.append(
+                    f'<a class="anexo" id="{chave}" href="{html.escape(recurso["url"])}">📎 {html.escape(recurso["nome"])} '
+                    f'({recurso["tamanho"] // 1024} KB)</a>'
+                )
+            else:
+                partes_anexos.append(f'<a class="anexo" href="#{chave}">📎 anexo repetido ({chave})</a>')
+        
+        horario = datetime.fromisoformat(registro['criado_em']).strftime('%d/%m/%Y %H:%M')
+        linhas.append(
+            f'<div class="message" id="m{registro["id"]}"><div class="avatar {registro["avatar"]}"></div><div>'
+            f'<span class="author">{html.escape(registro["autor"])}</span><span class="timestamp">{horario}</span>'
+            f'<div class="content">{html.escape(registro["conteudo"])}</div>{"".join(partes_anexos)}</div></div>'
+        )
+        return linhas
+
+    def _cabecalho_html(self, canal, titulo):
+        return (
+            f'<html><head><meta charset="UTF-8"><title>{html.escape(titulo)}</title><style>{self.ESTILO}</style></head><body>'
+            f'<div class="header"><h1>{html.escape(titulo)}</h1>'
+            f'<p>Servidor: {html.escape(canal.guild.name)} | Canal: #{html.escape(canal.name)} | ID: {canal.id}</p></div>'
+        )
+
+    def _rodape_html(self, estado):
+        return (
+            f'<div class="header"><p>Mensagens: {estado["total"]} | '
+            f'Gerado em: {datetime.now().strftime("%d/%m/%Y %H:%M")}</p></div></body></html>'
+        )
+
+    def _gravar(self, estado, texto, cabecalho=None):
+        """Anexa o lote ao arquivo a partir da última posição confirmada"""
+        modo = 'r+' if os.path.exists(estado['arquivo']) else 'w'
+        with open(estado['arquivo'], modo, encoding='utf-8') as f:
+            f.seek(estado['posicao'])
+            f.truncate()
+            if cabecalho and estado['posicao'] == 0:
+                f.write(cabecalho)
+            f.write(texto)
+            estado['posicao'] = f.tell()
+
+    # ---------- Exportação ----------
+
+    async def exportar(self, canal, formato='html', depois=None, titulo=None, progresso=None):
+        """Exporta o canal e retorna {'arquivo', 'total', 'inicio', 'fim', 'recursos'}"""
+        if formato not in self.FORMATOS:
+            raise ValueError(f"Formato inválido: {formato}")
+        
+        loop = asyncio.get_running_loop()
+        estado = self._carregar_estado(canal, formato, depois)
+        html_saida = formato != 'jsonl'
+        cabecalho = self._cabecalho_html(canal, titulo or f"Transcrição de #{canal.name}") if html_saida else None
+        converter = self._linhas_html if html_saida else self._linhas_jsonl
+        
+        depois = datetime.fromisoformat(estado['depois']) if estado['depois'] else None
+        inicio_leitura = discord.Object(id=estado['ultimo_id']) if estado['ultimo_id'] else depois
+        lote = []
+        
+        async def gravar_lote():
+            await loop.run_in_executor(None, self._gravar, estado, "\n".join(lote) + "\n", cabecalho)
+            self._salvar_estado(estado)
+            lote.clear()
+            if progresso:
+                await progresso(estado['total'])
+        
+        async for message in canal.history(limit=None, after=inicio_leitura, oldest_first=True):
+            registro, novos = self._registro(estado, message)
+            lote.extend(converter(registro, novos))
+            estado['ultimo_id'] = message.id
+            estado['total'] += 1
+            estado['inicio'] = estado['inicio'] or registro['criado_em']
+            estado['fim'] = registro['criado_em']
+            
+            if estado['total'] % self.tamanho_lote == 0:
+                await gravar_lote()
+        
+        if lote or estado['posicao'] == 0:
+            await gravar_lote()
+        
+        arquivo = estado['arquivo']
+        if html_saida:
+            await loop.run_in_executor(None, self._gravar, estado, self._rodape_html(estado), cabecalho)
+        
+        if formato == 'pdf':
+            arquivo_pdf = arquivo[:-len('.html')] + '.pdf'
+            await exportador_pdf._renderizar(arquivo, arquivo_pdf)
+            os.remove(arquivo)
+            arquivo = arquivo_pdf
+        
+        self._remover_estado(estado)
+        return {
+            'arquivo': arquivo,
+            'total': estado['total'],
+            'inicio': estado['inicio'],
+            'fim': estado['fim'],
+            'recursos': len(estado['recursos'])
+        }
 
-@bot.command(name='avatar')
-async def avatar(ctx, member: discord.Member = None):
-    """🖼️ Mostra o avatar de um usuário"""
-    member = member or ctx.author
-    embed = discord.Embed(title=f"Avatar de {member.name}", color=0x0099ff)
-    embed.set_image(url=member.avatar.url if member.avatar else member.default_avatar.url)
-    await ctx.send(embed=embed)
+    async def enviar(self, destino, resultado, texto, limite_arquivo):
+        """Envia a transcrição se couber no limite de upload; o arquivo local é sempre apagado"""
+        try:
+            if os.path.getsize(resultado['arquivo']) <= limite_arquivo:
+                await destino.send(texto, file=discord.File(resultado['arquivo']))
+                return True
+            await destino.send(f"{texto}\n⚠️ Arquivo grande demais para o limite de upload do servidor, a transcrição não pôde ser enviada.")
+            return False
+        finally:
+            # Conteúdo privado (tickets, evidências) não fica acumulando no disco
+            try:
+                os.remove(resultado['arquivo'])
+            except OSError:
+                pass
 
-# ========== SISTEMA PDF ORIGINAL ==========
+exportador_transcricoes = ExportadorTranscricoes()
 
 @bot.command(name='pdf_canal')
 @commands.has_permissions(manage_messages=True)
@@ -4334,70 +7134,98 @@ async def pdf_canal(ctx, limite: int = 100):
     """📄 Cria PDF com as mensagens do canal"""
     await ctx.typing()
     
+    resultado = None
     try:
-        # Coletar mensagens
-        messages = []
-        async for message in ctx.channel.history(limit=limite):
-            if not message.author.bot:  # Ignorar mensagens de bots
-                messages.append(message)
+        aviso = None
+        if limite > exportador_pdf.mensagens_por_parte:
+            aviso = await ctx.send(f"⏳ Exportando até {min(limite, exportador_pdf.limite_maximo)} mensagens em partes...")
+        
+        async def progresso(total):
+            if aviso:
+                try:
+                    await aviso.edit(content=f"⏳ {total} mensagens lidas...")
+                except:
+                    pass
         
-        messages.reverse()  # Ordem cronológica
+        resultado = await exportador_pdf.exportar_canal(ctx.channel, limite, progresso=progresso)
         
-        if not messages:
+        if not resultado['total']:
             await ctx.send("❌ Nenhuma mensagem encontrada para criar o PDF")
             return
         
-        # Criar conteúdo HTML para o PDF
-        html_content = f"""
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Mensagens do Canal #{ctx.channel.name}</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                .message {{ border-bottom: 1px solid #eee; padding: 10px 0; }}
-                .author {{ font-weight: bold; color: #7289DA; }}
-                .timestamp {{ color: #666; font-size: 12px; }}
-                .content {{ margin: 5px 0; }}
-                .header {{ text-align: center; border-bottom: 2px solid #7289DA; padding-bottom: 10px; margin-bottom: 20px; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>💬 Mensagens do Canal #{ctx.channel.name}</h1>
-                <p>Servidor: {ctx.guild.name} | Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}</p>
-                <p>Total de mensagens: {len(messages)}</p>
-            </div>
-        """
+        partes = resultado['partes']
+        data = datetime.now().strftime('%Y%m%d_%H%M')
+        limite_arquivo = ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
         
-        for message in messages:
-            html_content += f"""
-            <div class="message">
-                <div class="author">{message.author.display_name}</div>
-                <div class="timestamp">{message.created_at.strftime('%d/%m/%Y %H:%M')}</div>
-                <div class="content">{message.content.replace('<', '&lt;').replace('>', '&gt;')}</div>
-            </div>
-            """
-        
-        html_content += "</body></html>"
-        
-        # Configurar pdfkit
-        config = pdfkit.configuration(wkhtmltopdf='/usr/bin/wkhtmltopdf')
-        
-        # Gerar PDF
-        pdf = pdfkit.from_string(html_content, False, configuration=config)
-        
-        # Enviar PDF
-        await ctx.send(
-            f"📄 **PDF gerado com sucesso!**\n"
-            f"**Canal:** #{ctx.channel.name}\n"
-            f"**Mensagens:** {len(messages)}\n"
-            f"**Período:** {messages[0].created_at.strftime('%d/%m %H:%M')} - {messages[-1].created_at.strftime('%d/%m %H:%M')}",
-            file=discord.File(BytesIO(pdf), filename=f"mensagens_{ctx.channel.name}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf")
-        )
+        # Enviar PDF(s): até 10 arquivos por mensagem, respeitando o limite de upload
+        grupos = [[]]
+        for numero, caminho in enumerate(partes, 1):
+            if os.path.getsize(caminho) > limite_arquivo:
+                await ctx.send(f"⚠️ Parte {numero} passou do limite de upload e foi ignorada")
+                continue
+            if len(grupos[-1]) == 10:
+                grupos.append([])
+            sufixo = f"_parte{numero}" if len(partes) > 1 else ""
+            grupos[-1].append((caminho, f"mensagens_{ctx.channel.name}_{data}{sufixo}.pdf"))
+        
+        for indice, grupo in enumerate(grupos):
+            if not grupo:
+                continue
+            texto = None
+            if indice == 0:
+                texto = (f"📄 **PDF gerado com sucesso!**\n"
+                         f"**Canal:** #{ctx.channel.name}\n"
+                         f"**Mensagens:** {resultado['total']}" + (f" em {len(partes)} partes" if len(partes) > 1 else "") + "\n"
+                         f"**Período:** {resultado['inicio'].strftime('%d/%m %H:%M')} - {resultado['fim'].strftime('%d/%m %H:%M')}")
+            await ctx.send(texto, files=[discord.File(caminho, filename=nome) for caminho, nome in grupo])
+        
+        if aviso:
+            try:
+                await aviso.delete()
+            except:
+                pass
         
     except Exception as e:
         await ctx.send(f"❌ Erro ao gerar PDF: {e}")
+    finally:
+        if resultado:
+            shutil.rmtree(resultado['diretorio'], ignore_errors=True)
+
+@bot.command(name='transcricao')
+@commands.has_permissions(manage_messages=True)
+async def transcricao(ctx, formato: str = 'html', horas: int = 0):
+    """🧾 Exporta a transcrição do canal (evidência de moderação)"""
+    formato = formato.lower()
+    if formato not in ExportadorTranscricoes.FORMATOS:
+        await ctx.send(f"❌ Formato inválido! Use: {', '.join(ExportadorTranscricoes.FORMATOS)}")
+        return
+    
+    depois = datetime.now(timezone.utc) - timedelta(hours=horas) if horas > 0 else None
+    aviso = await ctx.send("⏳ Exportando transcrição...")
+    
+    async def progresso(total):
+        try:
+            await aviso.edit(content=f"⏳ {total} mensagens exportadas...")
+        except:
+            pass
+    
+    try:
+        resultado = await exportador_transcricoes.exportar(
+            ctx.channel, formato, depois=depois,
+            titulo=f"Evidências de #{ctx.channel.name}", progresso=progresso
+        )
+    except Exception as e:
+        await aviso.edit(content=f"❌ Erro ao exportar transcrição: {e}\nUse o comando de novo para continuar de onde parou.")
+        return
+    
+    texto = (f"🧾 **Transcrição de #{ctx.channel.name}** ({formato.upper()})\n"
+             f"**Mensagens:** {resultado['total']} | **Recursos únicos:** {resultado['recursos']}")
+    await exportador_transcricoes.enviar(ctx, resultado, texto, ctx.guild.filesize_limit)
+    
+    try:
+        await aviso.delete()
+    except:
+        pass
 
 @bot.command(name='web_to_pdf')
 async def web_to_pdf(ctx, url: str):
@@ -4410,21 +7238,20 @@ async def web_to_pdf(ctx, url: str):
         
         api_url = f"https://api.html2pdf.app/v1/generate?url={urllib.parse.quote(url)}&apiKey=free"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url, timeout=30) as response:
-                if response.status == 200:
-                    pdf_data = await response.read()
-                    
-                    if len(pdf_data) > 1000:
-                        await ctx.send(
-                            f"✅ PDF gerado de: {url}",
-                            file=discord.File(BytesIO(pdf_data), filename="pagina.pdf")
-                        )
-                    else:
-                        await ctx.send("❌ Não foi possível converter a página")
+        async with cliente_http.sessao.get(api_url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            if response.status == 200:
+                pdf_data = await response.read()
+                
+                if len(pdf_data) > 1000:
+                    await ctx.send(
+                        f"✅ PDF gerado de: {url}",
+                        file=discord.File(BytesIO(pdf_data), filename="pagina.pdf")
+                    )
                 else:
-                    await ctx.send("❌ Erro ao converter a página")
-                    
+                    await ctx.send("❌ Não foi possível converter a página")
+            else:
+                await ctx.send("❌ Erro ao converter a página")
+                
     except Exception as e:
         await ctx.send("❌ Erro ao processar a solicitação")
 
@@ -4439,21 +7266,20 @@ async def topdf(ctx, url: str):
         
         api_url = f"https://api.html2pdf.app/v1/generate?url={urllib.parse.quote(url)}&apiKey=free"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url, timeout=30) as response:
-                if response.status == 200:
-                    pdf_data = await response.read()
-                    
-                    if len(pdf_data) > 1000:
-                        await ctx.send(
-                            f"✅ PDF gerado de: {url}",
-                            file=discord.File(BytesIO(pdf_data), filename="pagina.pdf")
-                        )
-                    else:
-                        await ctx.send("❌ Não foi possível converter a página")
+        async with cliente_http.sessao.get(api_url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            if response.status == 200:
+                pdf_data = await response.read()
+                
+                if len(pdf_data) > 1000:
+                    await ctx.send(
+                        f"✅ PDF gerado de: {url}",
+                        file=discord.File(BytesIO(pdf_data), filename="pagina.pdf")
+                    )
                 else:
-                    await ctx.send("❌ Erro ao converter a página")
-                    
+                    await ctx.send("❌ Não foi possível converter a página")
+            else:
+                await ctx.send("❌ Erro ao converter a página")
+                
     except Exception as e:
         await ctx.send("❌ Erro ao processar a solicitação")
 
@@ -4793,12 +7619,13 @@ async def atualizar_nicks(ctx):
     await ctx.typing()
     
     try:
-        atualizados = 0
-        for member in ctx.guild.members:
-            if not member.bot:
-                await sistema_cargos.atualizar_nick_automatico(member)
-                atualizados += 1
-                await asyncio.sleep(0.3)
+        acoes = await sistema_cargos.acoes_nick_automatico(
+            indice_membros.membros(ctx.guild, indice_membros.snapshot(ctx.guild).humanos())
+        )
+        resultado = await executor_lote.executar(acoes)
+        atualizados = resultado['sucesso']
+        for nome, erro in resultado['falhas']:
+            print(f"Erro ao atualizar nick de {nome}: {erro}")
         
         embed = discord.Embed(
             title="✅ NICKS ATUALIZADOS",
@@ -4825,10 +7652,19 @@ async def sorteio(ctx, tempo: int = 60, *, premio: str):
     mensagem = await ctx.send(embed=embed)
     await mensagem.add_reaction("🎉")
     
-    await asyncio.sleep(tempo)
+    agendador.agendar('sorteio', tempo, {
+        'canal_id': ctx.channel.id, 'mensagem_id': mensagem.id, 'premio': premio
+    }, f"sorteio:{mensagem.id}")
+
+@agendador.tarefa('sorteio')
+async def finalizar_sorteio(dados):
+    canal = bot.get_channel(dados['canal_id'])
+    if not canal:
+        return
+    premio = dados['premio']
     
     # Recarregar mensagem para pegar reações atualizadas
-    mensagem = await ctx.channel.fetch_message(mensagem.id)
+    mensagem = await canal.fetch_message(dados['mensagem_id'])
     reacao = discord.utils.get(mensagem.reactions, emoji="🎉")
     
     if reacao and reacao.count > 1:
@@ -4845,12 +7681,12 @@ async def sorteio(ctx, tempo: int = 60, *, premio: str):
                 description=f"**Prêmio:** {premio}\n**Vencedor:** {vencedor.mention}",
                 color=0x00ff00
             )
-            await ctx.send(f"🎉 Parabéns {vencedor.mention}! Você ganhou: **{premio}**")
-            await ctx.send(embed=embed_vencedor)
+            await canal.send(f"🎉 Parabéns {vencedor.mention}! Você ganhou: **{premio}**")
+            await canal.send(embed=embed_vencedor)
         else:
-            await ctx.send("❌ Ninguém participou do sorteio!")
+            await canal.send("❌ Ninguém participou do sorteio!")
     else:
-        await ctx.send("❌ Ninguém participou do sorteio!")
+        await canal.send("❌ Ninguém participou do sorteio!")
 
 @bot.command(name='enquete')
 @commands.has_permissions(manage_messages=True)
@@ -4870,10 +7706,19 @@ async def enquete(ctx, tempo: int = 3600, *, pergunta: str):
     await mensagem.add_reaction("✅")
     await mensagem.add_reaction("❌")
     
-    await asyncio.sleep(tempo)
+    agendador.agendar('enquete', tempo, {
+        'canal_id': ctx.channel.id, 'mensagem_id': mensagem.id, 'pergunta': pergunta
+    }, f"enquete:{mensagem.id}")
+
+@agendador.tarefa('enquete')
+async def finalizar_enquete(dados):
+    canal = bot.get_channel(dados['canal_id'])
+    if not canal:
+        return
+    pergunta = dados['pergunta']
     
     # Resultados
-    mensagem = await ctx.channel.fetch_message(mensagem.id)
+    mensagem = await canal.fetch_message(dados['mensagem_id'])
     sim = discord.utils.get(mensagem.reactions, emoji="✅")
     nao = discord.utils.get(mensagem.reactions, emoji="❌")
     
@@ -4894,9 +7739,9 @@ async def enquete(ctx, tempo: int = 3600, *, pergunta: str):
         embed_resultado.add_field(name="❌ Não", value=f"{count_nao} votos ({percent_nao:.1f}%)", inline=True)
         embed_resultado.add_field(name="👥 Total", value=f"{total} votos", inline=True)
         
-        await ctx.send(embed=embed_resultado)
+        await canal.send(embed=embed_resultado)
     else:
-        await ctx.send("❌ Ninguém votou na enquete!")
+        await canal.send("❌ Ninguém votou na enquete!")
 
 # ========== UTILIDADES ORIGINAIS ==========
 
@@ -4927,15 +7772,683 @@ async def ping(ctx):
         description=f"**Latência:** {latency}ms",
         color=0x00ff00 if latency < 100 else 0xff9900 if latency < 200 else 0xff0000
     )
+    
+    primeiros_tokens = groq_ai.metricas['primeiro_token']
+    if primeiros_tokens:
+        embed.add_field(
+            name="🤖 IA (streaming)",
+            value=f"1º token em média {round(sum(primeiros_tokens) / len(primeiros_tokens) * 1000)}ms "
+                  f"• {groq_ai.metricas['streams']} respostas • {groq_ai.metricas['falhas']} falhas",
+            inline=False
+        )
+    
+    cache_ia = groq_ai.cache.estatisticas()
+    if cache_ia['acertos'] or cache_ia['falhas']:
+        embed.add_field(
+            name="🧠 Cache da IA",
+            value=f"{cache_ia['acertos']} acertos • {cache_ia['falhas']} falhas ({cache_ia['taxa_acerto']}%) "
+                  f"• {cache_ia['coalescidas']} coalescidas • {cache_ia['itens']} itens",
+            inline=False
+        )
+    
+    fila = fila_ia.estatisticas()
+    if fila['servidos'] or fila['na_fila']:
+        embed.add_field(
+            name="📬 Fila da IA",
+            value=f"{fila['na_fila']} na fila • {fila['em_execucao']} em execução • espera média {fila['espera_media_ms']}ms\n"
+                  f"{fila['servidos']} atendidos • {fila['rate_limits']} rate limits • {fila['rejeitados']} recusados",
+            inline=False
+        )
+    
+    memoria_ia = memoria_conversas.estatisticas()
+    if memoria_ia['usuarios_ativos']:
+        embed.add_field(
+            name="💭 Memória da IA",
+            value=f"{memoria_ia['usuarios_ativos']} conversas em RAM (~{memoria_ia['tokens_residentes']} tokens) "
+                  f"• {memoria_ia['resumos']} resumos • {memoria_ia['despejos']} enviadas ao disco",
+            inline=False
+        )
+    
+    # ✅ NOVO: Latência das APIs externas (sessão HTTP compartilhada)
+    for host, stats in list(cliente_http.estatisticas().items())[:5]:
+        embed.add_field(
+            name=f"🌐 {host}",
+            value=f"média {stats['media_ms']}ms • p95 {stats['p95_ms']}ms\n"
+                  f"{stats['requisicoes']} req • {stats['erros']} erros • {stats['conexoes_reusadas']} conexões reusadas",
+            inline=False
+        )
+    
     await ctx.send(embed=embed)
 
+# ✅ NOVO: Índice local de busca (SQLite FTS5)
+class IndiceBusca:
+    """Índice de texto completo das mensagens do servidor para `!search serv`.
+
+    Mensagens novas, editadas e apagadas entram numa fila em memória que é
+    gravada em lote no busca.db (mesmo esquema de write-behind do Database).
+    O histórico antigo é indexado aos poucos em segundo plano, canal por
+    canal, a partir da primeira busca no servidor; cada canal guarda o id da
+    última mensagem indexada e, ao iniciar, o que chegou com o bot desligado
+    é lido a partir dele. Todo acesso ao SQLite roda no executor. As consultas usam FTS5 com
+    ranking bm25, frases entre aspas e filtros de canal/autor. Sem FTS5 no
+    SQLite, `disponivel` fica False e a busca volta ao modo antigo.
+    """
+
+    REGEX_CANAL = re.compile(r'<#(\d+)>')
+    REGEX_AUTOR = re.compile(r'<@!?(\d+)>')
+    REGEX_FRASE = re.compile(r'"([^"]+)"')
+
+    def __init__(self, arquivo='busca.db', intervalo_flush=2, max_pendentes=500,
+                 lote_backfill=100, max_backfill_canal=5000):
+        self.arquivo = arquivo
+        self.intervalo_flush = intervalo_flush
+        self.max_pendentes = max_pendentes
+        self.lote_backfill = lote_backfill
+        self.max_backfill_canal = max_backfill_canal
+        self.pendentes = []
+        self.lock_conexao = threading.Lock()
+        self.evento_flush = None
+        self.task_flush = None
+        self.backfills = {}  # guild_id -> task
+        self.recuperacoes = {}  # guild_id -> task de recuperação do período offline
+        self.disponivel = True
+        self.conexao = sqlite3.connect(self.arquivo, check_same_thread=False)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self.criar_tabelas()
+        except sqlite3.OperationalError as e:
+            self.disponivel = False
+            print(f"⚠️ FTS5 indisponível, !search serv usará a busca antiga: {e}")
+
+    def criar_tabelas(self):
+        with self.conexao:
+            self.conexao.executescript("""
+                CREATE TABLE IF NOT EXISTS mensagens (
+                    id INTEGER PRIMARY KEY,
+                    guild_id INTEGER NOT NULL,
+                    canal_id INTEGER NOT NULL,
+                    autor_id INTEGER NOT NULL,
+                    autor TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    conteudo TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_mensagens_canal ON mensagens (guild_id, canal_id);
+                CREATE INDEX IF NOT EXISTS idx_mensagens_autor ON mensagens (guild_id, autor_id);
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS mensagens_fts USING fts5(
+                    conteudo, content='mensagens', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS mensagens_ai AFTER INSERT ON mensagens BEGIN
+                    INSERT INTO mensagens_fts (rowid, conteudo) VALUES (new.id, new.conteudo);
+                END;
+                CREATE TRIGGER IF NOT EXISTS mensagens_ad AFTER DELETE ON mensagens BEGIN
+                    INSERT INTO mensagens_fts (mensagens_fts, rowid, conteudo) VALUES ('delete', old.id, old.conteudo);
+                END;
+                CREATE TRIGGER IF NOT EXISTS mensagens_au AFTER UPDATE OF conteudo ON mensagens BEGIN
+                    INSERT INTO mensagens_fts (mensagens_fts, rowid, conteudo) VALUES ('delete', old.id, old.conteudo);
+                    INSERT INTO mensagens_fts (rowid, conteudo) VALUES (new.id, new.conteudo);
+                END;
+
+                CREATE TABLE IF NOT EXISTS backfill (
+                    canal_id INTEGER PRIMARY KEY,
+                    guild_id INTEGER NOT NULL,
+                    mais_antigo_id INTEGER,
+                    indexadas INTEGER NOT NULL DEFAULT 0,
+                    completo INTEGER NOT NULL DEFAULT 0,
+                    ultimo_id INTEGER
+                );
+            """)
+            # Bancos criados antes de ultimo_id: começar da última mensagem já indexada
+            colunas = {linha[1] for linha in self.conexao.execute("PRAGMA table_info(backfill)")}
+            if 'ultimo_id' not in colunas:
+                self.conexao.execute("ALTER TABLE backfill ADD COLUMN ultimo_id INTEGER")
+                self.conexao.execute(
+                    "UPDATE backfill SET ultimo_id = (SELECT MAX(id) FROM mensagens WHERE mensagens.canal_id = backfill.canal_id)"
+                )
+
+    # ---------- Alimentação ao vivo ----------
+
+    @staticmethod
+    def _linha(message):
+        return (message.id, message.guild.id, message.channel.id, message.author.id,
+                message.author.display_name, message.created_at.timestamp(), message.content)
+
+    def _enfileirar(self, operacao):
+        if not self.disponivel:
+            return
+        self.pendentes.append(operacao)
+        if self.evento_flush and len(self.pendentes) >= self.max_pendentes:
+            self.evento_flush.set()
+
+    def indexar(self, message):
+        if message.guild and message.content and not message.author.bot:
+            self._enfileirar(('inserir', self._linha(message)))
+
+    def editar(self, mensagem_id, conteudo):
+        self._enfileirar(('editar', mensagem_id, conteudo))
+
+    def remover(self, mensagem_ids):
+        for mensagem_id in mensagem_ids:
+            self._enfileirar(('remover', mensagem_id))
+
+    def _aplicar(self, operacoes):
+        ultimos = {}  # canal_id -> maior id inserido
+        with self.lock_conexao:
+            with self.conexao:
+                for operacao in operacoes:
+                    if operacao[0] == 'inserir':
+                        self.conexao.execute("INSERT OR IGNORE INTO mensagens VALUES (?, ?, ?, ?, ?, ?, ?)", operacao[1])
+                        mensagem_id, canal_id = operacao[1][0], operacao[1][2]
+                        ultimos[canal_id] = max(ultimos.get(canal_id, 0), mensagem_id)
+                    elif operacao[0] == 'editar':
+                        self.conexao.execute("UPDATE mensagens SET conteudo = ? WHERE id = ?", (operacao[2], operacao[1]))
+                    else:
+                        self.conexao.execute("DELETE FROM mensagens WHERE id = ?", (operacao[1],))
+                self._avancar_ultimos(ultimos)
+
+    def _avancar_ultimos(self, ultimos):
+        # Só canais que já têm histórico; os outros entram pelo backfill
+        self.conexao.executemany(
+            "UPDATE backfill SET ultimo_id = ? WHERE canal_id = ? AND (ultimo_id IS NULL OR ultimo_id < ?)",
+            [(mensagem_id, canal_id, mensagem_id) for canal_id, mensagem_id in ultimos.items()]
+        )
+
+    async def iniciar(self):
+        if not self.disponivel or (self.task_flush and not self.task_flush.done()):
+            return
+        self.evento_flush = asyncio.Event()
+        self.task_flush = asyncio.create_task(self.loop_flush())
+
+    async def flush(self):
+        if not self.pendentes:
+            return
+        operacoes, self.pendentes = self.pendentes, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._aplicar, operacoes)
+        except Exception as e:
+            print(f"❌ Erro ao gravar índice de busca: {e}")
+
+    async def loop_flush(self):
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.evento_flush.wait(), timeout=self.intervalo_flush)
+                except asyncio.TimeoutError:
+                    pass
+                self.evento_flush.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            operacoes, self.pendentes = self.pendentes, []
+            self._aplicar(operacoes)
+            raise
+
+    # ---------- Backfill preguiçoso ----------
+
+    def _estados_backfill(self, guild_id):
+        """canal_id -> (mais_antigo_id, indexadas, completo, ultimo_id)"""
+        with self.lock_conexao:
+            return {linha[0]: linha[1:] for linha in self.conexao.execute(
+                "SELECT canal_id, mais_antigo_id, indexadas, completo, ultimo_id FROM backfill WHERE guild_id = ?",
+                (guild_id,)
+            )}
+
+    async def garantir_backfill(self, guild):
+        """Agenda a indexação do histórico antigo do servidor; retorna quantos canais faltam"""
+        if not self.disponivel:
+            return 0
+        estados = await asyncio.get_running_loop().run_in_executor(None, self._estados_backfill, guild.id)
+        pendentes = [canal for canal in guild.text_channels
+                     if not (estados.get(canal.id) or (None, 0, 0, None))[2]
+                     and canal.permissions_for(guild.me).read_message_history]
+        tarefa = self.backfills.get(guild.id)
+        if pendentes and (not tarefa or tarefa.done()):
+            self.backfills[guild.id] = asyncio.create_task(self._backfill(guild, pendentes, estados))
+        return len(pendentes)
+
+    async def _backfill(self, guild, canais, estados):
+        loop = asyncio.get_running_loop()
+        for canal in canais:
+            mais_antigo_id, indexadas, _, ultimo_id = estados.get(canal.id) or (None, 0, 0, None)
+
+            try:
+                while indexadas < self.max_backfill_canal:
+                    antes = discord.Object(id=mais_antigo_id) if mais_antigo_id else None
+                    lote = []
+                    lidas = 0
+                    async for message in canal.history(limit=self.lote_backfill, before=antes):
+                        lidas += 1
+                        mais_antigo_id = message.id
+                        # A primeira mensagem da primeira página é a mais recente do canal
+                        ultimo_id = ultimo_id or message.id
+                        if message.content and not message.author.bot:
+                            lote.append(('inserir', self._linha(message)))
+
+                    indexadas += lidas
+                    completo = lidas < self.lote_backfill or indexadas >= self.max_backfill_canal
+                    lote.append(('backfill', canal.id, guild.id, mais_antigo_id, indexadas, int(completo), ultimo_id))
+                    await loop.run_in_executor(None, self._aplicar_backfill, lote)
+                    if completo:
+                        break
+            except discord.Forbidden:
+                continue
+            except Exception as e:
+                print(f"❌ Erro no backfill do canal {canal.name}: {e}")
+
+    def _aplicar_backfill(self, lote):
+        *mensagens, (_, canal_id, guild_id, mais_antigo_id, indexadas, completo, ultimo_id) = lote
+        with self.lock_conexao:
+            with self.conexao:
+                # ultimo_id pode ter avançado com mensagens ao vivo enquanto o lote era lido
+                self.conexao.execute(
+                    "INSERT INTO backfill VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (canal_id) DO UPDATE SET "
+                    "mais_antigo_id = excluded.mais_antigo_id, indexadas = excluded.indexadas, "
+                    "completo = excluded.completo, ultimo_id = MAX(COALESCE(ultimo_id, 0), COALESCE(excluded.ultimo_id, 0))",
+                    (canal_id, guild_id, mais_antigo_id, indexadas, completo, ultimo_id)
+                )
+        self._aplicar(mensagens)
+
+    def agendar_recuperacao(self, guild):
+        tarefa = self.recuperacoes.get(guild.id)
+        if self.disponivel and (not tarefa or tarefa.done()):
+            self.recuperacoes[guild.id] = asyncio.create_task(self.recuperar_lacunas(guild))
+
+    async def recuperar_lacunas(self, guild):
+        """Indexa o que chegou nos canais já indexados enquanto o bot estava desligado"""
+        if not self.disponivel:
+            return
+        loop = asyncio.get_running_loop()
+        estados = await loop.run_in_executor(None, self._estados_backfill, guild.id)
+        for canal_id, (_, _, _, ultimo_id) in estados.items():
+            canal = guild.get_channel(canal_id)
+            if not ultimo_id or not canal or not canal.permissions_for(guild.me).read_message_history:
+                continue
+            try:
+                lote = []
+                async for message in canal.history(limit=self.max_backfill_canal, after=discord.Object(id=ultimo_id),
+                                                   oldest_first=True):
+                    if message.content and not message.author.bot:
+                        lote.append(('inserir', self._linha(message)))
+                    if len(lote) >= self.lote_backfill:
+                        await loop.run_in_executor(None, self._aplicar, lote)
+                        lote = []
+                if lote:
+                    await loop.run_in_executor(None, self._aplicar, lote)
+            except discord.Forbidden:
+                continue
+            except Exception as e:
+                print(f"❌ Erro ao recuperar mensagens de #{canal.name}: {e}")
+
+    # ---------- Consulta ----------
+
+    def _montar_consulta(self, texto):
+        """Separa filtros (<#canal>, <@autor>) e monta a expressão FTS5"""
+        canais = [int(x) for x in self.REGEX_CANAL.findall(texto)]
+        autores = [int(x) for x in self.REGEX_AUTOR.findall(texto)]
+        texto = self.REGEX_AUTOR.sub(' ', self.REGEX_CANAL.sub(' ', texto))
+
+        termos = [f'"{frase.strip()}"' for frase in self.REGEX_FRASE.findall(texto) if frase.strip()]
+        texto = self.REGEX_FRASE.sub(' ', texto)
+        # Palavras soltas viram termos entre aspas (sem operadores FTS5 do usuário)
+        termos += [f'"{palavra}"' for palavra in re.findall(r'\w+', texto)]
+        return ' '.join(termos), canais, autores
+
+    def _buscar(self, guild_id, expressao, canais, autores, limite):
+        sql = ("SELECT m.id, m.canal_id, m.autor, m.criado_em, "
+               "snippet(mensagens_fts, 0, '**', '**', '…', 24) "
+               "FROM mensagens_fts JOIN mensagens m ON m.id = mensagens_fts.rowid "
+               "WHERE mensagens_fts MATCH ? AND m.guild_id = ?")
+        parametros = [expressao, guild_id]
+        if canais:
+            sql += f" AND m.canal_id IN ({','.join('?' * len(canais))})"
+            parametros += canais
+        if autores:
+            sql += f" AND m.autor_id IN ({','.join('?' * len(autores))})"
+            parametros += autores
+        sql += " ORDER BY bm25(mensagens_fts), m.criado_em DESC LIMIT ?"
+        parametros.append(limite)
+        with self.lock_conexao:
+            linhas = self.conexao.execute(sql, parametros).fetchall()
+            total = self.conexao.execute("SELECT COUNT(*) FROM mensagens WHERE guild_id = ?", (guild_id,)).fetchone()[0]
+        return linhas, total
+
+    async def buscar(self, guild, membro, texto, limite=8):
+        """Retorna (resultados visíveis para o membro, total de mensagens indexadas no servidor)"""
+        expressao, canais, autores = self._montar_consulta(texto)
+        if not expressao:
+            return [], 0
+        await self.flush()  # Mensagens recém-chegadas entram na busca
+
+        loop = asyncio.get_running_loop()
+        linhas, total = await loop.run_in_executor(None, self._buscar, guild.id, expressao, canais, autores, limite * 5)
+
+        resultados = []
+        for mensagem_id, canal_id, autor, criado_em, trecho in linhas:
+            canal = guild.get_channel_or_thread(canal_id)
+            if not canal or not canal.permissions_for(membro).read_messages:
+                continue
+            resultados.append({
+                'canal': canal,
+                'autor': autor,
+                'mensagem': trecho,
+                'data': datetime.fromtimestamp(criado_em).strftime("%d/%m/%y %H:%M"),
+                'link': f"https://discord.com/channels/{guild.id}/{canal_id}/{mensagem_id}"
+            })
+            if len(resultados) >= limite:
+                break
+        return resultados, total
+
+indice_busca = IndiceBusca()
+
+# Roda num processo python separado por PDF: imprime [[pagina, texto], ...] em JSON
+SCRIPT_EXTRACAO_PDF = """
+import json, sys
+from pypdf import PdfReader
+leitor = PdfReader(sys.argv[1])
+paginas = []
+for numero, pagina in enumerate(leitor.pages[:int(sys.argv[2])], 1):
+    texto = (pagina.extract_text() or '').strip()
+    if texto:
+        paginas.append((numero, texto))
+json.dump(paginas, sys.stdout)
+"""
+
+# ✅ NOVO: Indexador de conteúdo de PDFs anexados
+class IndicePDFs:
+    """Indexa o texto dos PDFs anexados no servidor, página por página.
+
+    Cada anexo é baixado uma única vez (até `max_bytes`), o texto é extraído
+    num processo python próprio (morto se passar de `timeout_extracao`, então
+    um PDF malformado não prende o worker nem o GIL do bot) e fica no busca.db
+    numa tabela FTS5 chave = id do anexo. Todo acesso ao SQLite sai do event loop. Anexos novos chegam pelo on_message; o histórico de um canal é
+    varrido uma vez na primeira busca feita nele. Anexos ainda pendentes são
+    retomados quando o bot reinicia.
+    """
+
+    def __init__(self, indice, max_bytes=20 * 1024 * 1024, max_paginas=300, workers=2,
+                 timeout_extracao=120, varredura_canal=500):
+        self.indice = indice
+        self.max_bytes = max_bytes
+        self.max_paginas = max_paginas
+        self.workers = workers
+        self.timeout_extracao = timeout_extracao
+        self.varredura_canal = varredura_canal
+        self.fila = None
+        self.tasks = []
+        self.varrendo = {}  # canal_id -> task
+        self.stats = {'indexados': 0, 'grandes': 0, 'erros': 0}
+        if self.indice.disponivel:
+            self.criar_tabelas()
+
+    @property
+    def disponivel(self):
+        return self.indice.disponivel
+
+    def criar_tabelas(self):
+        with self.indice.lock_conexao:
+            with self.indice.conexao:
+                self.indice.conexao.executescript("""
+                    CREATE TABLE IF NOT EXISTS pdfs (
+                        anexo_id INTEGER PRIMARY KEY,
+                        guild_id INTEGER NOT NULL,
+                        canal_id INTEGER NOT NULL,
+                        mensagem_id INTEGER NOT NULL,
+                        autor TEXT NOT NULL,
+                        nome TEXT NOT NULL,
+                        tamanho INTEGER NOT NULL,
+                        url TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        paginas INTEGER NOT NULL DEFAULT 0
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_pdfs_mensagem ON pdfs (mensagem_id);
+                    CREATE INDEX IF NOT EXISTS idx_pdfs_status ON pdfs (status);
+
+                    CREATE VIRTUAL TABLE IF NOT EXISTS pdf_paginas USING fts5(
+                        texto, anexo_id UNINDEXED, pagina UNINDEXED,
+                        tokenize='unicode61 remove_diacritics 2'
+                    );
+
+                    CREATE TABLE IF NOT EXISTS pdf_canais_varridos (
+                        canal_id INTEGER PRIMARY KEY,
+                        varrido_em REAL NOT NULL
+                    );
+                """)
+
+    def _executar(self, sql, parametros=(), varios=False):
+        with self.indice.lock_conexao:
+            with self.indice.conexao:
+                if varios:
+                    return self.indice.conexao.executemany(sql, parametros).fetchall()
+                return self.indice.conexao.execute(sql, parametros).fetchall()
+
+    # ---------- Registro e fila ----------
+
+    async def iniciar(self):
+        if not self.disponivel or self.tasks:
+            return
+        self.fila = asyncio.Queue()
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self._worker()))
+        # Retomar anexos que ficaram pendentes
+        loop = asyncio.get_running_loop()
+        for linha in await loop.run_in_executor(
+            None, self._executar, "SELECT anexo_id, url, tamanho FROM pdfs WHERE status = 'pendente'"
+        ):
+            self.fila.put_nowait(linha)
+
+    def fechar(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def _inserir_novos(self, linhas):
+        """Insere os anexos ainda não registrados; retorna as linhas inseridas"""
+        novas = []
+        with self.indice.lock_conexao:
+            with self.indice.conexao:
+                for linha in linhas:
+                    cursor = self.indice.conexao.execute(
+                        "INSERT OR IGNORE INTO pdfs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)", linha
+                    )
+                    if cursor.rowcount:
+                        novas.append(linha)
+        return novas
+
+    async def registrar(self, message):
+        """Registra os PDFs da mensagem; retorna quantos eram novos"""
+        if not self.disponivel or not message.guild:
+            return 0
+        linhas = [
+            (anexo.id, message.guild.id, message.channel.id, message.id, message.author.display_name,
+             anexo.filename, anexo.size, anexo.url, 'pendente' if anexo.size <= self.max_bytes else 'grande')
+            for anexo in message.attachments if anexo.filename.lower().endswith('.pdf')
+        ]
+        if not linhas:
+            return 0
+
+        novas = await asyncio.get_running_loop().run_in_executor(None, self._inserir_novos, linhas)
+        for anexo_id, _, _, _, _, _, tamanho, url, status in novas:
+            if status == 'pendente' and self.fila is not None:
+                self.fila.put_nowait((anexo_id, url, tamanho))
+            elif status == 'grande':
+                self.stats['grandes'] += 1
+        return len(novas)
+
+    def _remover(self, mensagem_ids):
+        marcadores = ','.join('?' * len(mensagem_ids))
+        with self.indice.lock_conexao:
+            with self.indice.conexao:
+                anexos = [(linha[0],) for linha in self.indice.conexao.execute(
+                    f"SELECT anexo_id FROM pdfs WHERE mensagem_id IN ({marcadores})", list(mensagem_ids)
+                )]
+                if anexos:
+                    self.indice.conexao.executemany("DELETE FROM pdf_paginas WHERE anexo_id = ?", anexos)
+                    self.indice.conexao.executemany("DELETE FROM pdfs WHERE anexo_id = ?", anexos)
+
+    async def remover_mensagens(self, mensagem_ids):
+        if not self.disponivel or not mensagem_ids:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self._remover, list(mensagem_ids))
+
+    async def _baixar(self, url, destino):
+        """Baixa o anexo em partes, abortando se passar de max_bytes"""
+        recebidos = 0
+        async with cliente_http.sessao.get(url, timeout=aiohttp.ClientTimeout(total=120)) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            with open(destino, 'wb') as f:
+                async for parte in response.content.iter_chunked(64 * 1024):
+                    recebidos += len(parte)
+                    if recebidos > self.max_bytes:
+                        raise RuntimeError("arquivo maior que o limite")
+                    f.write(parte)
+
+    async def _processar(self, anexo_id, url):
+        if not PdfReader:
+            return 'sem_extrator', []
+
+        descritor, caminho = tempfile.mkstemp(suffix='.pdf')
+        os.close(descritor)
+        try:
+            await self._baixar(url, caminho)
+            return 'indexado', await self._extrair(caminho)
+        finally:
+            os.remove(caminho)
+
+    async def _extrair(self, caminho):
+        """Extrai as páginas num subprocesso, matando-o se passar do timeout"""
+        processo = await asyncio.create_subprocess_exec(
+            sys.executable, '-c', SCRIPT_EXTRACAO_PDF, caminho, str(self.max_paginas),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            saida, erro = await asyncio.wait_for(processo.communicate(), timeout=self.timeout_extracao)
+        except BaseException:
+            # Timeout ou cancelamento (bot desligando): não deixar o processo órfão
+            processo.kill()
+            await processo.wait()
+            raise
+        
+        if processo.returncode != 0:
+            linhas = erro.decode('utf-8', 'ignore').strip().splitlines()
+            raise RuntimeError(linhas[-1][:200] if linhas else f"extração saiu com código {processo.returncode}")
+        return [tuple(pagina) for pagina in json.loads(saida)]
+
+    def _gravar_paginas(self, anexo_id, status, paginas):
+        with self.indice.lock_conexao:
+            with self.indice.conexao:
+                self.indice.conexao.execute("DELETE FROM pdf_paginas WHERE anexo_id = ?", (anexo_id,))
+                self.indice.conexao.executemany(
+                    "INSERT INTO pdf_paginas (texto, anexo_id, pagina) VALUES (?, ?, ?)",
+                    [(texto, anexo_id, numero) for numero, texto in paginas]
+                )
+                self.indice.conexao.execute(
+                    "UPDATE pdfs SET status = ?, paginas = ? WHERE anexo_id = ?", (status, len(paginas), anexo_id)
+                )
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            anexo_id, url, tamanho = await self.fila.get()
+            try:
+                status, paginas = await self._processar(anexo_id, url)
+                self.stats['indexados'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Erro ao indexar PDF {anexo_id}: {e}")
+                status, paginas = 'erro', []
+                self.stats['erros'] += 1
+            try:
+                await loop.run_in_executor(None, self._gravar_paginas, anexo_id, status, paginas)
+            except Exception as e:
+                # O anexo continua 'pendente' e é retomado no próximo início
+                print(f"❌ Erro ao gravar páginas do PDF {anexo_id}: {e}")
+                self.stats['erros'] += 1
+            finally:
+                self.fila.task_done()
+
+    # ---------- Varredura de histórico ----------
+
+    async def garantir_varredura(self, canal):
+        """Agenda (uma vez por canal) a busca de PDFs antigos no histórico"""
+        if not self.disponivel or canal.id in self.varrendo:
+            return
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self._executar, "SELECT 1 FROM pdf_canais_varridos WHERE canal_id = ?", (canal.id,)):
+            return
+        if canal.id not in self.varrendo:
+            self.varrendo[canal.id] = asyncio.create_task(self._varrer(canal))
+
+    async def _varrer(self, canal):
+        loop = asyncio.get_running_loop()
+        try:
+            async for message in canal.history(limit=self.varredura_canal):
+                if message.attachments:
+                    await self.registrar(message)
+            await loop.run_in_executor(
+                None, self._executar, "INSERT OR REPLACE INTO pdf_canais_varridos VALUES (?, ?)", (canal.id, time.time())
+            )
+        except Exception as e:
+            print(f"❌ Erro ao varrer PDFs de #{canal.name}: {e}")
+        finally:
+            self.varrendo.pop(canal.id, None)
+
+    # ---------- Consulta ----------
+
+    @staticmethod
+    def _escapar_like(texto):
+        return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    def _buscar(self, guild_id, expressao, termo_nome, limite):
+        # Conteúdo: um resultado por página, melhor ranking primeiro
+        linhas = self._executar(
+            "SELECT p.anexo_id, p.canal_id, p.nome, p.autor, pdf_paginas.pagina, "
+            "snippet(pdf_paginas, 0, '**', '**', '…', 16) "
+            "FROM pdf_paginas JOIN pdfs p ON p.anexo_id = pdf_paginas.anexo_id "
+            "WHERE pdf_paginas MATCH ? AND p.guild_id = ? ORDER BY bm25(pdf_paginas) LIMIT ?",
+            (expressao, guild_id, limite)
+        ) if expressao else []
+        # Nome do arquivo (cobre PDFs grandes, com erro ou sem texto)
+        linhas += [linha + (None, None) for linha in self._executar(
+            "SELECT anexo_id, canal_id, nome, autor FROM pdfs WHERE guild_id = ? AND nome LIKE ? ESCAPE '\\' "
+            "ORDER BY anexo_id DESC LIMIT ?",
+            (guild_id, f"%{self._escapar_like(termo_nome)}%", limite)
+        )]
+        return linhas
+
+    async def buscar(self, guild, membro, texto, limite=5):
+        expressao = self.indice._montar_consulta(texto)[0]
+        loop = asyncio.get_running_loop()
+        linhas = await loop.run_in_executor(None, self._buscar, guild.id, expressao, texto.strip(), limite * 5)
+
+        resultados = []
+        vistos = set()
+        for anexo_id, canal_id, nome, autor, pagina, trecho in linhas:
+            canal = guild.get_channel_or_thread(canal_id)
+            if (anexo_id, pagina) in vistos or not canal or not canal.permissions_for(membro).read_messages:
+                continue
+            if pagina is None and any(a == anexo_id for a, _ in vistos):
+                continue  # Já apareceu pelo conteúdo
+            vistos.add((anexo_id, pagina))
+            resultados.append({'nome': nome, 'autor': autor, 'canal': canal, 'pagina': pagina, 'trecho': trecho})
+            if len(resultados) >= limite:
+                break
+        return resultados
+
+    def pendentes(self):
+        return self.fila.qsize() if self.fila else 0
+
+indice_pdfs = IndicePDFs(indice_busca)
+
 @bot.command(name='search')
 async def search_advanced(ctx, tipo: str = None, *, query=None):
     """🔍 Pesquisa avançada no servidor (PDF/serv/membros)"""
     if not tipo or not query:
         embed = discord.Embed(
             title="🔍 SISTEMA DE PESQUISA AVANÇADA",
-            description="**Como usar:**\n`!search PDF <nome>` - Busca em PDFs\n`!search serv <termo>` - Busca no servidor\n`!search membros <nome>` - Lista membros",
+            description="**Como usar:**\n`!search PDF <termo>` - Busca no conteúdo dos PDFs\n`!search serv <termo>` - Busca no servidor (aceita #canal, @autor e \"frases\")\n`!search membros <nome>` - Lista membros",
             color=0x0099ff
         )
         await ctx.send(embed=embed)
@@ -4952,9 +8465,36 @@ async def search_advanced(ctx, tipo: str = None, *, query=None):
                 description="\n".join([f"• {r}" for r in resultados[:5]]),
                 color=0x00ff00
             )
+            if indice_pdfs.pendentes() or indice_pdfs.varrendo:
+                embed.set_footer(text=f"⏳ Indexando PDFs ({indice_pdfs.pendentes()} na fila)")
             await ctx.send(embed=embed)
         else:
-            await ctx.send("❌ Nenhum PDF encontrado com esse termo")
+            aviso = " (ainda indexando PDFs, tente de novo em instantes)" if indice_pdfs.pendentes() or indice_pdfs.varrendo else ""
+            await ctx.send(f"❌ Nenhum PDF encontrado com esse termo{aviso}")
+
+    elif tipo.lower() == "serv" and indice_busca.disponivel:
+        # ✅ NOVO: Busca no índice local (FTS5)
+        faltando = await indice_busca.garantir_backfill(ctx.guild)
+        inicio = time.perf_counter()
+        resultados, total = await indice_busca.buscar(ctx.guild, ctx.author, query)
+        duracao = (time.perf_counter() - inicio) * 1000
+        
+        embed = discord.Embed(title=f"🔍 Resultados para: '{query}'", color=0x0099ff)
+        if resultados:
+            for resultado in resultados:
+                embed.add_field(
+                    name=f"#{resultado['canal'].name} • {resultado['autor']}",
+                    value=f"{resultado['mensagem'][:900]}\n*{resultado['data']}* • [ir]({resultado['link']})",
+                    inline=False
+                )
+        else:
+            embed.description = "❌ Nenhum resultado encontrado"
+        
+        rodape = f"{len(resultados)} resultados • {total} mensagens indexadas • {duracao:.0f}ms"
+        if faltando:
+            rodape += f" • indexando histórico de {faltando} canais"
+        embed.set_footer(text=rodape + " • Filtros: #canal @autor \"frase\"")
+        await ctx.send(embed=embed)
 
     elif tipo.lower() == "serv":
         # Busca avançada no servidor
@@ -5034,20 +8574,23 @@ async def search_advanced(ctx, tipo: str = None, *, query=None):
         await ctx.send("❌ Tipo de pesquisa inválido. Use: PDF, serv ou membros")
 
 async def buscar_pdfs(ctx, query):
-    """Busca termo em PDFs do canal"""
-    resultados = []
-    after_data = datetime.now() - timedelta(days=30)
+    """Busca termo no conteúdo (ou nome) dos PDFs do servidor"""
+    if not indice_pdfs.disponivel:
+        # Sem índice: só pelo nome, nas mensagens recentes do canal
+        resultados = []
+        async for mensagem in ctx.channel.history(limit=100, after=datetime.now() - timedelta(days=30)):
+            for anexo in mensagem.attachments:
+                if anexo.filename.lower().endswith('.pdf') and query.lower() in anexo.filename.lower():
+                    resultados.append(f"📄 {anexo.filename} - {mensagem.author.name}")
+        return resultados
     
-    async for mensagem in ctx.channel.history(limit=100, after=after_data):
-        for anexo in mensagem.attachments:
-            if anexo.filename.lower().endswith('.pdf'):
-                try:
-                    # Aqui você implementaria a leitura do PDF
-                    # Por enquanto, só verifica pelo nome
-                    if query.lower() in anexo.filename.lower():
-                        resultados.append(f"📄 {anexo.filename} - {mensagem.author.name}")
-                except:
-                    continue
+    await indice_pdfs.garantir_varredura(ctx.channel)
+    resultados = []
+    for r in await indice_pdfs.buscar(ctx.guild, ctx.author, query):
+        if r['pagina'] is None:
+            resultados.append(f"📄 {r['nome']} - {r['autor']} em #{r['canal'].name}")
+        else:
+            resultados.append(f"📄 {r['nome']} (p. {r['pagina']}) - {r['autor']} em #{r['canal'].name}\n> {r['trecho'][:300]}")
     return resultados
 
 @bot.command(name='p')
@@ -5077,6 +8620,7 @@ async def procurar_comando(ctx, *, busca: str):
         'pdf': '!pdf_canal [limite] - Cria PDF das mensagens | !web_to_pdf [url] - Converte site para PDF',
         'site': '!web_to_pdf [url] - Converte site para PDF',
         'mensagens': '!pdf_canal [limite] - Cria PDF das mensagens',
+        'transcricao': '!transcricao [html|jsonl|pdf] [horas] - Exporta transcrição do canal',
         
         # Sistema de IA
         'perguntar': 'Mencione o bot para conversar',
@@ -5136,32 +8680,183 @@ async def procurar_comando(ctx, *, busca: str):
     
     await ctx.send(embed=embed)
 
+# ✅ NOVO: Avaliador de expressões sem eval (com limites de tamanho e de operações)
+class ErroCalculo(Exception):
+    pass
+
+class CalculadoraSegura:
+    """Avalia expressões matemáticas percorrendo a AST, sem `eval`.
+
+    Só números, operadores aritméticos e as funções/constantes da tabela são
+    aceitos. Antes de cada potência, multiplicação ou fatorial o tamanho do
+    resultado é estimado e a conta é recusada se passar de `max_bits` (ou
+    `max_expoente`), e cada nó visitado gasta uma unidade de `max_operacoes`.
+    Assim nenhuma expressão trava o event loop. Expressões já analisadas
+    ficam em cache.
+    """
+
+    OPERADORES = {
+        ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+        ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod, ast.Pow: operator.pow,
+    }
+    UNARIOS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+    CONSTANTES = {'pi': math.pi, 'e': math.e, 'tau': math.tau}
+
+    FUNCOES = {
+        'sqrt': math.sqrt, 'raiz': math.sqrt, 'cbrt': lambda x: math.copysign(abs(x) ** (1 / 3), x),
+        'log': math.log, 'ln': math.log, 'log2': math.log2, 'log10': math.log10, 'exp': math.exp,
+        'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+        'asin': math.asin, 'acos': math.acos, 'atan': math.atan, 'atan2': math.atan2,
+        'sinh': math.sinh, 'cosh': math.cosh, 'tanh': math.tanh,
+        'sen': math.sin, 'graus': math.degrees, 'rad': math.radians,
+        'abs': abs, 'floor': math.floor, 'ceil': math.ceil, 'round': round,
+        'min': min, 'max': max, 'gcd': math.gcd, 'mdc': math.gcd,
+        'fact': math.factorial, 'fatorial': math.factorial,
+        'hex': hex, 'bin': bin, 'oct': oct,
+    }
+    # Só fazem sentido como resultado final (retornam texto)
+    FUNCOES_TEXTO = {'hex', 'bin', 'oct'}
+
+    def __init__(self, max_bits=4096, max_expoente=10000, max_fatorial=1000, max_casas=400,
+                 max_operacoes=500, max_tamanho=300, tamanho_cache=256):
+        self.max_bits = max_bits
+        self.max_casas = max_casas
+        self.max_expoente = max_expoente
+        self.max_fatorial = max_fatorial
+        self.max_operacoes = max_operacoes
+        self.max_tamanho = max_tamanho
+        self.compilar = functools.lru_cache(maxsize=tamanho_cache)(self._compilar)
+
+    def _compilar(self, expressao):
+        """Analisa e valida a expressão uma vez; o resultado fica em cache"""
+        if len(expressao) > self.max_tamanho:
+            raise ErroCalculo(f"Expressão longa demais (máx. {self.max_tamanho} caracteres)")
+        try:
+            arvore = ast.parse(expressao.replace('^', '**'), mode='eval')
+        except SyntaxError:
+            raise ErroCalculo("Expressão inválida")
+
+        for no in ast.walk(arvore):
+            if isinstance(no, (ast.Expression, ast.Load, ast.operator, ast.unaryop)):
+                if isinstance(no, ast.operator) and type(no) not in self.OPERADORES:
+                    raise ErroCalculo("Operador não suportado")
+                if isinstance(no, ast.unaryop) and type(no) not in self.UNARIOS:
+                    raise ErroCalculo("Operador não suportado")
+            elif isinstance(no, ast.Constant):
+                if type(no.value) not in (int, float):
+                    raise ErroCalculo("Só números são aceitos")
+            elif isinstance(no, ast.Name):
+                if no.id not in self.CONSTANTES and no.id not in self.FUNCOES:
+                    raise ErroCalculo(f"Nome desconhecido: {no.id}")
+            elif isinstance(no, ast.Call):
+                if not isinstance(no.func, ast.Name) or no.func.id not in self.FUNCOES or no.keywords:
+                    raise ErroCalculo("Função não suportada")
+                if no.func.id in self.FUNCOES_TEXTO and no is not arvore.body:
+                    raise ErroCalculo(f"{no.func.id}() só pode ser usada na expressão inteira")
+            elif not isinstance(no, (ast.BinOp, ast.UnaryOp)):
+                raise ErroCalculo("Expressão não suportada")
+        return arvore
+
+    def _bits(self, valor):
+        if isinstance(valor, int):
+            return abs(valor).bit_length()
+        return 0  # float estoura sozinho (OverflowError) sem custo
+
+    def _verificar(self, valor):
+        if isinstance(valor, complex):
+            raise ErroCalculo("Resultado complexo não suportado")
+        if isinstance(valor, float) and not math.isfinite(valor):
+            raise ErroCalculo("Resultado grande demais")
+        if isinstance(valor, int) and self._bits(valor) > self.max_bits:
+            raise ErroCalculo(f"Resultado grande demais (máx. {self.max_bits} bits)")
+        return valor
+
+    def _potencia(self, base, expoente):
+        if isinstance(base, int) and isinstance(expoente, int) and expoente > 0 and abs(base) > 1:
+            if expoente > self.max_expoente or (self._bits(base) - 1) * expoente + 1 > self.max_bits:
+                raise ErroCalculo("Potência grande demais")
+        elif abs(expoente) > self.max_expoente and abs(base) > 1:
+            raise ErroCalculo("Potência grande demais")
+        return base ** expoente
+
+    def _avaliar(self, no, orcamento):
+        orcamento[0] -= 1
+        if orcamento[0] < 0:
+            raise ErroCalculo(f"Expressão complexa demais (máx. {self.max_operacoes} operações)")
+
+        if isinstance(no, ast.Constant):
+            return self._verificar(no.value)
+        if isinstance(no, ast.Name):
+            if no.id not in self.CONSTANTES:
+                raise ErroCalculo(f"{no.id} é uma função, use {no.id}(...)")
+            return self.CONSTANTES[no.id]
+        if isinstance(no, ast.UnaryOp):
+            return self.UNARIOS[type(no.op)](self._avaliar(no.operand, orcamento))
+        if isinstance(no, ast.BinOp):
+            esquerda = self._avaliar(no.left, orcamento)
+            direita = self._avaliar(no.right, orcamento)
+            if isinstance(no.op, ast.Pow):
+                return self._verificar(self._potencia(esquerda, direita))
+            if isinstance(no.op, ast.Mult) and self._bits(esquerda) + self._bits(direita) > self.max_bits:
+                raise ErroCalculo(f"Resultado grande demais (máx. {self.max_bits} bits)")
+            return self._verificar(self.OPERADORES[type(no.op)](esquerda, direita))
+        if isinstance(no, ast.Call):
+            nome = no.func.id
+            argumentos = [self._avaliar(argumento, orcamento) for argumento in no.args]
+            # round(x, n) calcula 10**-n: n sem limite trava o loop
+            if nome == 'round' and len(argumentos) > 1:
+                if not isinstance(argumentos[1], int):
+                    raise ErroCalculo("round() precisa de um número inteiro de casas")
+                if abs(argumentos[1]) > self.max_casas:
+                    raise ErroCalculo(f"round() aceita no máximo {self.max_casas} casas")
+            if nome in ('fact', 'fatorial') and argumentos and argumentos[0] > self.max_fatorial:
+                raise ErroCalculo(f"Fatorial máximo: {self.max_fatorial}!")
+            if nome in self.FUNCOES_TEXTO and argumentos and not isinstance(argumentos[0], int):
+                raise ErroCalculo(f"{nome}() precisa de um número inteiro")
+            return self._verificar(self.FUNCOES[nome](*argumentos))
+        raise ErroCalculo("Expressão não suportada")
+
+    def avaliar(self, expressao):
+        arvore = self.compilar(expressao.strip())
+        try:
+            return self._avaliar(arvore.body, [self.max_operacoes])
+        except ZeroDivisionError:
+            raise ErroCalculo("Divisão por zero")
+        except OverflowError:
+            raise ErroCalculo("Resultado grande demais")
+        except (ValueError, TypeError) as e:
+            raise ErroCalculo(f"Fora do domínio da função ({e})")
+
+    @staticmethod
+    def formatar(resultado):
+        if isinstance(resultado, float):
+            if resultado.is_integer() and abs(resultado) < 1e15:
+                return str(int(resultado))
+            return f"{resultado:.12g}"
+        texto = str(resultado)
+        if len(texto) > 1000:
+            return f"{texto[:40]}…{texto[-40:]} ({len(texto)} dígitos)"
+        return texto
+
+calculadora_segura = CalculadoraSegura()
+
 @bot.command(name='calc')
 async def calculadora(ctx, *, expressao: str):
-    """🧮 Calculadora simples"""
+    """🧮 Calculadora (operadores, potências, sqrt, log, trigonometria, hex/bin)"""
     try:
-        # Remover espaços e validar caracteres
-        expressao = expressao.replace(' ', '')
-        caracteres_validos = set('0123456789+-*/.() ')
-        
-        if not all(c in caracteres_validos for c in expressao):
-            await ctx.send("❌ Expressão contém caracteres inválidos")
-            return
-        
-        # Calcular resultado
-        resultado = eval(expressao)
-        
-        embed = discord.Embed(
-            title="🧮 CALCULADORA",
-            description=f"**Expressão:** `{expressao}`\n**Resultado:** `{resultado}`",
-            color=0x0099ff
-        )
-        await ctx.send(embed=embed)
-        
-    except ZeroDivisionError:
-        await ctx.send("❌ Erro: Divisão por zero")
-    except:
-        await ctx.send("❌ Erro: Expressão inválida")
+        resultado = calculadora_segura.formatar(calculadora_segura.avaliar(expressao))
+    except ErroCalculo as e:
+        await ctx.send(f"❌ Erro: {e}")
+        return
+    
+    embed = discord.Embed(
+        title="🧮 CALCULADORA",
+        description=f"**Expressão:** `{expressao[:200]}`\n**Resultado:** `{resultado}`",
+        color=0x0099ff
+    )
+    await ctx.send(embed=embed)
 
 @bot.command(name='traduzir')
 async def traduzir(ctx, idioma: str, *, texto: str):
@@ -5182,7 +8877,7 @@ async def traduzir(ctx, idioma: str, *, texto: str):
     prompt = f"Traduza este texto para {idiomas[idioma]}: {texto}"
     
     try:
-        traducao = await groq_ai.gerar_resposta(prompt, user_id=ctx.author.id)
+        traducao = await groq_ai.gerar_resposta(prompt, user_id=ctx.author.id, guild_id=ctx.guild.id if ctx.guild else None)
         
         embed = discord.Embed(
             title="🌍 TRADUÇÃO",
@@ -5208,21 +8903,30 @@ async def lembrete(ctx, minutos: int, *, mensagem: str):
         await ctx.send("❌ O tempo máximo é 1440 minutos (24 horas)")
         return
     
+    agendador.agendar('lembrete', minutos * 60, {
+        'user_id': ctx.author.id, 'canal_id': ctx.channel.id, 'mensagem': mensagem, 'minutos': minutos
+    })
     await ctx.send(f"✅ Lembrete definido! Te avisarei em {minutos} minutos.")
-    
-    await asyncio.sleep(minutos * 60)
-    
+
+@agendador.tarefa('lembrete')
+async def disparar_lembrete(dados):
+    canal = bot.get_channel(dados['canal_id'])
+    mensagem = dados['mensagem']
+    mencao = f"<@{dados['user_id']}>"
     try:
+        usuario = bot.get_user(dados['user_id']) or await bot.fetch_user(dados['user_id'])
         embed = discord.Embed(
             title="⏰ LEMBRETE",
             description=mensagem,
             color=0xffd700
         )
-        embed.set_footer(text=f"Lembrete definido há {minutos} minutos")
-        await ctx.author.send(embed=embed)
-        await ctx.send(f"🔔 {ctx.author.mention}, lembrete enviado no seu privado!")
+        embed.set_footer(text=f"Lembrete definido há {dados['minutos']} minutos")
+        await usuario.send(embed=embed)
+        if canal:
+            await canal.send(f"🔔 {mencao}, lembrete enviado no seu privado!")
     except:
-        await ctx.send(f"🔔 {ctx.author.mention}, **LEMBRETE:** {mensagem}")
+        if canal:
+            await canal.send(f"🔔 {mencao}, **LEMBRETE:** {mensagem}")
 
 @bot.command(name='comunicado')
 @commands.has_permissions(administrator=True)
@@ -5278,14 +8982,9 @@ async def lembrete_anuncio(ctx, canal: discord.TextChannel = None, tempo: str =
     mensagem_final = await groq_ai.gerar_resposta(prompt, user_id=ctx.author.id, modo_tecnico=True)
     
     # Salvar lembrete
-    lembrete_id = f"{ctx.guild.id}_{canal.id}_{datetime.now().timestamp()}"
-    db.lembretes_anuncios[lembrete_id] = {
-        "canal_id": canal.id,
-        "mensagem": mensagem_final,
-        "autor": ctx.author.id,
-        "executar_em": (datetime.now() + timedelta(seconds=segundos)).isoformat()
-    }
-    db.salvar_dados()
+    agendador.agendar('lembrete_anuncio', segundos, {
+        'canal_id': canal.id, 'mensagem': mensagem_final, 'autor': ctx.author.id
+    })
     
     embed = discord.Embed(
         title="⏰ LEMBRETE AGENDADO",
@@ -5293,28 +8992,20 @@ async def lembrete_anuncio(ctx, canal: discord.TextChannel = None, tempo: str =
         color=0x00ff00
     )
     await ctx.send(embed=embed)
-    
-    # Agendar execução
-    await asyncio.sleep(segundos)
-    
-    # Executar lembrete
-    try:
-        embed_anuncio = discord.Embed(
-            title="🔔 LEMBRETE",
-            description=mensagem_final,
-            color=0xffd700,
-            timestamp=datetime.now()
-        )
-        embed_anuncio.set_footer(text="Lembrete agendado")
-        await canal.send(embed=embed_anuncio)
-        
-        # Remover do banco
-        if lembrete_id in db.lembretes_anuncios:
-            del db.lembretes_anuncios[lembrete_id]
-            db.salvar_dados()
-            
-    except Exception as e:
-        print(f"Erro ao enviar lembrete: {e}")
+
+@agendador.tarefa('lembrete_anuncio')
+async def disparar_lembrete_anuncio(dados):
+    canal = bot.get_channel(dados['canal_id'])
+    if not canal:
+        return
+    embed_anuncio = discord.Embed(
+        title="🔔 LEMBRETE",
+        description=dados['mensagem'],
+        color=0xffd700,
+        timestamp=datetime.now()
+    )
+    embed_anuncio.set_footer(text="Lembrete agendado")
+    await canal.send(embed=embed_anuncio)
 
 @bot.command(name='missao_cyber')
 @commands.has_permissions(administrator=True)
@@ -5625,18 +9316,14 @@ async def moeda(ctx):
 async def script(ctx, *, requisitos):
     """💻 Peça um script personalizado (resposta detalhada)"""
     await ctx.typing()
-    resposta = await groq_ai.gerar_resposta(
+    # ✅ NOVO: Resposta em streaming (continua em novas mensagens após 2000 caracteres)
+    await groq_ai.responder_stream(
+        ctx.send,
         f"Crie um script completo com esses requisitos: {requisitos}. Forneça o código completo, explicações e como usar.", 
         user_id=ctx.author.id, 
-        modo_tecnico=True
+        modo_tecnico=True,
+        guild_id=ctx.guild.id if ctx.guild else None
     )
-    
-    if len(resposta) > 2000:
-        partes = [resposta[i:i+2000] for i in range(0, len(resposta), 2000)]
-        for i, parte in enumerate(partes):
-            await ctx.send(parte)
-    else:
-        await ctx.send(resposta)
 
 # ========== SEGURANÇA ORIGINAL ==========
 
@@ -5736,6 +9423,7 @@ async def ajuda(ctx):
               "`!organizar_canais <id_cat> <id1> <id2>...` - Organiza canais\n"
               "`!backup_canais` - Backup da estrutura\n"
               "`!restaurar_canais <backup_id>` - Restaura backup\n"
+              "`!backups_canais` - Histórico de backups\n"
               "`!limpar_canais_inativos [dias]` - Limpeza inteligente\n"
               "`!estatisticas_canais` - Estatísticas detalhadas\n"
               "`!sync_cargos` - Sincroniza cargos\n"
@@ -5749,6 +9437,7 @@ async def ajuda(ctx):
         name="📄 SISTEMA DE PDF",
         value="`!pdf_canal [limite]` - Cria PDF das mensagens\n"
               "`!web_to_pdf [url]` - Converte site para PDF\n"
+              "`!transcricao [html|jsonl|pdf] [horas]` - Transcrição do canal\n"
               "`!banir @user [motivo]` - Ban com IA\n"
               "`!advertir @user [motivo]` - Advertir com IA",
         inline=False
@@ -5846,16 +9535,27 @@ async def on_ready():
     if 'canais_permitidos' in db.config:
         CONFIG['canais_permitidos'] = db.config['canais_permitidos']
     
+    # ✅ NOVO: Indexar as mensagens que chegaram com o bot desligado
+    for guild in bot.guilds:
+        indice_busca.agendar_recuperacao(guild)
+    
+    # ✅ NOVO: Snapshot de convites antes do loop de nicks (0.3s por membro),
+    # senão as entradas desse intervalo ficam sem convite atribuído
+    for guild in bot.guilds:
+        try:
+            await sistema_convites.carregar_snapshot(guild)
+        except Exception as e:
+            print(f"❌ Erro ao carregar convites de {guild.name}: {e}")
+    
     print("🔄 Iniciando sistema automático de cargos...")
     for guild in bot.guilds:
         try:
             membros_atualizados = await sistema_cargos.atribuir_cargo_membro_automatico(guild)
             print(f"✅ {membros_atualizados} membros receberam cargo 'Membro' em {guild.name}")
             
-            for member in guild.members:
-                if not member.bot:
-                    await sistema_cargos.atualizar_nick_automatico(member)
-                    await asyncio.sleep(0.3)
+            for member in indice_membros.membros(guild, indice_membros.snapshot(guild).humanos()):
+                await sistema_cargos.atualizar_nick_automatico(member)
+                await asyncio.sleep(0.3)
             
             print(f"✅ Nicks atualizados em {guild.name}")
         except Exception as e:
@@ -5870,19 +9570,26 @@ async def on_ready():
         except Exception as e:
             print(f"❌ Erro em {guild.name}: {e}")
 
-@bot.event
-async def on_member_remove(member):
-    await log_system.log_saida(member)
-
 @bot.event
 async def on_member_update(before, after):
+    if before.roles != after.roles or before.nick != after.nick:
+        indice_membros.atualizado(after)
     if before.roles != after.roles:
         await sistema_cargos.atualizar_nick_automatico(after)
 
+# ✅ NOVO: Manter o status do snapshot de membros
+@bot.event
+async def on_presence_update(before, after):
+    if before.status != after.status:
+        indice_membros.presenca(after)
+
 # ========== INICIALIZAR BOT ==========
 if __name__ == "__main__":
     token = os.getenv('DISCORD_TOKEN')
     if token:
-        bot.run(token)
+        try:
+            bot.run(token)
+        finally:
+            db.fechar()
     else:
         print("❌ Token do Discord não encontrado")
\ No newline at end of file
@@ -16,9 +16,10 @@ import aiofiles
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple, Set
 import traceback
+import time
 import pickle
 import hashlib
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
 import random
 import string
 from enum import Enum
@@ -221,11 +222,15 @@ intents.presences = True
 intents.members = True
 
 # Criar bot
+# 429 com espera acima deste limite vira discord.RateLimited (as curtas o discord.py repete sozinho)
+LIMITE_ESPERA_RATELIMIT = 10.0
+
 bot = commands.Bot(
     command_prefix='#',
     intents=intents,
     help_command=None,
-    case_insensitive=True
+    case_insensitive=True,
+    max_ratelimit_timeout=LIMITE_ESPERA_RATELIMIT
 )
 
 # ==============================================
@@ -389,6 +394,245 @@ class WhitelistMaster:
 
 whitelist_master = WhitelistMaster()
 
+# ==============================================
+# MOTOR DE CONTADORES POR JANELA DE TEMPO
+# ==============================================
+
+class WindowCounterEngine:
+    """Contadores de eventos por janela de tempo, compartilhados pelo anti-nuke e anti-raid.
+
+    As chaves são separadas por namespace ('raid_join', 'spam', ...) para ids de
+    guild e de membro nunca se misturarem. Cada chave guarda um deque de
+    timestamps monotônicos (O(1) amortizado), chaves ociosas expiram por TTL e
+    o total de chaves é limitado (as menos recentes são descartadas).
+    """
+    
+    def __init__(self, max_chaves: int = 50000, intervalo_limpeza: float = 60.0):
+        self.max_chaves = max_chaves
+        self.intervalo_limpeza = intervalo_limpeza
+        self.eventos: "OrderedDict[Tuple[str, Any], Tuple[float, deque]]" = OrderedDict()
+        self.ultima_limpeza = time.monotonic()
+    
+    def registrar(self, namespace: str, chave: Any, janela: float) -> int:
+        """Registra um evento e retorna quantos existem na janela"""
+        agora = time.monotonic()
+        item = (namespace, chave)
+        
+        if item in self.eventos:
+            _, fila = self.eventos[item]
+            self.eventos.move_to_end(item)
+        else:
+            fila = deque()
+        
+        fila.append(agora)
+        while fila[0] <= agora - janela:
+            fila.popleft()
+        self.eventos[item] = (janela, fila)
+        
+        # Limite de memória: descarta as chaves usadas há mais tempo
+        while len(self.eventos) > self.max_chaves:
+            self.eventos.popitem(last=False)
+        
+        if agora - self.ultima_limpeza >= self.intervalo_limpeza:
+            self.limpar_ociosos()
+        
+        return len(fila)
+    
+    def contar(self, namespace: str, chave: Any) -> int:
+        """Quantos eventos a chave tem na janela atual"""
+        item = self.eventos.get((namespace, chave))
+        if not item:
+            return 0
+        
+        janela, fila = item
+        limite = time.monotonic() - janela
+        while fila and fila[0] <= limite:
+            fila.popleft()
+        return len(fila)
+    
+    def resetar(self, namespace: str, chave: Any):
+        """Zera o contador de uma chave"""
+        self.eventos.pop((namespace, chave), None)
+    
+    def limpar_ociosos(self):
+        """Remove chaves cujo último evento já saiu da janela (TTL)"""
+        agora = time.monotonic()
+        ociosas = [item for item, (janela, fila) in self.eventos.items() if not fila or fila[-1] <= agora - janela]
+        for item in ociosas:
+            del self.eventos[item]
+        self.ultima_limpeza = agora
+    
+    def limpar(self, namespace: Optional[str] = None):
+        """Limpa todos os contadores (ou apenas de um namespace)"""
+        if namespace is None:
+            self.eventos.clear()
+            return
+        for item in [i for i in self.eventos if i[0] == namespace]:
+            del self.eventos[item]
+
+window_counter = WindowCounterEngine()
+
+# ==============================================
+# CORRELACIONADOR DE AUDIT LOG (GATEWAY)
+# ==============================================
+
+class AuditLogCorrelator:
+    """Índice das entradas recentes do audit log recebidas pelo gateway.
+
+    Consome on_audit_log_entry_create e indexa por (guild, ação, alvo) com TTL,
+    então os handlers descobrem quem fez a ação sem chamar guild.audit_logs()
+    a cada evento. Se a entrada não chegar dentro do timeout, faz uma única
+    consulta REST (compartilhada entre handlers que esperam a mesma ação).
+    Entradas anteriores ao evento nunca são aceitas.
+    """
+    
+    def __init__(self, ttl: float = 30.0, max_entradas: int = 5000, timeout: float = 3.0, tolerancia: float = 5.0):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.timeout = timeout
+        self.tolerancia = tolerancia
+        self.entradas: "OrderedDict[Tuple[int, Any, Any], Tuple[float, Any]]" = OrderedDict()
+        self.aguardando: Dict[Tuple[int, Any, Any], List[Tuple[asyncio.Future, datetime]]] = defaultdict(list)
+        self.buscas_rest: Dict[Tuple[int, Any], asyncio.Task] = {}
+        self.estatisticas = {'gateway': 0, 'cache': 0, 'rest': 0, 'nao_encontrado': 0}
+    
+    @staticmethod
+    def _alvo(entry) -> Any:
+        """Id do alvo da entrada (convites são identificados pelo código)"""
+        target = entry.target
+        if entry.action in (discord.AuditLogAction.invite_create, discord.AuditLogAction.invite_delete):
+            codigo = getattr(target, 'code', None)
+            if codigo:
+                return codigo
+        return getattr(target, 'id', None)
+    
+    def _limpar_expiradas(self):
+        """Remove entradas fora do TTL e o excesso acima do limite"""
+        limite = time.monotonic() - self.ttl
+        while self.entradas:
+            chave, (recebida, _) = next(iter(self.entradas.items()))
+            if recebida > limite and len(self.entradas) <= self.max_entradas:
+                break
+            self.entradas.popitem(last=False)
+    
+    def registrar(self, entry):
+        """Indexa uma entrada do audit log e acorda quem estava esperando por ela"""
+        alvo = self._alvo(entry)
+        if alvo is None:
+            return
+        
+        # O evento do gateway pode chegar sem o autor em cache
+        if entry.user is None and getattr(entry, 'user_id', None):
+            entry.user = entry.guild.get_member(entry.user_id) or bot.get_user(entry.user_id)
+        
+        chave = (entry.guild.id, entry.action, alvo)
+        self.entradas.pop(chave, None)
+        self.entradas[chave] = (time.monotonic(), entry)
+        self._limpar_expiradas()
+        
+        # Só acorda quem espera por uma entrada criada a partir do seu evento
+        restantes = []
+        for future, desde in self.aguardando.pop(chave, []):
+            if future.done():
+                continue
+            if entry.created_at >= desde:
+                future.set_result(entry)
+            else:
+                restantes.append((future, desde))
+        if restantes:
+            self.aguardando[chave] = restantes
+    
+    def obter_recente(self, guild: discord.Guild, acao, alvo, desde: Optional[datetime] = None) -> Optional[Any]:
+        """Retorna a entrada em cache, se ainda dentro do TTL e não anterior a `desde`"""
+        item = self.entradas.get((guild.id, acao, alvo))
+        if item and time.monotonic() - item[0] <= self.ttl:
+            if desde is None or item[1].created_at >= desde:
+                return item[1]
+        return None
+    
+    def inicio_evento(self) -> datetime:
+        """Marco a partir do qual uma entrada conta para o evento atual"""
+        return discord.utils.utcnow() - timedelta(seconds=self.tolerancia)
+    
+    async def aguardar_entrada(self, guild: discord.Guild, acao, alvo, timeout: Optional[float] = None,
+                               desde: Optional[datetime] = None, rest: bool = True):
+        """Aguarda a entrada do audit log de uma ação (autor em entry.user).
+
+        Entradas anteriores a `desde` (padrão: agora menos a tolerância) são
+        ignoradas. Com rest=False não há fallback REST, para eventos que
+        muitas vezes não geram entrada (saídas e autoexclusões).
+        """
+        if desde is None:
+            desde = self.inicio_evento()
+        
+        entry = self.obter_recente(guild, acao, alvo, desde)
+        if entry:
+            self.estatisticas['cache'] += 1
+            return await self._garantir_autor(entry)
+        
+        chave = (guild.id, acao, alvo)
+        future = asyncio.get_running_loop().create_future()
+        self.aguardando[chave].append((future, desde))
+        
+        try:
+            entry = await asyncio.wait_for(future, timeout=timeout or self.timeout)
+            self.estatisticas['gateway'] += 1
+            return await self._garantir_autor(entry)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if chave in self.aguardando:
+                self.aguardando[chave] = [item for item in self.aguardando[chave] if item[0] is not future]
+                if not self.aguardando[chave]:
+                    del self.aguardando[chave]
+        
+        if not rest:
+            self.estatisticas['nao_encontrado'] += 1
+            return None
+        
+        # Fallback: uma consulta REST por (guild, ação), compartilhada
+        await self._buscar_rest(guild, acao)
+        entry = self.obter_recente(guild, acao, alvo, desde)
+        if entry:
+            self.estatisticas['rest'] += 1
+            return await self._garantir_autor(entry)
+        
+        self.estatisticas['nao_encontrado'] += 1
+        return None
+    
+    async def _buscar_rest(self, guild: discord.Guild, acao):
+        """Busca as últimas entradas via REST, sem duplicar buscas simultâneas"""
+        chave = (guild.id, acao)
+        task = self.buscas_rest.get(chave)
+        
+        if not task or task.done():
+            async def buscar():
+                try:
+                    entradas = [entry async for entry in guild.audit_logs(limit=5, action=acao)]
+                    # Mais antigas primeiro, para a mais recente prevalecer no índice
+                    for entry in reversed(entradas):
+                        self.registrar(entry)
+                except Exception as e:
+                    logger.log_system(f"Erro ao consultar audit log: {e}", "ERROR")
+                finally:
+                    self.buscas_rest.pop(chave, None)
+            
+            task = asyncio.create_task(buscar())
+            self.buscas_rest[chave] = task
+        
+        await asyncio.shield(task)
+    
+    async def _garantir_autor(self, entry):
+        """Busca o autor via API se ele não estava em cache"""
+        if entry.user is None and getattr(entry, 'user_id', None):
+            try:
+                entry.user = await bot.fetch_user(entry.user_id)
+            except Exception:
+                return None
+        return entry if entry.user else None
+
+audit_correlator = AuditLogCorrelator()
+
 # ==============================================
 # SISTEMA ANTI-NUKE PROFISSIONAL
 # ==============================================
@@ -397,7 +641,6 @@ class AntiNukeProfessional:
     """Sistema Anti-Nuke nível empresarial"""
     
     def __init__(self):
-        self.cooldowns = {}
         self.suspicious_actions = defaultdict(list)
         self.auto_restore_queue = []
         self.lockdown_mode = False
@@ -407,261 +650,245 @@ class AntiNukeProfessional:
         """Monitora criação de cargos"""
         guild = role.guild
         
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.role_create):
-            if entry.target.id == role.id:
-                user = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.role_create, role.id)
+        if entry:
+            user = entry.user
                 
-                # Verificar se quem criou está na whitelist
-                if not whitelist_master.is_whitelisted(user.id) and user.id != bot.user.id:
+            # Verificar se quem criou está na whitelist
+            if not whitelist_master.is_whitelisted(user.id) and user.id != bot.user.id:
                     
-                    # Verificar se o cargo tem permissões perigosas
-                    if whitelist_master.tem_permissao_perigosa(role.permissions):
-                        # AÇÃO: Deletar cargo e punir criador
-                        try:
-                            await role.delete(reason=f"Anti-Nuke: Cargo perigoso criado por não autorizado - {user.name}")
+                # Verificar se o cargo tem permissões perigosas
+                if whitelist_master.tem_permissao_perigosa(role.permissions):
+                    # AÇÃO: Deletar cargo e punir criador
+                    try:
+                        await role.delete(reason=f"Anti-Nuke: Cargo perigoso criado por não autorizado - {user.name}")
                             
-                            # Punição automática
-                            if user != guild.owner and user != bot.user:
-                                try:
-                                    await user.kick(reason="Tentativa de escalar privilégios")
-                                    logger.log_action("KICK", user, role, "Criação de cargo perigoso")
-                                except:
-                                    pass
+                        # Punição automática
+                        if user != guild.owner and user != bot.user:
+                            try:
+                                await user.kick(reason="Tentativa de escalar privilégios")
+                                logger.log_action("KICK", user, role, "Criação de cargo perigoso")
+                            except:
+                                pass
                             
-                            # Log detalhado
-                            logger.log_nuke(f"Cargo perigoso criado e removido: {role.name} por {user.name}", user)
-                            logger.log_security("CRITICAL", f"Tentativa de criar cargo admin: {role.name}", user)
+                        # Log detalhado
+                        logger.log_nuke(f"Cargo perigoso criado e removido: {role.name} por {user.name}", user)
+                        logger.log_security("CRITICAL", f"Tentativa de criar cargo admin: {role.name}", user)
                             
-                            # Notificar owner
-                            await self.notificar_owner(
-                                guild,
-                                f"🚨 **TENTATIVA DE NUKE DETECTADA**\n"
-                                f"**Usuário:** {user.mention} ({user.id})\n"
-                                f"**Ação:** Criou cargo perigoso `{role.name}`\n"
-                                f"**Status:** Bloqueado e usuário expulso\n"
-                                f"**Permissões:** {role.permissions.value}"
-                            )
+                        # Notificar owner
+                        await self.notificar_owner(
+                            guild,
+                            f"🚨 **TENTATIVA DE NUKE DETECTADA**\n"
+                            f"**Usuário:** {user.mention} ({user.id})\n"
+                            f"**Ação:** Criou cargo perigoso `{role.name}`\n"
+                            f"**Status:** Bloqueado e usuário expulso\n"
+                            f"**Permissões:** {role.permissions.value}"
+                        )
                             
-                        except Exception as e:
-                            logger.log_system(f"Erro ao deletar cargo perigoso: {e}", "ERROR")
-                
-                break
+                    except Exception as e:
+                        logger.log_system(f"Erro ao deletar cargo perigoso: {e}", "ERROR")
     
     async def monitorar_delecao_cargo(self, role: discord.Role):
         """Monitora deleção de cargos"""
         guild = role.guild
         
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.role_delete):
-            if entry.target.id == role.id:
-                user = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.role_delete, role.id)
+        if entry:
+            user = entry.user
                 
-                # Se o cargo deletado é importante (staff ou bot)
-                if role.name.lower() in ['staff', 'admin', 'administrator', 'mod', 'moderator', bot.user.name.lower()]:
-                    if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
+            # Se o cargo deletado é importante (staff ou bot)
+            if role.name.lower() in ['staff', 'admin', 'administrator', 'mod', 'moderator', bot.user.name.lower()]:
+                if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
                         
-                        # AUTO-RESTORE: Recriar cargo
+                    # AUTO-RESTORE: Recriar cargo
+                    try:
+                        restored_role = await guild.create_role(
+                            name=role.name,
+                            color=role.color,
+                            hoist=role.hoist,
+                            mentionable=role.mentionable,
+                            permissions=role.permissions,
+                            reason="Auto-Restore: Cargo importante deletado"
+                        )
+                            
+                        # Restaurar posição se possível
                         try:
-                            restored_role = await guild.create_role(
-                                name=role.name,
-                                color=role.color,
-                                hoist=role.hoist,
-                                mentionable=role.mentionable,
-                                permissions=role.permissions,
-                                reason="Auto-Restore: Cargo importante deletado"
-                            )
+                            await restored_role.edit(position=role.position)
+                        except:
+                            pass
                             
-                            # Restaurar posição se possível
+                        # Punição automática
+                        if user != guild.owner and user != bot.user:
                             try:
-                                await restored_role.edit(position=role.position)
+                                await user.kick(reason="Tentativa de deletar cargo importante")
+                                logger.log_action("KICK", user, role, "Deleção de cargo importante")
                             except:
                                 pass
                             
-                            # Punição automática
-                            if user != guild.owner and user != bot.user:
-                                try:
-                                    await user.kick(reason="Tentativa de deletar cargo importante")
-                                    logger.log_action("KICK", user, role, "Deleção de cargo importante")
-                                except:
-                                    pass
+                        # Log
+                        logger.log_nuke(f"Cargo importante restaurado: {role.name} (deletado por {user.name})", user)
                             
-                            # Log
-                            logger.log_nuke(f"Cargo importante restaurado: {role.name} (deletado por {user.name})", user)
-                            
-                            # Notificar
-                            await self.notificar_owner(
-                                guild,
-                                f"🛡️ **CARGO RESTAURADO AUTOMATICAMENTE**\n"
-                                f"**Usuário:** {user.mention} ({user.id})\n"
-                                f"**Ação:** Deletou cargo importante `{role.name}`\n"
-                                f"**Status:** Cargo restaurado, usuário punido"
-                            )
+                        # Notificar
+                        await self.notificar_owner(
+                            guild,
+                            f"🛡️ **CARGO RESTAURADO AUTOMATICAMENTE**\n"
+                            f"**Usuário:** {user.mention} ({user.id})\n"
+                            f"**Ação:** Deletou cargo importante `{role.name}`\n"
+                            f"**Status:** Cargo restaurado, usuário punido"
+                        )
                             
-                        except Exception as e:
-                            logger.log_system(f"Erro ao restaurar cargo: {e}", "ERROR")
-                
-                break
+                    except Exception as e:
+                        logger.log_system(f"Erro ao restaurar cargo: {e}", "ERROR")
     
     async def monitorar_delecao_canal(self, channel: discord.abc.GuildChannel):
         """Monitora deleção de canais"""
         guild = channel.guild
         
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_delete):
-            if entry.target.id == channel.id:
-                user = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.channel_delete, channel.id)
+        if entry:
+            user = entry.user
                 
-                if not whitelist_master.is_whitelisted(user.id) and user != guild.owner and user != bot.user:
-                    
-                    # Verificar se é deleção em massa
-                    user_id = user.id
-                    agora = datetime.utcnow()
-                    
-                    if user_id not in self.cooldowns:
-                        self.cooldowns[user_id] = []
-                    
-                    self.cooldowns[user_id].append(agora)
+            if not whitelist_master.is_whitelisted(user.id) and user != guild.owner and user != bot.user:
                     
-                    # Limpar timestamps antigos
-                    self.cooldowns[user_id] = [t for t in self.cooldowns[user_id] if agora - t < timedelta(seconds=10)]
+                # Verificar se é deleção em massa
+                agora = datetime.utcnow()
+                total_delecoes = window_counter.registrar('nuke_channel_delete', user.id, 10)
                     
-                    # Se deletou mais de 2 canais em 10 segundos
-                    if len(self.cooldowns[user_id]) > 2:
-                        # MODO EMERGENCIAL: Banir usuário
-                        try:
-                            await user.ban(reason="Deleção em massa de canais (Anti-Nuke)", delete_message_days=1)
-                            logger.log_nuke(f"BAN por deleção em massa: {user.name} deletou {len(self.cooldowns[user_id])} canais", user)
+                # Se deletou mais de 2 canais em 10 segundos
+                if total_delecoes > 2:
+                    # MODO EMERGENCIAL: Banir usuário
+                    try:
+                        await user.ban(reason="Deleção em massa de canais (Anti-Nuke)", delete_message_days=1)
+                        logger.log_nuke(f"BAN por deleção em massa: {user.name} deletou {total_delecoes} canais", user)
                             
-                            # Notificar modo de emergência
-                            await self.notificar_owner(
-                                guild,
-                                f"🚨🚨 **EMERGÊNCIA: DELETOR EM MASSA**\n"
-                                f"**Usuário:** {user.mention} ({user.id})\n"
-                                f"**Ação:** Deletou {len(self.cooldowns[user_id])} canais em 10 segundos\n"
-                                f"**Status:** BANIDO AUTOMATICAMENTE\n"
-                                f"**Hora:** {agora.strftime('%H:%M:%S')}"
-                            )
+                        # Notificar modo de emergência
+                        await self.notificar_owner(
+                            guild,
+                            f"🚨🚨 **EMERGÊNCIA: DELETOR EM MASSA**\n"
+                            f"**Usuário:** {user.mention} ({user.id})\n"
+                            f"**Ação:** Deletou {total_delecoes} canais em 10 segundos\n"
+                            f"**Status:** BANIDO AUTOMATICAMENTE\n"
+                            f"**Hora:** {agora.strftime('%H:%M:%S')}"
+                        )
                             
-                        except Exception as e:
-                            logger.log_system(f"Erro ao banir deletor em massa: {e}", "ERROR")
+                    except Exception as e:
+                        logger.log_system(f"Erro ao banir deletor em massa: {e}", "ERROR")
                     
-                    else:
-                        # AUTO-RESTORE: Recriar canal
-                        try:
-                            if isinstance(channel, discord.TextChannel):
-                                novo_canal = await channel.category.create_text_channel(
-                                    name=channel.name,
-                                    topic=channel.topic,
-                                    nsfw=channel.nsfw,
-                                    slowmode_delay=channel.slowmode_delay,
-                                    position=channel.position,
-                                    overwrites=channel.overwrites,
-                                    reason="Auto-Restore: Canal deletado"
-                                ) if channel.category else await guild.create_text_channel(
-                                    name=channel.name,
-                                    topic=channel.topic,
-                                    nsfw=channel.nsfw,
-                                    slowmode_delay=channel.slowmode_delay,
-                                    position=channel.position,
-                                    overwrites=channel.overwrites,
-                                    reason="Auto-Restore: Canal deletado"
-                                )
-                            elif isinstance(channel, discord.VoiceChannel):
-                                novo_canal = await channel.category.create_voice_channel(
-                                    name=channel.name,
-                                    bitrate=channel.bitrate,
-                                    user_limit=channel.user_limit,
-                                    position=channel.position,
-                                    overwrites=channel.overwrites,
-                                    reason="Auto-Restore: Canal deletado"
-                                ) if channel.category else await guild.create_voice_channel(
-                                    name=channel.name,
-                                    bitrate=channel.bitrate,
-                                    user_limit=channel.user_limit,
-                                    position=channel.position,
-                                    overwrites=channel.overwrites,
-                                    reason="Auto-Restore: Canal deletado"
-                                )
+                else:
+                    # AUTO-RESTORE: Recriar canal
+                    try:
+                        if isinstance(channel, discord.TextChannel):
+                            novo_canal = await channel.category.create_text_channel(
+                                name=channel.name,
+                                topic=channel.topic,
+                                nsfw=channel.nsfw,
+                                slowmode_delay=channel.slowmode_delay,
+                                position=channel.position,
+                                overwrites=channel.overwrites,
+                                reason="Auto-Restore: Canal deletado"
+                            ) if channel.category else await guild.create_text_channel(
+                                name=channel.name,
+                                topic=channel.topic,
+                                nsfw=channel.nsfw,
+                                slowmode_delay=channel.slowmode_delay,
+                                position=channel.position,
+                                overwrites=channel.overwrites,
+                                reason="Auto-Restore: Canal deletado"
+                            )
+                        elif isinstance(channel, discord.VoiceChannel):
+                            novo_canal = await channel.category.create_voice_channel(
+                                name=channel.name,
+                                bitrate=channel.bitrate,
+                                user_limit=channel.user_limit,
+                                position=channel.position,
+                                overwrites=channel.overwrites,
+                                reason="Auto-Restore: Canal deletado"
+                            ) if channel.category else await guild.create_voice_channel(
+                                name=channel.name,
+                                bitrate=channel.bitrate,
+                                user_limit=channel.user_limit,
+                                position=channel.position,
+                                overwrites=channel.overwrites,
+                                reason="Auto-Restore: Canal deletado"
+                            )
                             
-                            # Punição para deletor
-                            try:
-                                await user.kick(reason="Tentativa de deletar canal")
-                                logger.log_action("KICK", user, channel, "Deleção de canal")
-                            except:
-                                pass
+                        # Punição para deletor
+                        try:
+                            await user.kick(reason="Tentativa de deletar canal")
+                            logger.log_action("KICK", user, channel, "Deleção de canal")
+                        except:
+                            pass
                             
-                            logger.log_nuke(f"Canal restaurado: #{channel.name} (deletado por {user.name})", user)
+                        logger.log_nuke(f"Canal restaurado: #{channel.name} (deletado por {user.name})", user)
                             
-                            # Notificar
-                            await self.notificar_owner(
-                                guild,
-                                f"🛡️ **CANAL RESTAURADO AUTOMATICAMENTE**\n"
-                                f"**Usuário:** {user.mention} ({user.id})\n"
-                                f"**Ação:** Deletou canal `#{channel.name}`\n"
-                                f"**Status:** Canal restaurado, usuário expulso"
-                            )
+                        # Notificar
+                        await self.notificar_owner(
+                            guild,
+                            f"🛡️ **CANAL RESTAURADO AUTOMATICAMENTE**\n"
+                            f"**Usuário:** {user.mention} ({user.id})\n"
+                            f"**Ação:** Deletou canal `#{channel.name}`\n"
+                            f"**Status:** Canal restaurado, usuário expulso"
+                        )
                             
-                        except Exception as e:
-                            logger.log_system(f"Erro ao restaurar canal: {e}", "ERROR")
-                
-                break
+                    except Exception as e:
+                        logger.log_system(f"Erro ao restaurar canal: {e}", "ERROR")
     
     async def monitorar_alteracao_cargo(self, before: discord.Role, after: discord.Role):
         """Monitora alterações em cargos"""
         guild = after.guild
         
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.role_update):
-            if entry.target.id == after.id:
-                user = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.role_update, after.id)
+        if entry:
+            user = entry.user
                 
-                # Verificar se alguém não autorizado deu permissões perigosas
-                if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
+            # Verificar se alguém não autorizado deu permissões perigosas
+            if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
                     
-                    # Verificar se foram adicionadas permissões perigosas
-                    perms_antes = before.permissions
-                    perms_depois = after.permissions
+                # Verificar se foram adicionadas permissões perigosas
+                perms_antes = before.permissions
+                perms_depois = after.permissions
                     
-                    perigosas_adicionadas = []
-                    for perm in whitelist_master.PERMISSIONS_PERIGOSAS:
-                        if not getattr(perms_antes, perm) and getattr(perms_depois, perm):
-                            perigosas_adicionadas.append(perm)
+                perigosas_adicionadas = []
+                for perm in whitelist_master.PERMISSIONS_PERIGOSAS:
+                    if not getattr(perms_antes, perm) and getattr(perms_depois, perm):
+                        perigosas_adicionadas.append(perm)
                     
-                    if perigosas_adicionadas:
-                        # REVERTER: Remover permissões perigosas
-                        try:
-                            # Criar novas permissões (removendo as perigosas)
-                            novas_perms = after.permissions
-                            for perm in perigosas_adicionadas:
-                                setattr(novas_perms, perm, False)
+                if perigosas_adicionadas:
+                    # REVERTER: Remover permissões perigosas
+                    try:
+                        # Criar novas permissões (removendo as perigosas)
+                        novas_perms = after.permissions
+                        for perm in perigosas_adicionadas:
+                            setattr(novas_perms, perm, False)
                             
-                            await after.edit(permissions=novas_perms, reason="Anti-Nuke: Permissões perigosas removidas")
+                        await after.edit(permissions=novas_perms, reason="Anti-Nuke: Permissões perigosas removidas")
                             
-                            # Punição automática
-                            if user != guild.owner and user != bot.user:
-                                try:
-                                    await user.kick(reason="Tentativa de escalar permissões de cargo")
-                                    logger.log_action("KICK", user, after, "Alteração de permissões perigosas")
-                                except:
-                                    pass
+                        # Punição automática
+                        if user != guild.owner and user != bot.user:
+                            try:
+                                await user.kick(reason="Tentativa de escalar permissões de cargo")
+                                logger.log_action("KICK", user, after, "Alteração de permissões perigosas")
+                            except:
+                                pass
                             
-                            logger.log_nuke(f"Permissões perigosas revertidas no cargo: {after.name} (alterado por {user.name})", user)
-                            logger.log_security("HIGH", f"Tentativa de escalar cargo {after.name}", user)
+                        logger.log_nuke(f"Permissões perigosas revertidas no cargo: {after.name} (alterado por {user.name})", user)
+                        logger.log_security("HIGH", f"Tentativa de escalar cargo {after.name}", user)
                             
-                            # Log detalhado de permissões
-                            logger.log_permission("ROLE_UPDATE", user, after.name, perms_antes.value, perms_depois.value)
+                        # Log detalhado de permissões
+                        logger.log_permission("ROLE_UPDATE", user, after.name, perms_antes.value, perms_depois.value)
                             
-                            # Notificar
-                            await self.notificar_owner(
-                                guild,
-                                f"⚠️ **TENTATIVA DE ESCALAR PERMISSÕES**\n"
-                                f"**Usuário:** {user.mention} ({user.id})\n"
-                                f"**Cargo:** @{after.name}\n"
-                                f"**Permissões adicionadas:** {', '.join(perigosas_adicionadas)}\n"
-                                f"**Status:** Revertido automaticamente"
-                            )
+                        # Notificar
+                        await self.notificar_owner(
+                            guild,
+                            f"⚠️ **TENTATIVA DE ESCALAR PERMISSÕES**\n"
+                            f"**Usuário:** {user.mention} ({user.id})\n"
+                            f"**Cargo:** @{after.name}\n"
+                            f"**Permissões adicionadas:** {', '.join(perigosas_adicionadas)}\n"
+                            f"**Status:** Revertido automaticamente"
+                        )
                             
-                        except Exception as e:
-                            logger.log_system(f"Erro ao reverter permissões: {e}", "ERROR")
-                
-                break
+                    except Exception as e:
+                        logger.log_system(f"Erro ao reverter permissões: {e}", "ERROR")
     
     async def monitorar_membro_update(self, before: discord.Member, after: discord.Member):
         """Monitora atualização de membros (cargos)"""
@@ -674,208 +901,196 @@ class AntiNukeProfessional:
                     # Verificar quem adicionou
                     guild = after.guild
                     
-                    async for entry in guild.audit_logs(limit=10, action=discord.AuditLogAction.member_role_update):
-                        if entry.target.id == after.id:
-                            user = entry.user
+                    entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.member_role_update, after.id)
+                    if entry:
+                        user = entry.user
                             
-                            # Se quem deu o cargo não está na whitelist
-                            if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
+                        # Se quem deu o cargo não está na whitelist
+                        if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
                                 
-                                # REMOVER CARGO PERIGOSO
-                                try:
-                                    await after.remove_roles(cargo, reason=f"Anti-Nuke: Cargo perigoso dado por não autorizado - {user.name}")
+                            # REMOVER CARGO PERIGOSO
+                            try:
+                                await after.remove_roles(cargo, reason=f"Anti-Nuke: Cargo perigoso dado por não autorizado - {user.name}")
                                     
-                                    # Punição automática para quem deu o cargo
-                                    if user != guild.owner and user != bot.user:
-                                        try:
-                                            await user.kick(reason="Tentativa de dar cargo perigoso")
-                                            logger.log_action("KICK", user, after, "Dar cargo perigoso")
-                                        except:
-                                            pass
+                                # Punição automática para quem deu o cargo
+                                if user != guild.owner and user != bot.user:
+                                    try:
+                                        await user.kick(reason="Tentativa de dar cargo perigoso")
+                                        logger.log_action("KICK", user, after, "Dar cargo perigoso")
+                                    except:
+                                        pass
                                     
-                                    # Se o membro que recebeu também não está na whitelist, punir também
-                                    if not whitelist_master.is_whitelisted(after.id) and after != guild.owner:
-                                        try:
-                                            await after.kick(reason="Tentativa de receber cargo perigoso")
-                                            logger.log_action("KICK", after, cargo, "Receber cargo perigoso")
-                                        except:
-                                            pass
+                                # Se o membro que recebeu também não está na whitelist, punir também
+                                if not whitelist_master.is_whitelisted(after.id) and after != guild.owner:
+                                    try:
+                                        await after.kick(reason="Tentativa de receber cargo perigoso")
+                                        logger.log_action("KICK", after, cargo, "Receber cargo perigoso")
+                                    except:
+                                        pass
                                     
-                                    logger.log_nuke(f"Cargo perigoso removido: {cargo.name} de {after.name} (dado por {user.name})", user)
-                                    logger.log_security("HIGH", f"Tentativa de dar cargo admin {cargo.name} para {after.name}", user)
+                                logger.log_nuke(f"Cargo perigoso removido: {cargo.name} de {after.name} (dado por {user.name})", user)
+                                logger.log_security("HIGH", f"Tentativa de dar cargo admin {cargo.name} para {after.name}", user)
                                     
-                                    # Notificar
-                                    await self.notificar_owner(
-                                        guild,
-                                        f"🛡️ **CARGO PERIGOSO BLOQUEADO**\n"
-                                        f"**Quem deu:** {user.mention} ({user.id})\n"
-                                        f"**Quem recebeu:** {after.mention} ({after.id})\n"
-                                        f"**Cargo:** @{cargo.name}\n"
-                                        f"**Status:** Cargo removido, ambos punidos"
-                                    )
+                                # Notificar
+                                await self.notificar_owner(
+                                    guild,
+                                    f"🛡️ **CARGO PERIGOSO BLOQUEADO**\n"
+                                    f"**Quem deu:** {user.mention} ({user.id})\n"
+                                    f"**Quem recebeu:** {after.mention} ({after.id})\n"
+                                    f"**Cargo:** @{cargo.name}\n"
+                                    f"**Status:** Cargo removido, ambos punidos"
+                                )
                                     
-                                except Exception as e:
-                                    logger.log_system(f"Erro ao remover cargo perigoso: {e}", "ERROR")
-                            
-                            break
+                            except Exception as e:
+                                logger.log_system(f"Erro ao remover cargo perigoso: {e}", "ERROR")
     
     async def monitorar_ban(self, guild: discord.Guild, user: discord.User):
         """Monitora banimentos"""
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.ban):
-            if entry.target.id == user.id:
-                banner = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.ban, user.id)
+        if entry:
+            banner = entry.user
                 
-                if not whitelist_master.is_whitelisted(banner.id) and banner != guild.owner:
+            if not whitelist_master.is_whitelisted(banner.id) and banner != guild.owner:
                     
-                    # DESBANIR automaticamente
-                    try:
-                        await guild.unban(user, reason="Anti-Nuke: Banimento por não autorizado")
+                # DESBANIR automaticamente
+                try:
+                    await guild.unban(user, reason="Anti-Nuke: Banimento por não autorizado")
                         
-                        # Punir quem baniu
-                        if banner != guild.owner and banner != bot.user:
-                            try:
-                                await banner.kick(reason="Tentativa de banir membro")
-                                logger.log_action("KICK", banner, user, "Banimento não autorizado")
-                            except:
-                                pass
+                    # Punir quem baniu
+                    if banner != guild.owner and banner != bot.user:
+                        try:
+                            await banner.kick(reason="Tentativa de banir membro")
+                            logger.log_action("KICK", banner, user, "Banimento não autorizado")
+                        except:
+                            pass
                         
-                        logger.log_nuke(f"Banimento revertido: {user.name} (banido por {banner.name})", banner)
+                    logger.log_nuke(f"Banimento revertido: {user.name} (banido por {banner.name})", banner)
                         
-                        # Notificar
-                        await self.notificar_owner(
-                            guild,
-                            f"🛡️ **BANIMENTO REVERTIDO**\n"
-                            f"**Quem baniu:** {banner.mention} ({banner.id})\n"
-                            f"**Quem foi banido:** {user.name} ({user.id})\n"
-                            f"**Status:** Desbanido automaticamente"
-                        )
+                    # Notificar
+                    await self.notificar_owner(
+                        guild,
+                        f"🛡️ **BANIMENTO REVERTIDO**\n"
+                        f"**Quem baniu:** {banner.mention} ({banner.id})\n"
+                        f"**Quem foi banido:** {user.name} ({user.id})\n"
+                        f"**Status:** Desbanido automaticamente"
+                    )
                         
-                    except Exception as e:
-                        logger.log_system(f"Erro ao reverter ban: {e}", "ERROR")
+                except Exception as e:
+                    logger.log_system(f"Erro ao reverter ban: {e}", "ERROR")
+    
+    async def monitorar_kick(self, member: discord.Member, desde: Optional[datetime] = None):
+        """Monitora expulsões (saídas voluntárias não geram entrada, então não há fallback REST)"""
+        entry = await audit_correlator.aguardar_entrada(member.guild, discord.AuditLogAction.kick, member.id,
+                                                        desde=desde, rest=False)
+        if entry:
+            kicker = entry.user
                 
-                break
-    
-    async def monitorar_kick(self, member: discord.Member):
-        """Monitora expulsões"""
-        async for entry in member.guild.audit_logs(limit=5, action=discord.AuditLogAction.kick):
-            if entry.target.id == member.id:
-                kicker = entry.user
-                
-                if not whitelist_master.is_whitelisted(kicker.id) and kicker != member.guild.owner:
+            if not whitelist_master.is_whitelisted(kicker.id) and kicker != member.guild.owner:
                     
-                    # Tentar readicionar o membro (se possível via convite)
-                    # Como não podemos forçar reentrada, apenas punimos quem expulsou
+                # Tentar readicionar o membro (se possível via convite)
+                # Como não podemos forçar reentrada, apenas punimos quem expulsou
                     
-                    try:
-                        await kicker.kick(reason="Tentativa de expulsar membro")
-                        logger.log_action("KICK", kicker, member, "Expulsão não autorizada")
+                try:
+                    await kicker.kick(reason="Tentativa de expulsar membro")
+                    logger.log_action("KICK", kicker, member, "Expulsão não autorizada")
                         
-                        logger.log_nuke(f"Kicker punido: {kicker.name} (expulsou {member.name})", kicker)
+                    logger.log_nuke(f"Kicker punido: {kicker.name} (expulsou {member.name})", kicker)
                         
-                        # Notificar
-                        await self.notificar_owner(
-                            member.guild,
-                            f"🛡️ **EXPULSÃO BLOQUEADA**\n"
-                            f"**Quem expulsou:** {kicker.mention} ({kicker.id})\n"
-                            f"**Quem foi expulso:** {member.name} ({member.id})\n"
-                            f"**Status:** Expulsor punido"
-                        )
+                    # Notificar
+                    await self.notificar_owner(
+                        member.guild,
+                        f"🛡️ **EXPULSÃO BLOQUEADA**\n"
+                        f"**Quem expulsou:** {kicker.mention} ({kicker.id})\n"
+                        f"**Quem foi expulso:** {member.name} ({member.id})\n"
+                        f"**Status:** Expulsor punido"
+                    )
                         
-                    except Exception as e:
-                        logger.log_system(f"Erro ao punir kicker: {e}", "ERROR")
-                
-                break
+                except Exception as e:
+                    logger.log_system(f"Erro ao punir kicker: {e}", "ERROR")
     
     async def monitorar_criacao_invite(self, invite: discord.Invite):
         """Monitora criação de convites"""
         guild = invite.guild
         
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.invite_create):
-            if entry.target.code == invite.code:
-                user = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.invite_create, invite.code)
+        if entry:
+            user = entry.user
                 
-                if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
+            if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
                     
-                    # DELETAR convite
-                    try:
-                        await invite.delete(reason="Anti-Nuke: Convite criado por não autorizado")
+                # DELETAR convite
+                try:
+                    await invite.delete(reason="Anti-Nuke: Convite criado por não autorizado")
                         
-                        # Punir criador
-                        if user != guild.owner and user != bot.user:
-                            try:
-                                await user.kick(reason="Criação de convite não autorizada")
-                                logger.log_action("KICK", user, invite, "Criação de convite")
-                            except:
-                                pass
+                    # Punir criador
+                    if user != guild.owner and user != bot.user:
+                        try:
+                            await user.kick(reason="Criação de convite não autorizada")
+                            logger.log_action("KICK", user, invite, "Criação de convite")
+                        except:
+                            pass
                         
-                        logger.log_nuke(f"Convite deletado: criado por {user.name}", user)
+                    logger.log_nuke(f"Convite deletado: criado por {user.name}", user)
                         
-                    except Exception as e:
-                        logger.log_system(f"Erro ao deletar convite: {e}", "ERROR")
-                
-                break
+                except Exception as e:
+                    logger.log_system(f"Erro ao deletar convite: {e}", "ERROR")
     
     async def monitorar_criacao_webhook(self, webhook: discord.Webhook):
         """Monitora criação de webhooks"""
         guild = webhook.guild
         
-        async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.webhook_create):
-            if entry.target.id == webhook.id:
-                user = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.webhook_create, webhook.id)
+        if entry:
+            user = entry.user
                 
-                if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
+            if not whitelist_master.is_whitelisted(user.id) and user != guild.owner:
                     
-                    # DELETAR webhook
-                    try:
-                        await webhook.delete(reason="Anti-Nuke: Webhook criado por não autorizado")
+                # DELETAR webhook
+                try:
+                    await webhook.delete(reason="Anti-Nuke: Webhook criado por não autorizado")
                         
-                        # Punir criador
-                        if user != guild.owner and user != bot.user:
-                            try:
-                                await user.kick(reason="Criação de webhook não autorizada")
-                                logger.log_action("KICK", user, webhook, "Criação de webhook")
-                            except:
-                                pass
+                    # Punir criador
+                    if user != guild.owner and user != bot.user:
+                        try:
+                            await user.kick(reason="Criação de webhook não autorizada")
+                            logger.log_action("KICK", user, webhook, "Criação de webhook")
+                        except:
+                            pass
                         
-                        logger.log_nuke(f"Webhook deletado: criado por {user.name}", user)
-                        logger.log_security("MEDIUM", f"Webhook malicioso deletado", user)
+                    logger.log_nuke(f"Webhook deletado: criado por {user.name}", user)
+                    logger.log_security("MEDIUM", f"Webhook malicioso deletado", user)
                         
-                    except Exception as e:
-                        logger.log_system(f"Erro ao deletar webhook: {e}", "ERROR")
-                
-                break
+                except Exception as e:
+                    logger.log_system(f"Erro ao deletar webhook: {e}", "ERROR")
     
     async def monitorar_movimento_cargo(self, role: discord.Role, before_pos: int, after_pos: int):
         """Monitora movimentação de cargos na hierarquia"""
         guild = role.guild
         
-        async for entry in guild.audit_logs(limit=5):
-            if entry.action == discord.AuditLogAction.role_update:
-                if entry.target.id == role.id:
-                    user = entry.user
+        entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.role_update, role.id)
+        if entry:
+            user = entry.user
                     
-                    # Se alguém tentou mover cargo acima do bot ou de staff
-                    bot_role = guild.me.top_role
-                    if after_pos > bot_role.position and not whitelist_master.is_whitelisted(user.id):
+            # Se alguém tentou mover cargo acima do bot ou de staff
+            bot_role = guild.me.top_role
+            if after_pos > bot_role.position and not whitelist_master.is_whitelisted(user.id):
                         
-                        # REVERTER posição
-                        try:
-                            await role.edit(position=before_pos, reason="Anti-Nuke: Tentativa de mover cargo acima do bot")
+                # REVERTER posição
+                try:
+                    await role.edit(position=before_pos, reason="Anti-Nuke: Tentativa de mover cargo acima do bot")
                             
-                            # Punir
-                            if user != guild.owner and user != bot.user:
-                                try:
-                                    await user.kick(reason="Tentativa de mover cargo acima do bot")
-                                    logger.log_action("KICK", user, role, "Movimentação de cargo")
-                                except:
-                                    pass
+                    # Punir
+                    if user != guild.owner and user != bot.user:
+                        try:
+                            await user.kick(reason="Tentativa de mover cargo acima do bot")
+                            logger.log_action("KICK", user, role, "Movimentação de cargo")
+                        except:
+                            pass
                             
-                            logger.log_nuke(f"Posição de cargo revertida: {role.name} (movido por {user.name})", user)
+                    logger.log_nuke(f"Posição de cargo revertida: {role.name} (movido por {user.name})", user)
                             
-                        except Exception as e:
-                            logger.log_system(f"Erro ao reverter posição de cargo: {e}", "ERROR")
-                    
-                    break
+                except Exception as e:
+                    logger.log_system(f"Erro ao reverter posição de cargo: {e}", "ERROR")
     
     async def notificar_owner(self, guild: discord.Guild, message: str):
         """Notifica o owner sobre eventos críticos"""
@@ -941,7 +1156,6 @@ class AntiRaidProfessional:
     """Sistema Anti-Raid completo"""
     
     def __init__(self):
-        self.join_timestamps = defaultdict(list)
         self.suspicious_joins = defaultdict(list)
         self.raid_mode = False
         self.siege_mode = False
@@ -952,14 +1166,8 @@ class AntiRaidProfessional:
         agora = datetime.utcnow()
         guild_id = member.guild.id
         
-        # Adicionar timestamp
-        self.join_timestamps[guild_id].append(agora)
-        
-        # Limpar timestamps antigos (últimos 10 segundos)
-        self.join_timestamps[guild_id] = [
-            t for t in self.join_timestamps[guild_id]
-            if agora - t < timedelta(seconds=10)
-        ]
+        # Entradas nos últimos 10 segundos
+        total_entradas = window_counter.registrar('raid_join', guild_id, 10)
         
         # Verificar se é conta suspeita
         is_suspicious = await self.verificar_conta_suspeita(member)
@@ -974,7 +1182,7 @@ class AntiRaidProfessional:
             logger.log_raid(f"Conta suspeita detectada: {member.name} - {is_suspicious}", member)
         
         # Verificar se há raid (muitas entradas em pouco tempo)
-        if len(self.join_timestamps[guild_id]) > 7:  # Mais de 7 entradas em 10 segundos
+        if total_entradas > 7:  # Mais de 7 entradas em 10 segundos
             if not self.raid_mode:
                 await self.ativar_modo_raid(member.guild)
         
@@ -1107,22 +1315,11 @@ class AntiRaidProfessional:
     
     async def monitorar_spam(self, message: discord.Message):
         """Monitora spam de mensagens"""
-        author_id = message.author.id
-        agora = datetime.utcnow()
-        
-        if author_id not in self.join_timestamps:
-            self.join_timestamps[author_id] = []
-        
-        self.join_timestamps[author_id].append(agora)
-        
-        # Manter apenas últimos 10 segundos
-        self.join_timestamps[author_id] = [
-            t for t in self.join_timestamps[author_id]
-            if agora - t < timedelta(seconds=10)
-        ]
+        # Mensagens do autor nos últimos 10 segundos (namespace próprio, não mistura com guilds)
+        total_mensagens = window_counter.registrar('spam', message.author.id, 10)
         
         # Se enviou mais de 10 mensagens em 10 segundos
-        if len(self.join_timestamps[author_id]) > 10:
+        if total_mensagens > 10:
             await self.lidar_com_spammer(message.author, message.guild)
     
     async def lidar_com_spammer(self, member: discord.Member, guild: discord.Guild):
@@ -1131,12 +1328,11 @@ class AntiRaidProfessional:
             # Banir spammer
             await member.ban(reason="Anti-Raid: Spam em massa", delete_message_days=1)
             
-            logger.log_raid(f"Spammer banido: {member.name} ({len(self.join_timestamps[member.id])} mensagens em 10s)", member)
+            logger.log_raid(f"Spammer banido: {member.name} ({window_counter.contar('spam', member.id)} mensagens em 10s)", member)
             logger.log_action("BAN", bot.user, member, "Spam em massa")
             
             # Limpar cache
-            if member.id in self.join_timestamps:
-                del self.join_timestamps[member.id]
+            window_counter.resetar('spam', member.id)
         except Exception as e:
             logger.log_system(f"Erro ao banir spammer: {e}", "ERROR")
 
@@ -1270,6 +1466,338 @@ class VoicePermanente:
 
 voice_permanente = VoicePermanente()
 
+# ==============================================
+# EXECUTOR DE AÇÕES EM LOTE
+# ==============================================
+
+class BatchActionExecutor:
+    """Executa mutações em massa com concorrência limitada por bucket de rota.
+
+    Cada ação é (bucket, descrição, fábrica); a fábrica devolve a corrotina e
+    pode ser chamada de novo numa retentativa. A concorrência de cada bucket
+    sobe com sucessos; 429 curtos são repetidos pelo próprio discord.py e só os
+    longos (acima de LIMITE_ESPERA_RATELIMIT) chegam como discord.RateLimited,
+    quando a concorrência cai pela metade e o bucket pausa pelo retry_after.
+    O resultado é um relatório único com progresso e falhas.
+    """
+    
+    def __init__(self, concorrencia_inicial: int = 3, concorrencia_maxima: int = 8, max_tentativas: int = 3):
+        self.concorrencia_inicial = concorrencia_inicial
+        self.concorrencia_maxima = concorrencia_maxima
+        self.max_tentativas = max_tentativas
+        self.limites: Dict[str, int] = {}
+    
+    async def executar(self, acoes: List[Tuple[str, str, Any]], progresso=None, intervalo_progresso: float = 2.0) -> Dict[str, Any]:
+        """Executa as ações e retorna {'total', 'sucesso', 'falhas', 'resultados', 'rate_limits', 'duracao'}"""
+        resultado = {
+            'total': len(acoes),
+            'sucesso': 0,
+            'falhas': [],
+            'resultados': {},
+            'rate_limits': 0,
+            'duracao': 0.0
+        }
+        inicio = time.monotonic()
+        
+        por_bucket: Dict[str, deque] = defaultdict(deque)
+        for acao in acoes:
+            por_bucket[acao[0]].append(acao)
+        
+        estado_progresso = {'concluidas': 0, 'ultimo': 0.0}
+        
+        async def notificar(forcar: bool = False):
+            if not progresso:
+                return
+            agora = time.monotonic()
+            if forcar or agora - estado_progresso['ultimo'] >= intervalo_progresso:
+                estado_progresso['ultimo'] = agora
+                try:
+                    await progresso(estado_progresso['concluidas'], resultado['total'])
+                except Exception:
+                    pass
+        
+        async def processar_bucket(bucket: str, fila: deque):
+            self.limites.setdefault(bucket, self.concorrencia_inicial)
+            estado = {'ativos': 0, 'pausa_ate': 0.0, 'sucessos_seguidos': 0}
+            condicao = asyncio.Condition()
+            
+            async def trabalhador():
+                while fila:
+                    async with condicao:
+                        await condicao.wait_for(lambda: estado['ativos'] < self.limites[bucket])
+                        if not fila:
+                            return
+                        _, descricao, fabrica = fila.popleft()
+                        estado['ativos'] += 1
+                    
+                    try:
+                        ok, valor = await self._executar_acao(bucket, fabrica, estado, resultado)
+                    finally:
+                        async with condicao:
+                            estado['ativos'] -= 1
+                            condicao.notify_all()
+                    
+                    if ok:
+                        resultado['sucesso'] += 1
+                        resultado['resultados'][descricao] = valor
+                    else:
+                        resultado['falhas'].append((descricao, valor))
+                    estado_progresso['concluidas'] += 1
+                    await notificar()
+            
+            await asyncio.gather(*(trabalhador() for _ in range(min(self.concorrencia_maxima, len(fila)))))
+        
+        await asyncio.gather(*(processar_bucket(bucket, fila) for bucket, fila in por_bucket.items()))
+        
+        resultado['duracao'] = time.monotonic() - inicio
+        await notificar(forcar=True)
+        return resultado
+    
+    async def _executar_acao(self, bucket: str, fabrica, estado: Dict[str, Any], resultado: Dict[str, Any]) -> Tuple[bool, Any]:
+        """Executa uma ação com retentativas; retorna (ok, valor ou erro)"""
+        for tentativa in range(self.max_tentativas):
+            espera = estado['pausa_ate'] - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            
+            try:
+                valor = await fabrica()
+                estado['sucessos_seguidos'] += 1
+                if estado['sucessos_seguidos'] >= self.limites[bucket]:
+                    estado['sucessos_seguidos'] = 0
+                    self.limites[bucket] = min(self.concorrencia_maxima, self.limites[bucket] + 1)
+                return True, valor
+            except (discord.Forbidden, discord.NotFound) as e:
+                return False, str(e)
+            except discord.RateLimited as e:
+                # Só chega aqui por causa do max_ratelimit_timeout do client
+                resultado['rate_limits'] += 1
+                retry_after = e.retry_after or 1.0
+                estado['pausa_ate'] = max(estado['pausa_ate'], time.monotonic() + retry_after)
+                estado['sucessos_seguidos'] = 0
+                self.limites[bucket] = max(1, self.limites[bucket] // 2)
+                logger.log_system(f"Rate limit no bucket {bucket}: aguardando {retry_after:.1f}s", "WARNING")
+            except Exception as e:
+                status = getattr(e, 'status', None)
+                if status == 429:
+                    resultado['rate_limits'] += 1
+                    retry_after = getattr(e, 'retry_after', None) or 1.0
+                    estado['pausa_ate'] = max(estado['pausa_ate'], time.monotonic() + retry_after)
+                    estado['sucessos_seguidos'] = 0
+                    self.limites[bucket] = max(1, self.limites[bucket] // 2)
+                    logger.log_system(f"Rate limit no bucket {bucket}: aguardando {retry_after:.1f}s", "WARNING")
+                elif status and status >= 500:
+                    await asyncio.sleep(0.5 * (2 ** tentativa))
+                else:
+                    return False, str(e)
+        
+        return False, "Limite de tentativas excedido"
+
+batch_executor = BatchActionExecutor()
+
+# ==============================================
+# ARMAZÉM DE SNAPSHOTS (CONTEÚDO ENDEREÇADO)
+# ==============================================
+
+class SnapshotStore:
+    """Guarda snapshots de servidor com deduplicação por hash de conteúdo.
+
+    Cada cargo, categoria e canal vira um objeto imutável em
+    ``objetos/<sha256>.json``; o snapshot em si é só um manifesto com a lista
+    de hashes. Itens que não mudaram entre dois backups custam uma referência,
+    e os ``max_snapshots`` mais recentes de cada servidor/tipo ficam no
+    histórico (objetos sem referência são coletados na poda). O diretório é
+    compartilhado com o bot principal, então a poda só coleta objetos sem
+    uso há mais de ``carencia`` segundos.
+    """
+    
+    def __init__(self, raiz: str = 'snapshots', max_snapshots: int = 20, carencia: float = 3600.0):
+        self.raiz = raiz
+        self.dir_objetos = os.path.join(raiz, 'objetos')
+        self.dir_manifestos = os.path.join(raiz, 'manifestos')
+        self.max_snapshots = max_snapshots
+        self.carencia = carencia
+        os.makedirs(self.dir_objetos, exist_ok=True)
+        os.makedirs(self.dir_manifestos, exist_ok=True)
+    
+    # ---------- Objetos ----------
+    
+    @staticmethod
+    def _serializar(valor: Any) -> bytes:
+        return json.dumps(valor, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    
+    def _caminho_objeto(self, digest: str) -> str:
+        return os.path.join(self.dir_objetos, f"{digest}.json")
+    
+    def _gravar_atomico(self, caminho: str, conteudo: bytes):
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'wb') as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+    
+    def _guardar_objeto(self, valor: Any, novos: List[str]) -> str:
+        conteudo = self._serializar(valor)
+        digest = hashlib.sha256(conteudo).hexdigest()
+        caminho = self._caminho_objeto(digest)
+        
+        try:
+            # Objeto reaproveitado: renova o mtime para a poda respeitar a carência
+            os.utime(caminho)
+        except FileNotFoundError:
+            self._gravar_atomico(caminho, conteudo)
+            novos.append(digest)
+        return digest
+    
+    def _ler_objeto(self, digest: str) -> Any:
+        with open(self._caminho_objeto(digest), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    # ---------- Decomposição ----------
+    
+    def _decompor(self, valor: Any, novos: List[str]) -> Dict[str, Any]:
+        """Listas de dicts viram listas de hashes (um objeto por item)"""
+        if isinstance(valor, list) and valor and all(isinstance(item, dict) for item in valor):
+            return {'itens': [self._guardar_objeto(item, novos) for item in valor]}
+        if isinstance(valor, dict) and valor and all(isinstance(item, list) for item in valor.values()):
+            return {'grupos': {chave: self._decompor(item, novos) for chave, item in valor.items()}}
+        if isinstance(valor, (dict, list)):
+            return {'objeto': self._guardar_objeto(valor, novos)}
+        return {'valor': valor}
+    
+    def _recompor(self, secao: Dict[str, Any]) -> Any:
+        if 'itens' in secao:
+            return [self._ler_objeto(digest) for digest in secao['itens']]
+        if 'grupos' in secao:
+            return {chave: self._recompor(item) for chave, item in secao['grupos'].items()}
+        if 'objeto' in secao:
+            return self._ler_objeto(secao['objeto'])
+        return secao['valor']
+    
+    @staticmethod
+    def _hashes(secao: Dict[str, Any]) -> List[str]:
+        if 'itens' in secao:
+            return list(secao['itens'])
+        if 'grupos' in secao:
+            return [digest for item in secao['grupos'].values() for digest in SnapshotStore._hashes(item)]
+        if 'objeto' in secao:
+            return [secao['objeto']]
+        return []
+    
+    # ---------- Snapshots ----------
+    
+    def salvar(self, guild_id: int, dados: Dict[str, Any], tipo: str = 'backup', rotulo: Optional[str] = None) -> Dict[str, Any]:
+        """Grava um snapshot e retorna o manifesto (sem as seções)"""
+        criado_em = time.time()
+        snapshot_id = f"{tipo}_{guild_id}_{int(criado_em)}"
+        sufixo = 1
+        while os.path.exists(os.path.join(self.dir_manifestos, f"{snapshot_id}.json")):
+            sufixo += 1
+            snapshot_id = f"{tipo}_{guild_id}_{int(criado_em)}_{sufixo}"
+        
+        novos: List[str] = []
+        secoes = {chave: self._decompor(valor, novos) for chave, valor in dados.items()}
+        total = sum(len(self._hashes(secao)) for secao in secoes.values())
+        
+        manifesto = {
+            'id': snapshot_id,
+            'guild_id': str(guild_id),
+            'tipo': tipo,
+            'rotulo': rotulo,
+            'criado_em': criado_em,
+            'delta': {'objetos': total, 'novos': len(novos), 'reaproveitados': total - len(novos)},
+            'secoes': secoes
+        }
+        self._gravar_atomico(os.path.join(self.dir_manifestos, f"{snapshot_id}.json"), self._serializar(manifesto))
+        
+        self._podar(str(guild_id), tipo)
+        return self._resumo(manifesto)
+    
+    def _ler_manifesto(self, snapshot_id: str) -> Optional[Dict[str, Any]]:
+        caminho = os.path.join(self.dir_manifestos, f"{os.path.basename(snapshot_id)}.json")
+        if not os.path.exists(caminho):
+            return None
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    @staticmethod
+    def _resumo(manifesto: Dict[str, Any]) -> Dict[str, Any]:
+        return {chave: valor for chave, valor in manifesto.items() if chave != 'secoes'}
+    
+    def carregar(self, snapshot_id: str, guild_id: Optional[int] = None, tipo: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Reconstrói os dados completos de um snapshot (None se não existir ou for de outro servidor/tipo)"""
+        manifesto = self._ler_manifesto(snapshot_id)
+        if manifesto is None:
+            return None
+        if guild_id is not None and manifesto['guild_id'] != str(guild_id):
+            return None
+        if tipo is not None and manifesto['tipo'] != tipo:
+            return None
+        return {chave: self._recompor(secao) for chave, secao in manifesto['secoes'].items()}
+    
+    def listar(self, guild_id: Optional[int] = None, tipo: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lista os snapshots (mais recente primeiro)"""
+        manifestos = []
+        for nome in os.listdir(self.dir_manifestos):
+            if not nome.endswith('.json'):
+                continue
+            try:
+                manifesto = self._ler_manifesto(nome[:-5])
+            except Exception as e:
+                logger.log_system(f"Manifesto de snapshot ilegível ({nome}): {e}", "WARNING")
+                continue
+            if guild_id is not None and manifesto['guild_id'] != str(guild_id):
+                continue
+            if tipo is not None and manifesto['tipo'] != tipo:
+                continue
+            manifestos.append(self._resumo(manifesto))
+        
+        return sorted(manifestos, key=lambda m: m['criado_em'], reverse=True)
+    
+    def ultimo(self, guild_id: Optional[int] = None, tipo: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        snapshots = self.listar(guild_id, tipo)
+        return snapshots[0] if snapshots else None
+    
+    def _podar(self, guild_id: str, tipo: str):
+        """Mantém só os max_snapshots mais recentes e coleta objetos órfãos"""
+        excedentes = self.listar(int(guild_id), tipo)[self.max_snapshots:]
+        if not excedentes:
+            return
+        
+        for manifesto in excedentes:
+            os.remove(os.path.join(self.dir_manifestos, f"{manifesto['id']}.json"))
+        
+        referenciados = set()
+        for nome in os.listdir(self.dir_manifestos):
+            if nome.endswith('.json'):
+                manifesto = self._ler_manifesto(nome[:-5])
+                if manifesto:
+                    for secao in manifesto['secoes'].values():
+                        referenciados.update(self._hashes(secao))
+        
+        # Objetos recentes podem ser de um manifesto que o outro bot ainda vai gravar
+        limite = time.time() - self.carencia
+        removidos = 0
+        for nome in os.listdir(self.dir_objetos):
+            if not nome.endswith('.json') or nome[:-5] in referenciados:
+                continue
+            caminho = self._caminho_objeto(nome[:-5])
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    os.remove(caminho)
+                    removidos += 1
+            except FileNotFoundError:
+                pass
+        
+        logger.log_backup(f"Snapshots podados: {len(excedentes)} antigos, {removidos} objetos órfãos removidos")
+    
+    def estatisticas(self) -> Dict[str, int]:
+        return {
+            'snapshots': sum(1 for nome in os.listdir(self.dir_manifestos) if nome.endswith('.json')),
+            'objetos': sum(1 for nome in os.listdir(self.dir_objetos) if nome.endswith('.json'))
+        }
+
+snapshot_store = SnapshotStore()
+
 # ==============================================
 # SISTEMA DE BACKUP/RESTORE ABSOLUTO
 # ==============================================
@@ -1280,6 +1808,8 @@ class BackupRestoreMaster:
     def __init__(self):
         self.backup_file = 'backup_completo.json'
         self.backup_cache = {}
+        self.checkpoint_file = 'restore_checkpoint.json'
+        self.restore_concurrency = 5  # ações simultâneas por camada da restauração
         
     async def criar_backup_completo(self, guild: discord.Guild) -> Dict[str, Any]:
         """Cria backup absoluto de tudo"""
@@ -1464,240 +1994,596 @@ class BackupRestoreMaster:
                 }
         return serialized
     
-    def salvar_backup(self, backup_data: Dict[str, Any]):
-        """Salva backup em arquivo"""
+    def salvar_backup(self, backup_data: Dict[str, Any]) -> Optional[str]:
+        """Salva backup como snapshot no histórico (retorna o id do snapshot)"""
         try:
-            with open(self.backup_file, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, indent=4, ensure_ascii=False)
+            snapshot = snapshot_store.salvar(int(backup_data['metadata']['guild_id']), backup_data, tipo='backup')
             
-            logger.log_backup(f"Backup salvo em {self.backup_file}")
-            return True
+            delta = snapshot['delta']
+            logger.log_backup(f"Backup salvo como snapshot {snapshot['id']} "
+                              f"({delta['novos']} objetos novos, {delta['reaproveitados']} reaproveitados)")
+            return snapshot['id']
         except Exception as e:
             logger.log_system(f"Erro ao salvar backup: {e}", "ERROR")
+            return None
+    
+    def _carregar_legado(self, guild_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Backup legado em arquivo único (anterior ao histórico de snapshots)"""
+        if not os.path.exists(self.backup_file):
+            return None
+        with open(self.backup_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if guild_id is not None and str(data['metadata']['guild_id']) != str(guild_id):
+            return None
+        return data
+    
+    def backup_disponivel(self, guild_id: Optional[int] = None) -> bool:
+        """Verifica se há backup do servidor sem reconstruir o snapshot"""
+        if snapshot_store.ultimo(guild_id, tipo='backup') is not None:
+            return True
+        try:
+            return self._carregar_legado(guild_id) is not None
+        except Exception:
             return False
     
-    def carregar_backup(self) -> Optional[Dict[str, Any]]:
-        """Carrega backup do arquivo"""
+    def carregar_backup(self, snapshot_id: Optional[str] = None, guild_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Carrega um snapshot pelo id (ou o mais recente) - só do servidor informado"""
         try:
-            if os.path.exists(self.backup_file):
-                with open(self.backup_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logger.log_backup(f"Backup carregado: {data['metadata']['guild_name']}")
+            if snapshot_id is None:
+                ultimo = snapshot_store.ultimo(guild_id, tipo='backup')
+                if ultimo:
+                    snapshot_id = ultimo['id']
+                else:
+                    data = self._carregar_legado(guild_id)
+                    if data:
+                        logger.log_backup(f"Backup carregado: {data['metadata']['guild_name']}")
+                    return data
+            
+            if snapshot_id:
+                data = snapshot_store.carregar(snapshot_id, guild_id, tipo='backup')
+                if data:
+                    logger.log_backup(f"Backup carregado: {data['metadata']['guild_name']} ({snapshot_id})")
                     return data
         except Exception as e:
             logger.log_system(f"Erro ao carregar backup: {e}", "ERROR")
         
         return None
     
-    async def restaurar_backup_completo(self, guild: discord.Guild, backup_data: Dict[str, Any]):
-        """RESTAURAÇÃO COMPLETA - Apaga tudo e recria"""
+    async def restaurar_backup_completo(self, guild: discord.Guild, backup_data: Dict[str, Any], progresso=None):
+        """RESTAURAÇÃO COMPLETA - Apaga tudo e recria (retomável por checkpoint)"""
         logger.log_backup(f"Iniciando restauração completa do servidor: {guild.name}")
         
         # CONFIRMAÇÃO DE SEGURANÇA (deve ser feita via UI)
         
         try:
-            # 1. SALVAR CONFIGURAÇÕES ATUAIS (backup de emergência)
-            backup_emergencia = await self.criar_backup_completo(guild)
-            with open('backup_emergencia.json', 'w', encoding='utf-8') as f:
-                json.dump(backup_emergencia, f, indent=4)
-            
-            logger.log_backup("Backup de emergência criado")
-            
-            # 2. APAGAR TUDO (exceto @everyone e cargos do bot)
-            await self._limpar_servidor(guild)
-            
-            # 3. RESTAURAR CARGOS
-            await self._restaurar_cargos(guild, backup_data['roles'])
+            checkpoint = self.carregar_checkpoint(guild, backup_data)
             
-            # 4. RESTAURAR CATEGORIAS
-            categories_map = await self._restaurar_categorias(guild, backup_data['categories'])
+            if checkpoint['etapas']:
+                logger.log_backup(f"Retomando restauração do checkpoint: {', '.join(checkpoint['etapas'])} já concluídas")
             
-            # 5. RESTAURAR CANAIS
-            await self._restaurar_canais(guild, backup_data['channels'], categories_map)
+            # 1. SALVAR CONFIGURAÇÕES ATUAIS (backup de emergência)
+            # Etapa própria no checkpoint: se a limpeza cair no meio, a retomada
+            # não sobrescreve o backup bom com o servidor meio apagado
+            if 'backup_emergencia' not in checkpoint['etapas']:
+                backup_emergencia = await self.criar_backup_completo(guild)
+                with open('backup_emergencia.json', 'w', encoding='utf-8') as f:
+                    json.dump(backup_emergencia, f, indent=4)
+                
+                logger.log_backup("Backup de emergência criado")
+                self._concluir_etapa(checkpoint, 'backup_emergencia')
             
-            # 6. RESTAURAR CONFIGURAÇÕES
-            await self._restaurar_settings(guild, backup_data['settings'])
+            # 2. APAGAR TUDO (exceto @everyone e cargos do bot)
+            if 'limpeza' not in checkpoint['etapas']:
+                await self._limpar_servidor(guild)
+                self._concluir_etapa(checkpoint, 'limpeza')
             
-            # 7. RESTAURAR WHITELIST
-            if 'whitelist' in backup_data:
-                whitelist_master.whitelist = backup_data['whitelist']
-                whitelist_master.salvar_whitelist()
+            # 3-6. Camadas em ordem de dependência; cada camada roda em paralelo
+            for etapa, executar in self._plano_restauracao(guild, backup_data, checkpoint):
+                if etapa in checkpoint['etapas']:
+                    continue
+                
+                if progresso:
+                    await progresso(etapa, checkpoint)
+                
+                await executar()
+                self._concluir_etapa(checkpoint, etapa)
             
-            # 8. RESTAURAR CONFIG VOICE
-            if 'voice_config' in backup_data:
-                voice_permanente.voice_channel_id = backup_data['voice_config'].get('voice_channel_id')
+            # 7-8. RESTAURAR WHITELIST E CONFIG VOICE
+            self._restaurar_extras(backup_data, checkpoint)
             
+            self.remover_checkpoint()
             logger.log_backup(f"✅ Restauração completa concluída: {guild.name}")
             
             return True
             
         except Exception as e:
             logger.log_system(f"❌ Erro na restauração: {e}", "ERROR")
-            logger.log_backup(f"❌ Restauração falhou: {str(e)}")
+            logger.log_backup(f"❌ Restauração falhou: {str(e)} (checkpoint mantido em {self.checkpoint_file})")
             return False
     
+    def _restaurar_extras(self, backup_data: Dict[str, Any], checkpoint: Dict[str, Any]):
+        """Restaura whitelist e canal de voz permanente (já mapeado para o canal atual)"""
+        if 'whitelist' in backup_data:
+            whitelist_master.whitelist = backup_data['whitelist']
+            whitelist_master.salvar_whitelist()
+        
+        if 'voice_config' in backup_data:
+            voice_id = backup_data['voice_config'].get('voice_channel_id')
+            novo_id = checkpoint['mapa']['channels'].get(str(voice_id)) if voice_id else None
+            voice_permanente.voice_channel_id = int(novo_id) if novo_id else voice_id
+    
+    async def restaurar_backup_diferencial(self, guild: discord.Guild, backup_data: Dict[str, Any], progresso=None) -> Optional[Dict[str, int]]:
+        """RESTAURAÇÃO DIFERENCIAL - Compara o servidor com o backup e só cria/edita/apaga o necessário.
+
+        Cada item do backup é pareado com o objeto atual pelo checkpoint, pelo id
+        e por fim pelo nome (posição mais próxima). O que não existe é criado, o
+        que divergiu é editado e o que sobrou no servidor é apagado, então os ids
+        do que sobreviveu são preservados.
+        """
+        logger.log_backup(f"Iniciando restauração diferencial do servidor: {guild.name}")
+        
+        try:
+            checkpoint = self.carregar_checkpoint(guild, backup_data, modo='diferencial')
+            contagem = {'criados': 0, 'atualizados': 0, 'removidos': 0, 'ignorados': 0}
+            canais_data = [c for tipo in ('text', 'voice') for c in backup_data['channels'].get(tipo, [])]
+            
+            camadas = [
+                ('cargos', lambda: self._diff_cargos(guild, backup_data['roles'], checkpoint)),
+                ('categorias', lambda: self._diff_categorias(guild, backup_data['categories'], checkpoint)),
+                ('canais', lambda: self._diff_canais(guild, canais_data, checkpoint)),
+                ('remocoes', lambda: self._diff_remocoes(guild, backup_data, checkpoint))
+            ]
+            
+            # Cada camada só é planejada depois que a anterior terminou (ids novos já no mapa)
+            for etapa, planejar in camadas:
+                if progresso:
+                    await progresso(etapa, checkpoint)
+                
+                acoes = planejar()
+                resultado = await self._executar_camada(etapa, acoes)
+                
+                # Só conta o que a API confirmou, não o que foi planejado
+                for bucket, descricao, _ in acoes:
+                    if descricao in resultado['resultados']:
+                        contagem[self._TIPO_OPERACAO[bucket.split('_')[1]]] += 1
+            
+            ignorados = checkpoint.pop('cargos_ignorados', [])
+            contagem['ignorados'] = len(ignorados)
+            if ignorados:
+                logger.log_system(f"Cargos acima do cargo do bot ignorados na restauração: {', '.join(ignorados)}", "WARNING")
+            
+            await self._ajustar_posicoes_cargos(guild, backup_data['roles'], checkpoint)
+            
+            if progresso:
+                await progresso('configuracoes', checkpoint)
+            await self._restaurar_settings(guild, backup_data['settings'], checkpoint)
+            
+            self._restaurar_extras(backup_data, checkpoint)
+            
+            self.remover_checkpoint()
+            logger.log_backup(f"✅ Restauração diferencial concluída: {guild.name} "
+                              f"({contagem['criados']} criados, {contagem['atualizados']} atualizados, {contagem['removidos']} removidos)")
+            
+            return contagem
+            
+        except Exception as e:
+            logger.log_system(f"❌ Erro na restauração diferencial: {e}", "ERROR")
+            logger.log_backup(f"❌ Restauração diferencial falhou: {str(e)} (checkpoint mantido em {self.checkpoint_file})")
+            return None
+    
+    _TIPO_OPERACAO = {'create': 'criados', 'edit': 'atualizados', 'delete': 'removidos'}
+    
+    def _parear(self, itens_data: List[Dict[str, Any]], atuais: List[Any], mapa: Dict[str, str]):
+        """Pareia itens do backup com objetos atuais: checkpoint, id e depois nome + posição"""
+        livres = {obj.id: obj for obj in atuais}
+        pares = {}
+        pendentes = []
+        
+        for dados in itens_data:
+            obj = None
+            if dados['id'] in mapa:
+                obj = livres.pop(int(mapa[dados['id']]), None)
+            if obj is None:
+                obj = livres.pop(int(dados['id']), None)
+            
+            if obj is not None:
+                pares[dados['id']] = obj
+            else:
+                pendentes.append(dados)
+        
+        por_nome = defaultdict(list)
+        for obj in livres.values():
+            por_nome[obj.name].append(obj)
+        
+        for dados in pendentes:
+            candidatos = [obj for obj in por_nome.get(dados['name'], []) if obj.id in livres]
+            if candidatos:
+                obj = min(candidatos, key=lambda o: abs(o.position - dados['position']))
+                pares[dados['id']] = livres.pop(obj.id)
+        
+        for id_antigo, obj in pares.items():
+            mapa[id_antigo] = str(obj.id)
+        
+        return pares, list(livres.values())
+    
+    def _cargos_pareaveis(self, guild: discord.Guild) -> List[discord.Role]:
+        """Todos os cargos comuns, inclusive os que o bot não consegue editar"""
+        return [role for role in guild.roles if not role.is_default() and not role.managed]
+    
+    def _diff_cargos(self, guild: discord.Guild, roles_data: List[Dict[str, Any]], checkpoint: Dict[str, Any]):
+        roles_data = [d for d in roles_data if not d.get('managed')]
+        pares, sobras = self._parear(roles_data, self._cargos_pareaveis(guild), checkpoint['mapa']['roles'])
+        topo = guild.me.top_role
+        ignorados = [role.name for role in sobras if role >= topo]
+        checkpoint['sobras_cargos'] = [role.id for role in sobras if role < topo]
+        acoes = []
+        
+        for role_data in roles_data:
+            role = pares.get(role_data['id'])
+            
+            if role is None:
+                acoes.append(('role_create', role_data['id'], lambda d=role_data: self._criar_cargo(guild, d, checkpoint)))
+                continue
+            
+            # Pareado com um cargo no topo ou acima do bot: não dá para editar nem deve ser recriado
+            if role >= topo:
+                ignorados.append(role.name)
+                continue
+            
+            mudancas = {}
+            if role.name != role_data['name']:
+                mudancas['name'] = role_data['name']
+            if role.color.value != role_data['color']:
+                mudancas['color'] = discord.Color(role_data['color'])
+            if role.hoist != role_data['hoist']:
+                mudancas['hoist'] = role_data['hoist']
+            if role.permissions.value != role_data['permissions']:
+                mudancas['permissions'] = discord.Permissions(role_data['permissions'])
+            if role.mentionable != role_data['mentionable']:
+                mudancas['mentionable'] = role_data['mentionable']
+            
+            if mudancas:
+                acoes.append(('role_edit', role_data['id'], lambda r=role, m=mudancas: r.edit(**m, reason="Restauração diferencial")))
+        
+        checkpoint['cargos_ignorados'] = ignorados
+        return acoes
+    
+    def _diff_overwrites(self, canal, overwrites_data: Dict[str, Any], guild: discord.Guild, checkpoint: Dict[str, Any]):
+        """Retorna os overwrites desejados se os de cargos divergirem (overwrites de membros são mantidos)"""
+        desejados = self._deserialize_overwrites(overwrites_data, guild, checkpoint)
+        
+        atuais = {alvo.id: ow.pair() for alvo, ow in canal.overwrites.items() if isinstance(alvo, discord.Role)}
+        alvo_desejado = {alvo.id: ow.pair() for alvo, ow in desejados.items()}
+        
+        if atuais == alvo_desejado:
+            return None
+        
+        for alvo, ow in canal.overwrites.items():
+            if not isinstance(alvo, discord.Role):
+                desejados[alvo] = ow
+        return desejados
+    
+    def _diff_categorias(self, guild: discord.Guild, categories_data: List[Dict[str, Any]], checkpoint: Dict[str, Any]):
+        pares, sobras = self._parear(categories_data, list(guild.categories), checkpoint['mapa']['categories'])
+        checkpoint['sobras_canais'] = [cat.id for cat in sobras]
+        acoes = []
+        
+        for cat_data in categories_data:
+            category = pares.get(cat_data['id'])
+            
+            if category is None:
+                acoes.append(('channel_create', cat_data['id'], lambda d=cat_data: self._criar_categoria(guild, d, checkpoint)))
+                continue
+            
+            mudancas = {}
+            if category.name != cat_data['name']:
+                mudancas['name'] = cat_data['name']
+            if category.position != cat_data['position']:
+                mudancas['position'] = cat_data['position']
+            
+            overwrites = self._diff_overwrites(category, cat_data['overwrites'], guild, checkpoint)
+            if overwrites is not None:
+                mudancas['overwrites'] = overwrites
+            
+            if mudancas:
+                acoes.append(('channel_edit', cat_data['id'], lambda c=category, m=mudancas: c.edit(**m, reason="Restauração diferencial")))
+        
+        return acoes
+    
+    def _diff_canais(self, guild: discord.Guild, channels_data: List[Dict[str, Any]], checkpoint: Dict[str, Any]):
+        acoes = []
+        
+        for tipo, atuais in (('text', guild.text_channels), ('voice', guild.voice_channels)):
+            dados_tipo = [d for d in channels_data if d.get('type', 'text') == tipo]
+            pares, sobras = self._parear(dados_tipo, list(atuais), checkpoint['mapa']['channels'])
+            checkpoint['sobras_canais'].extend(canal.id for canal in sobras)
+            
+            for channel_data in dados_tipo:
+                canal = pares.get(channel_data['id'])
+                
+                if canal is None:
+                    acoes.append(('channel_create', channel_data['id'], lambda d=channel_data: self._criar_canal(guild, d, checkpoint)))
+                    continue
+                
+                mudancas = self._diff_campos_canal(guild, canal, channel_data, checkpoint)
+                if mudancas:
+                    acoes.append(('channel_edit', channel_data['id'], lambda c=canal, m=mudancas: c.edit(**m, reason="Restauração diferencial")))
+        
+        return acoes
+    
+    def _diff_campos_canal(self, guild: discord.Guild, canal, channel_data: Dict[str, Any], checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+        mudancas = {}
+        
+        if canal.name != channel_data['name']:
+            mudancas['name'] = channel_data['name']
+        if canal.position != channel_data['position']:
+            mudancas['position'] = channel_data['position']
+        
+        if channel_data.get('category_id'):
+            novo_id = checkpoint['mapa']['categories'].get(channel_data['category_id'])
+            if novo_id and canal.category_id != int(novo_id):
+                categoria = guild.get_channel(int(novo_id))
+                if categoria:
+                    mudancas['category'] = categoria
+        elif canal.category_id:
+            mudancas['category'] = None
+        
+        if channel_data.get('type') == 'voice':
+            bitrate = min(channel_data.get('bitrate', 64000), guild.bitrate_limit)
+            if canal.bitrate != bitrate:
+                mudancas['bitrate'] = bitrate
+            if canal.user_limit != channel_data.get('user_limit', 0):
+                mudancas['user_limit'] = channel_data.get('user_limit', 0)
+        else:
+            if (canal.topic or None) != (channel_data.get('topic') or None):
+                mudancas['topic'] = channel_data.get('topic')
+            if canal.slowmode_delay != channel_data.get('slowmode_delay', 0):
+                mudancas['slowmode_delay'] = channel_data.get('slowmode_delay', 0)
+            if canal.nsfw != channel_data.get('nsfw', False):
+                mudancas['nsfw'] = channel_data.get('nsfw', False)
+        
+        overwrites = self._diff_overwrites(canal, channel_data['overwrites'], guild, checkpoint)
+        if overwrites is not None:
+            mudancas['overwrites'] = overwrites
+        
+        return mudancas
+    
+    def _diff_remocoes(self, guild: discord.Guild, backup_data: Dict[str, Any], checkpoint: Dict[str, Any]):
+        """Apaga o que existe no servidor mas não no backup (canais antes dos cargos)"""
+        acoes = []
+        
+        for channel_id in checkpoint.pop('sobras_canais', []):
+            canal = guild.get_channel(channel_id)
+            if canal:
+                acoes.append(('channel_delete', f"channel_{canal.id}", lambda c=canal: c.delete(reason="Restauração diferencial")))
+        
+        for role_id in checkpoint.pop('sobras_cargos', []):
+            role = guild.get_role(role_id)
+            if role:
+                acoes.append(('role_delete', f"role_{role.id}", lambda r=role: r.delete(reason="Restauração diferencial")))
+        
+        return acoes
+    
+    def _plano_restauracao(self, guild: discord.Guild, backup_data: Dict[str, Any], checkpoint: Dict[str, Any]):
+        """Camadas da restauração: cada uma depende apenas das anteriores"""
+        return [
+            ('cargos', lambda: self._restaurar_cargos(guild, backup_data['roles'], checkpoint)),
+            ('categorias', lambda: self._restaurar_categorias(guild, backup_data['categories'], checkpoint)),
+            ('canais', lambda: self._restaurar_canais(guild, backup_data['channels'], checkpoint)),
+            ('configuracoes', lambda: self._restaurar_settings(guild, backup_data['settings'], checkpoint))
+        ]
+    
+    # ---------- Checkpoint ----------
+    
+    def carregar_checkpoint(self, guild: discord.Guild, backup_data: Dict[str, Any], modo: str = 'completo') -> Dict[str, Any]:
+        """Carrega o checkpoint da restauração em andamento (ou cria um novo)"""
+        identificador = {
+            'modo': modo,
+            'guild_id': str(guild.id),
+            'backup_date': backup_data['metadata']['backup_date'],
+            'everyone_id': backup_data['metadata']['guild_id']
+        }
+        
+        try:
+            if os.path.exists(self.checkpoint_file):
+                with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                    checkpoint = json.load(f)
+                if checkpoint.get('identificador') == identificador:
+                    return checkpoint
+        except Exception as e:
+            logger.log_system(f"Checkpoint inválido ignorado: {e}", "WARNING")
+        
+        return {
+            'identificador': identificador,
+            'etapas': [],
+            'mapa': {'roles': {}, 'categories': {}, 'channels': {}}
+        }
+    
+    def salvar_checkpoint(self, checkpoint: Dict[str, Any]):
+        """Grava o checkpoint de forma atômica (arquivo temporário + rename)"""
+        temporario = f"{self.checkpoint_file}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(temporario, self.checkpoint_file)
+    
+    def remover_checkpoint(self):
+        try:
+            os.remove(self.checkpoint_file)
+        except FileNotFoundError:
+            pass
+    
+    def _concluir_etapa(self, checkpoint: Dict[str, Any], etapa: str):
+        checkpoint['etapas'].append(etapa)
+        self.salvar_checkpoint(checkpoint)
+        logger.log_backup(f"Etapa concluída: {etapa}")
+    
+    def _registrar_criado(self, checkpoint: Dict[str, Any], tipo: str, id_antigo: str, objeto):
+        """Registra o objeto recriado no checkpoint assim que a API confirma"""
+        checkpoint['mapa'][tipo][str(id_antigo)] = str(objeto.id)
+        self.salvar_checkpoint(checkpoint)
+        return objeto
+    
+    async def _executar_camada(self, nome: str, acoes: List[Tuple[str, str, Any]], obrigatoria: bool = True):
+        """Executa uma camada com a concorrência configurada.
+
+        Se uma camada obrigatória tiver falhas ela não é marcada como concluída:
+        a exceção mantém o checkpoint e uma nova execução refaz só o que faltou.
+        """
+        executor = BatchActionExecutor(
+            concorrencia_inicial=self.restore_concurrency,
+            concorrencia_maxima=self.restore_concurrency
+        )
+        resultado = await executor.executar(acoes)
+        
+        for descricao, erro in resultado['falhas']:
+            logger.log_system(f"Erro na camada {nome} ({descricao}): {erro}", "ERROR")
+        logger.log_backup(f"Camada {nome}: {resultado['sucesso']}/{resultado['total']} em {resultado['duracao']:.1f}s")
+        
+        if obrigatoria and resultado['falhas']:
+            raise RuntimeError(f"{len(resultado['falhas'])} falha(s) na camada {nome}")
+        return resultado
+    
     async def _limpar_servidor(self, guild: discord.Guild):
         """Limpa o servidor (canais e cargos)"""
+        acoes = []
         
         # Apagar todos os canais
         for channel in guild.channels:
-            try:
-                await channel.delete(reason="Restauração completa")
-            except:
-                pass
+            acoes.append(('channel_delete', f"channel_{channel.id}", lambda c=channel: c.delete(reason="Restauração completa")))
         
         # Apagar todos os cargos (exceto @everyone e cargos gerenciados)
         for role in guild.roles:
             if role.name != "@everyone" and not role.managed and role != guild.me.top_role:
-                try:
-                    await role.delete(reason="Restauração completa")
-                except:
-                    pass
+                acoes.append(('role_delete', f"role_{role.id}", lambda r=role: r.delete(reason="Restauração completa")))
         
-        await asyncio.sleep(2)  # Pausa para evitar rate limit
+        await self._executar_camada('limpeza', acoes, obrigatoria=False)
     
-    async def _restaurar_cargos(self, guild: discord.Guild, roles_data: List[Dict[str, Any]]):
+    async def _restaurar_cargos(self, guild: discord.Guild, roles_data: List[Dict[str, Any]], checkpoint: Dict[str, Any]):
         """Restaura todos os cargos"""
-        roles_map = {}
+        mapa = checkpoint['mapa']['roles']
+        acoes = []
         
         for role_data in roles_data:
-            try:
-                role = await guild.create_role(
-                    name=role_data['name'],
-                    color=discord.Color(role_data['color']),
-                    hoist=role_data['hoist'],
-                    permissions=discord.Permissions(role_data['permissions']),
-                    mentionable=role_data['mentionable'],
-                    reason="Restauração de backup"
-                )
-                
-                roles_map[role_data['id']] = role
-                
-                # Posição será ajustada depois
-                
-            except Exception as e:
-                logger.log_system(f"Erro ao criar cargo {role_data['name']}: {e}", "ERROR")
+            if role_data['id'] in mapa or role_data.get('managed'):
+                continue
+            acoes.append(('role_create', role_data['id'], lambda d=role_data: self._criar_cargo(guild, d, checkpoint)))
         
-        # Ajustar posições (do menos importante para o mais importante)
-        for role_data in sorted(roles_data, key=lambda x: x['position']):
-            if role_data['id'] in roles_map:
-                try:
-                    await roles_map[role_data['id']].edit(position=role_data['position'])
-                except:
-                    pass
+        await self._executar_camada('cargos', acoes)
+        await self._ajustar_posicoes_cargos(guild, roles_data, checkpoint)
+    
+    async def _ajustar_posicoes_cargos(self, guild: discord.Guild, roles_data: List[Dict[str, Any]], checkpoint: Dict[str, Any]):
+        """Ajusta posições numa única chamada (em vez de um edit por cargo)"""
+        mapa = checkpoint['mapa']['roles']
+        posicoes = {}
+        for role_data in roles_data:
+            role = guild.get_role(int(mapa[role_data['id']])) if role_data['id'] in mapa else None
+            if role and role.position != role_data['position'] and role_data['position'] < guild.me.top_role.position:
+                posicoes[role] = role_data['position']
         
-        return roles_map
+        if posicoes:
+            try:
+                await guild.edit_role_positions(positions=posicoes, reason="Restauração de backup")
+            except Exception as e:
+                logger.log_system(f"Erro ao ajustar posições dos cargos: {e}", "ERROR")
+    
+    async def _criar_cargo(self, guild: discord.Guild, role_data: Dict[str, Any], checkpoint: Dict[str, Any]):
+        role = await guild.create_role(
+            name=role_data['name'],
+            color=discord.Color(role_data['color']),
+            hoist=role_data['hoist'],
+            permissions=discord.Permissions(role_data['permissions']),
+            mentionable=role_data['mentionable'],
+            reason="Restauração de backup"
+        )
+        return self._registrar_criado(checkpoint, 'roles', role_data['id'], role)
     
-    async def _restaurar_categorias(self, guild: discord.Guild, categories_data: List[Dict[str, Any]]):
+    async def _restaurar_categorias(self, guild: discord.Guild, categories_data: List[Dict[str, Any]], checkpoint: Dict[str, Any]):
         """Restaura todas as categorias"""
-        categories_map = {}
+        mapa = checkpoint['mapa']['categories']
+        acoes = []
         
         for cat_data in categories_data:
-            try:
-                # Desserializar overwrites
-                overwrites = self._deserialize_overwrites(cat_data['overwrites'], guild)
-                
-                category = await guild.create_category(
-                    name=cat_data['name'],
-                    position=cat_data['position'],
-                    overwrites=overwrites,
-                    reason="Restauração de backup"
-                )
-                
-                categories_map[cat_data['id']] = category
-                
-            except Exception as e:
-                logger.log_system(f"Erro ao criar categoria {cat_data['name']}: {e}", "ERROR")
+            if cat_data['id'] in mapa:
+                continue
+            acoes.append(('channel_create', cat_data['id'], lambda d=cat_data: self._criar_categoria(guild, d, checkpoint)))
         
-        return categories_map
+        await self._executar_camada('categorias', acoes)
+    
+    async def _criar_categoria(self, guild: discord.Guild, cat_data: Dict[str, Any], checkpoint: Dict[str, Any]):
+        category = await guild.create_category(
+            name=cat_data['name'],
+            position=cat_data['position'],
+            overwrites=self._deserialize_overwrites(cat_data['overwrites'], guild, checkpoint),
+            reason="Restauração de backup"
+        )
+        return self._registrar_criado(checkpoint, 'categories', cat_data['id'], category)
     
-    async def _restaurar_canais(self, guild: discord.Guild, channels_data: Dict[str, List[Dict[str, Any]]], categories_map: Dict[str, discord.CategoryChannel]):
+    async def _restaurar_canais(self, guild: discord.Guild, channels_data: Dict[str, List[Dict[str, Any]]], checkpoint: Dict[str, Any]):
         """Restaura todos os canais"""
+        mapa = checkpoint['mapa']['channels']
+        acoes = []
+        
+        for tipo in ('text', 'voice'):
+            for channel_data in channels_data.get(tipo, []):
+                if channel_data['id'] in mapa:
+                    continue
+                acoes.append(('channel_create', channel_data['id'], lambda d=channel_data: self._criar_canal(guild, d, checkpoint)))
+        
+        await self._executar_camada('canais', acoes)
+    
+    async def _criar_canal(self, guild: discord.Guild, channel_data: Dict[str, Any], checkpoint: Dict[str, Any]):
+        # Categoria e overwrites já apontam para os objetos recriados (camadas anteriores)
+        category = None
+        if channel_data.get('category_id'):
+            novo_id = checkpoint['mapa']['categories'].get(channel_data['category_id'])
+            category = guild.get_channel(int(novo_id)) if novo_id else None
+        
+        overwrites = self._deserialize_overwrites(channel_data['overwrites'], guild, checkpoint)
+        
+        if channel_data.get('type') == 'voice':
+            channel = await guild.create_voice_channel(
+                name=channel_data['name'],
+                category=category,
+                position=channel_data['position'],
+                bitrate=min(channel_data.get('bitrate', 64000), guild.bitrate_limit),
+                user_limit=channel_data.get('user_limit', 0),
+                overwrites=overwrites,
+                reason="Restauração de backup"
+            )
+        else:
+            channel = await guild.create_text_channel(
+                name=channel_data['name'],
+                category=category,
+                position=channel_data['position'],
+                topic=channel_data.get('topic'),
+                slowmode_delay=channel_data.get('slowmode_delay', 0),
+                nsfw=channel_data.get('nsfw', False),
+                overwrites=overwrites,
+                reason="Restauração de backup"
+            )
         
-        # Função para criar overwrites
-        def criar_overwrites(overwrites_data):
-            overwrites = {}
-            for key, perm_data in overwrites_data.items():
-                try:
-                    if key.startswith('role_'):
-                        role_id = int(key.split('_')[1])
-                        role = guild.get_role(role_id)
-                        if role:
-                            overwrites[role] = discord.PermissionOverwrite(
-                                allow=discord.Permissions(perm_data['allow']),
-                                deny=discord.Permissions(perm_data['deny'])
-                            )
-                except:
-                    pass
-            return overwrites
-        
-        # Restaurar canais de texto
-        for channel_data in channels_data.get('text', []):
-            try:
-                category = categories_map.get(channel_data['category_id']) if channel_data.get('category_id') else None
-                overwrites = criar_overwrites(channel_data['overwrites'])
-                
-                channel = await guild.create_text_channel(
-                    name=channel_data['name'],
-                    category=category,
-                    position=channel_data['position'],
-                    topic=channel_data.get('topic'),
-                    slowmode_delay=channel_data.get('slowmode_delay', 0),
-                    nsfw=channel_data.get('nsfw', False),
-                    overwrites=overwrites,
-                    reason="Restauração de backup"
-                )
-                
-            except Exception as e:
-                logger.log_system(f"Erro ao criar canal de texto {channel_data['name']}: {e}", "ERROR")
-        
-        # Restaurar canais de voz
-        for channel_data in channels_data.get('voice', []):
-            try:
-                category = categories_map.get(channel_data['category_id']) if channel_data.get('category_id') else None
-                overwrites = criar_overwrites(channel_data['overwrites'])
-                
-                channel = await guild.create_voice_channel(
-                    name=channel_data['name'],
-                    category=category,
-                    position=channel_data['position'],
-                    bitrate=min(channel_data.get('bitrate', 64000), guild.bitrate_limit),
-                    user_limit=channel_data.get('user_limit', 0),
-                    overwrites=overwrites,
-                    reason="Restauração de backup"
-                )
-                
-            except Exception as e:
-                logger.log_system(f"Erro ao criar canal de voz {channel_data['name']}: {e}", "ERROR")
+        return self._registrar_criado(checkpoint, 'channels', channel_data['id'], channel)
     
-    async def _restaurar_settings(self, guild: discord.Guild, settings_data: Dict[str, Any]):
+    def _resolver_canal(self, guild: discord.Guild, channel_id: Optional[str], checkpoint: Optional[Dict[str, Any]] = None):
+        """Resolve um id de canal do backup para o canal atual (recriado ou não)"""
+        if not channel_id:
+            return None
+        if checkpoint:
+            novo_id = checkpoint['mapa']['channels'].get(str(channel_id))
+            if novo_id:
+                return guild.get_channel(int(novo_id))
+        return guild.get_channel(int(channel_id))
+    
+    async def _restaurar_settings(self, guild: discord.Guild, settings_data: Dict[str, Any], checkpoint: Optional[Dict[str, Any]] = None):
         """Restaura configurações do servidor"""
         try:
             update_data = {}
             
-            # Canal de sistema
-            if settings_data.get('system_channel_id'):
-                channel = guild.get_channel(int(settings_data['system_channel_id']))
-                if channel:
-                    update_data['system_channel'] = channel
-            
-            # Canal de regras
-            if settings_data.get('rules_channel_id'):
-                channel = guild.get_channel(int(settings_data['rules_channel_id']))
-                if channel:
-                    update_data['rules_channel'] = channel
-            
-            # Canal de atualizações
-            if settings_data.get('public_updates_channel_id'):
-                channel = guild.get_channel(int(settings_data['public_updates_channel_id']))
-                if channel:
-                    update_data['public_updates_channel'] = channel
-            
-            # AFK
-            if settings_data.get('afk_channel_id'):
-                channel = guild.get_channel(int(settings_data['afk_channel_id']))
+            # Canais de sistema, regras, atualizações e AFK
+            for campo in ('system_channel', 'rules_channel', 'public_updates_channel', 'afk_channel'):
+                channel = self._resolver_canal(guild, settings_data.get(f'{campo}_id'), checkpoint)
                 if channel:
-                    update_data['afk_channel'] = channel
+                    update_data[campo] = channel
             
             if settings_data.get('afk_timeout'):
                 update_data['afk_timeout'] = settings_data['afk_timeout']
@@ -1722,19 +2608,23 @@ class BackupRestoreMaster:
         except Exception as e:
             logger.log_system(f"Erro ao restaurar settings: {e}", "ERROR")
     
-    def _deserialize_overwrites(self, overwrites_data: Dict[str, Any], guild: discord.Guild):
-        """Desserializa overwrites"""
+    def _deserialize_overwrites(self, overwrites_data: Dict[str, Any], guild: discord.Guild, checkpoint: Optional[Dict[str, Any]] = None):
+        """Desserializa overwrites (ids de cargos recriados são traduzidos pelo checkpoint)"""
         overwrites = {}
+        mapa_cargos = checkpoint['mapa']['roles'] if checkpoint else {}
         
         for key, perm_data in overwrites_data.items():
             try:
                 if key.startswith('role_'):
-                    role_id = int(key.split('_')[1])
-                    role = guild.get_role(role_id)
+                    role_id = key.split('_')[1]
+                    if checkpoint and role_id == checkpoint['identificador']['everyone_id']:
+                        role = guild.default_role
+                    else:
+                        role = guild.get_role(int(mapa_cargos.get(role_id, role_id)))
                     if role:
-                        overwrites[role] = discord.PermissionOverwrite(
-                            allow=discord.Permissions(perm_data['allow']),
-                            deny=discord.Permissions(perm_data['deny'])
+                        overwrites[role] = discord.PermissionOverwrite.from_pair(
+                            discord.Permissions(perm_data['allow']),
+                            discord.Permissions(perm_data['deny'])
                         )
             except:
                 pass
@@ -1751,7 +2641,7 @@ class CatBotUI:
     """Sistema de UI profissional do Cat Bot"""
     
     @staticmethod
-    def create_main_panel() -> discord.Embed:
+    def create_main_panel(guild_id: Optional[int] = None) -> discord.Embed:
         """Cria o painel principal"""
         embed = discord.Embed(
             title="🐱 **CAT BOT - PAINEL DE CONTROLE** 🛡️",
@@ -1767,7 +2657,7 @@ class CatBotUI:
             ("🚨 **ANTI-NUKE**", "✅ **ATIVADO**", True),
             ("⚔️ **ANTI-RAID**", "✅ **ATIVADO**", True),
             ("🎙️ **VOICE**", f"`{'✅ CONECTADO' if voice_permanente.voice_client else '❌ DESCONECTADO'}`", True),
-            ("📦 **BACKUP**", f"`{'✅ DISPONÍVEL' if backup_master.carregar_backup() else '❌ NÃO DISPONÍVEL'}`", True),
+            ("📦 **BACKUP**", f"`{'✅ DISPONÍVEL' if backup_master.backup_disponivel(guild_id) else '❌ NÃO DISPONÍVEL'}`", True),
             ("👥 **MEMBROS**", f"`{sum(g.member_count for g in bot.guilds)}` total", True)
         ]
         
@@ -1832,9 +2722,9 @@ class CatBotUI:
         return embed
     
     @staticmethod
-    def create_backup_panel() -> discord.Embed:
+    def create_backup_panel(guild_id: Optional[int] = None) -> discord.Embed:
         """Cria painel de backup"""
-        backup_data = backup_master.carregar_backup()
+        backup_data = backup_master.carregar_backup(guild_id=guild_id)
         
         embed = discord.Embed(
             title="📦 **SISTEMA DE BACKUP**",
@@ -1866,6 +2756,18 @@ class CatBotUI:
                       f"Emojis: {len(backup_data.get('emoji', []))}```",
                 inline=False
             )
+            
+            historico = snapshot_store.listar(guild_id, tipo='backup')[:5]
+            if historico:
+                embed.add_field(
+                    name="🕘 **HISTÓRICO**",
+                    value="\n".join(
+                        f"`{snap['id']}` • {datetime.fromtimestamp(snap['criado_em']).strftime('%d/%m %H:%M')} "
+                        f"• {snap['delta']['novos']} novos / {snap['delta']['reaproveitados']} iguais"
+                        for snap in historico
+                    ),
+                    inline=False
+                )
         else:
             embed.add_field(
                 name="❌ **NENHUM BACKUP**",
@@ -1878,6 +2780,27 @@ class CatBotUI:
         
         return embed
     
+    @staticmethod
+    def create_restore_confirmation(backup_data: Dict[str, Any]) -> discord.Embed:
+        """Cria o embed de confirmação de restauração"""
+        embed = discord.Embed(
+            title="⚠️ CONFIRMAÇÃO DE RESTAURAÇÃO",
+            description="**ATENÇÃO:** Esta ação é IRREVERSÍVEL!\n\n"
+                       "**O que será feito:**\n"
+                       "1. ❌ Todos os cargos serão DELETADOS\n"
+                       "2. ❌ Todos os canais serão DELETADOS\n"
+                       "3. ❌ Todas as categorias serão DELETADAS\n"
+                       "4. ✅ Tudo será recriado do backup\n\n"
+                       "🩹 **Só diferenças:** recria apenas o que foi apagado, corrige o que mudou e mantém os IDs atuais.\n\n"
+                       f"**Backup:** {backup_data['metadata']['guild_name']}\n"
+                       f"**Data:** {datetime.fromisoformat(backup_data['metadata']['backup_date']).strftime('%d/%m/%Y %H:%M')}\n\n"
+                       "**Tem certeza absoluta?**",
+            color=discord.Color.red(),
+            timestamp=datetime.utcnow()
+        )
+        
+        return embed
+    
     @staticmethod
     def create_security_panel() -> discord.Embed:
         """Cria painel de segurança"""
@@ -2060,7 +2983,7 @@ class MainPanelView(View):
             await interaction.response.send_message("❌ Apenas o dono pode acessar!", ephemeral=True)
             return
         
-        embed = CatBotUI.create_backup_panel()
+        embed = CatBotUI.create_backup_panel(interaction.guild_id)
         view = BackupManagementView()
         await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
     
@@ -2115,7 +3038,7 @@ class MainPanelView(View):
         embed.add_field(
             name="🛡️ PROTEÇÃO",
             value=f"```Whitelist: {len(whitelist_master.whitelist)} admins\n"
-                  f"Backups: {'✅' if backup_master.carregar_backup() else '❌'}\n"
+                  f"Backups: {'✅' if backup_master.backup_disponivel(interaction.guild_id) else '❌'}\n"
                   f"Voice: {'✅' if voice_permanente.voice_client else '❌'}\n"
                   f"Latência: {round(bot.latency * 1000, 2)}ms```",
             inline=False
@@ -2157,7 +3080,7 @@ class MainPanelView(View):
         embed.add_field(
             name="📁 ARQUIVOS",
             value="```whitelist_data.json\n"
-                  "backup_completo.json\n"
+                  "snapshots/ (histórico de backups)\n"
                   "fingerprints.json\n"
                   "logs/ (pasta)```",
             inline=False
@@ -2212,7 +3135,7 @@ class WhitelistManagementView(View):
     
     @discord.ui.button(label="🔙 Voltar", style=discord.ButtonStyle.gray, row=1)
     async def back_button(self, interaction: discord.Interaction, button: Button):
-        embed = CatBotUI.create_main_panel()
+        embed = CatBotUI.create_main_panel(interaction.guild_id)
         view = MainPanelView()
         await interaction.response.edit_message(embed=embed, view=view)
 
@@ -2244,7 +3167,7 @@ class BackupManagementView(View):
                 embed.add_field(name="Configurações", value="Todas", inline=True)
                 embed.add_field(name="Whitelist", value=str(len(backup_data['whitelist'])), inline=True)
                 
-                embed.set_footer(text="Backup salvo em backup_completo.json")
+                embed.set_footer(text=f"Snapshot: {success}")
                 
                 await interaction.followup.send(embed=embed, ephemeral=True)
             else:
@@ -2256,26 +3179,13 @@ class BackupManagementView(View):
     
     @discord.ui.button(label="🔄 Restaurar", style=discord.ButtonStyle.red, row=0)
     async def restore_backup(self, interaction: discord.Interaction, button: Button):
-        backup_data = backup_master.carregar_backup()
+        backup_data = backup_master.carregar_backup(guild_id=interaction.guild_id)
         
         if not backup_data:
             await interaction.response.send_message("❌ Nenhum backup disponível para restaurar!", ephemeral=True)
             return
         
-        embed = discord.Embed(
-            title="⚠️ CONFIRMAÇÃO DE RESTAURAÇÃO",
-            description="**ATENÇÃO:** Esta ação é IRREVERSÍVEL!\n\n"
-                       "**O que será feito:**\n"
-                       "1. ❌ Todos os cargos serão DELETADOS\n"
-                       "2. ❌ Todos os canais serão DELETADOS\n"
-                       "3. ❌ Todas as categorias serão DELETADAS\n"
-                       "4. ✅ Tudo será recriado do backup\n\n"
-                       f"**Backup:** {backup_data['metadata']['guild_name']}\n"
-                       f"**Data:** {datetime.fromisoformat(backup_data['metadata']['backup_date']).strftime('%d/%m/%Y %H:%M')}\n\n"
-                       "**Tem certeza absoluta?**",
-            color=discord.Color.red(),
-            timestamp=datetime.utcnow()
-        )
+        embed = CatBotUI.create_restore_confirmation(backup_data)
         
         view = ConfirmRestoreView()
         await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
@@ -2284,7 +3194,7 @@ class BackupManagementView(View):
     async def info_backup(self, interaction: discord.Interaction, button: Button):
         await interaction.response.defer(ephemeral=True)
         
-        backup_data = backup_master.carregar_backup()
+        backup_data = backup_master.carregar_backup(guild_id=interaction.guild_id)
         
         if backup_data:
             metadata = backup_data['metadata']
@@ -2332,19 +3242,27 @@ class BackupManagementView(View):
     
     @discord.ui.button(label="🔙 Voltar", style=discord.ButtonStyle.gray, row=1)
     async def back_button(self, interaction: discord.Interaction, button: Button):
-        embed = CatBotUI.create_main_panel()
+        embed = CatBotUI.create_main_panel(interaction.guild_id)
         view = MainPanelView()
         await interaction.response.edit_message(embed=embed, view=view)
 
 class ConfirmRestoreView(View):
-    def __init__(self):
+    def __init__(self, snapshot_id: Optional[str] = None):
         super().__init__(timeout=60)
+        self.snapshot_id = snapshot_id
     
     @discord.ui.button(label="✅ SIM, RESTAURAR", style=discord.ButtonStyle.danger, row=0)
     async def confirm_button(self, interaction: discord.Interaction, button: Button):
+        await self._executar_restauracao(interaction, diferencial=False)
+    
+    @discord.ui.button(label="🩹 SÓ DIFERENÇAS", style=discord.ButtonStyle.blurple, row=0)
+    async def diff_button(self, interaction: discord.Interaction, button: Button):
+        await self._executar_restauracao(interaction, diferencial=True)
+    
+    async def _executar_restauracao(self, interaction: discord.Interaction, diferencial: bool):
         await interaction.response.defer(ephemeral=True)
         
-        backup_data = backup_master.carregar_backup()
+        backup_data = backup_master.carregar_backup(self.snapshot_id, interaction.guild_id)
         
         if not backup_data:
             await interaction.followup.send("❌ Backup não encontrado!", ephemeral=True)
@@ -2360,11 +3278,60 @@ class ConfirmRestoreView(View):
             timestamp=datetime.utcnow()
         )
         
-        await interaction.followup.send(embed=embed, ephemeral=True)
+        mensagem = await interaction.followup.send(embed=embed, ephemeral=True, wait=True)
+        
+        if diferencial:
+            etapas = ['cargos', 'categorias', 'canais', 'remocoes', 'configuracoes']
+        else:
+            etapas = ['cargos', 'categorias', 'canais', 'configuracoes']
+        
+        async def progresso(etapa, checkpoint):
+            concluidas = etapas.index(etapa) + 1
+            barra = '▰' * (concluidas * 2) + '▱' * ((len(etapas) - concluidas) * 2)
+            embed.description = ("**A restauração pode levar alguns minutos...**\n"
+                                 "Não desligue o bot durante este processo.\n\n"
+                                 f"Etapa: **{etapa}**\n"
+                                 f"Progresso: `[{barra}] {concluidas * 100 // (len(etapas) + 1)}%`")
+            try:
+                await mensagem.edit(embed=embed)
+            except:
+                pass
+        
+        if diferencial:
+            try:
+                contagem = await backup_master.restaurar_backup_diferencial(interaction.guild, backup_data, progresso)
+                
+                if contagem is not None:
+                    embed = discord.Embed(
+                        title="✅ RESTAURAÇÃO DIFERENCIAL CONCLUÍDA",
+                        description=f"Servidor comparado com o backup de **{backup_data['metadata']['guild_name']}**.\n\n"
+                                   f"• {contagem['criados']} itens recriados\n"
+                                   f"• {contagem['atualizados']} itens corrigidos\n"
+                                   f"• {contagem['removidos']} itens removidos\n"
+                                   f"• {contagem['ignorados']} cargos ignorados (acima do cargo do bot)\n\n"
+                                   "✅ **IDs do que sobreviveu foram preservados**",
+                        color=discord.Color.green(),
+                        timestamp=datetime.utcnow()
+                    )
+                else:
+                    embed = discord.Embed(
+                        title="❌ ERRO NA RESTAURAÇÃO",
+                        description="Ocorreu um erro durante a restauração diferencial.\n"
+                                   "Verifique os logs e tente de novo: o progresso foi salvo.",
+                        color=discord.Color.red(),
+                        timestamp=datetime.utcnow()
+                    )
+                
+                await interaction.edit_original_response(embed=embed)
+                
+            except Exception as e:
+                await interaction.edit_original_response(content=f"❌ Erro durante a restauração: {str(e)[:500]}")
+                logger.log_system(f"Erro crítico na restauração diferencial: {traceback.format_exc()}", "ERROR")
+            return
         
         # Iniciar restauração
         try:
-            success = await backup_master.restaurar_backup_completo(interaction.guild, backup_data)
+            success = await backup_master.restaurar_backup_completo(interaction.guild, backup_data, progresso)
             
             if success:
                 embed = discord.Embed(
@@ -2541,7 +3508,7 @@ class SecurityManagementView(View):
     
     @discord.ui.button(label="🔙 Voltar", style=discord.ButtonStyle.gray, row=1)
     async def back_button(self, interaction: discord.Interaction, button: Button):
-        embed = CatBotUI.create_main_panel()
+        embed = CatBotUI.create_main_panel(interaction.guild_id)
         view = MainPanelView()
         await interaction.response.edit_message(embed=embed, view=view)
 
@@ -2616,7 +3583,7 @@ class ConfigView(View):
             description="**Configurações recarregadas com sucesso:**\n\n"
                        f"• Whitelist: `{len(whitelist_master.whitelist)}` admins\n"
                        f"• Fingerprints: `{len(whitelist_master.fingerprints)}` usuários\n"
-                       f"• Backup: `{'✅' if backup_master.carregar_backup() else '❌'}`",
+                       f"• Backup: `{'✅' if backup_master.backup_disponivel(interaction.guild_id) else '❌'}`",
             color=discord.Color.green(),
             timestamp=datetime.utcnow()
         )
@@ -2626,9 +3593,8 @@ class ConfigView(View):
     @discord.ui.button(label="🧹 Limpar Cache", style=discord.ButtonStyle.red, row=0)
     async def clear_button(self, interaction: discord.Interaction, button: Button):
         # Limpar caches
-        anti_raid.join_timestamps.clear()
+        window_counter.limpar()
         anti_raid.suspicious_joins.clear()
-        anti_nuke.cooldowns.clear()
         anti_nuke.suspicious_actions.clear()
         
         logger.message_cache.clear()
@@ -2651,7 +3617,7 @@ class ConfigView(View):
     
     @discord.ui.button(label="🔙 Voltar", style=discord.ButtonStyle.gray, row=1)
     async def back_button(self, interaction: discord.Interaction, button: Button):
-        embed = CatBotUI.create_main_panel()
+        embed = CatBotUI.create_main_panel(interaction.guild_id)
         view = MainPanelView()
         await interaction.response.edit_message(embed=embed, view=view)
 
@@ -2760,6 +3726,11 @@ async def on_ready():
 # EVENTOS DE MONITORAMENTO
 # ==============================================
 
+@bot.event
+async def on_audit_log_entry_create(entry: discord.AuditLogEntry):
+    """Alimenta o correlacionador com as entradas do audit log em tempo real"""
+    audit_correlator.registrar(entry)
+
 @bot.event
 async def on_member_update(before: discord.Member, after: discord.Member):
     """Monitora atualizações de membros"""
@@ -2780,20 +3751,18 @@ async def on_guild_channel_create(channel: discord.abc.GuildChannel):
     """Monitora criação de canais"""
     guild = channel.guild
     
-    async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_create):
-        if entry.target.id == channel.id:
-            user = entry.user
-            
-            if not whitelist_master.is_whitelisted(user.id) and user != guild.owner and user != bot.user:
-                # Se não autorizado criou canal, deletar
-                try:
-                    await channel.delete(reason="Canal criado por não autorizado")
-                    await user.kick(reason="Criação de canal não autorizada")
-                    logger.log_nuke(f"Canal deletado: criado por {user.name}", user)
-                except:
-                    pass
+    entry = await audit_correlator.aguardar_entrada(guild, discord.AuditLogAction.channel_create, channel.id)
+    if entry:
+        user = entry.user
             
-            break
+        if not whitelist_master.is_whitelisted(user.id) and user != guild.owner and user != bot.user:
+            # Se não autorizado criou canal, deletar
+            try:
+                await channel.delete(reason="Canal criado por não autorizado")
+                await user.kick(reason="Criação de canal não autorizada")
+                logger.log_nuke(f"Canal deletado: criado por {user.name}", user)
+            except:
+                pass
     
     logger.log_action("CHANNEL_CREATE", channel.guild.me, channel.name, "")
 
@@ -2828,7 +3797,7 @@ async def on_member_ban(guild: discord.Guild, user: discord.User):
 @bot.event
 async def on_member_remove(member: discord.Member):
     """Monitora remoção de membros (kick)"""
-    await anti_nuke.monitorar_kick(member)
+    await anti_nuke.monitorar_kick(member, audit_correlator.inicio_evento())
     logger.log_action("MEMBER_KICK", member.guild.me, member.name, "")
 
 @bot.event
@@ -2883,10 +3852,11 @@ async def on_message_delete(message: discord.Message):
     # Tentar identificar quem deletou
     deleter = None
     try:
-        async for entry in message.guild.audit_logs(limit=5, action=discord.AuditLogAction.message_delete):
-            if entry.target.id == message.author.id:
-                deleter = entry.user
-                break
+        # Autoexclusões não geram entrada no audit log: espera curta e sem REST
+        entry = await audit_correlator.aguardar_entrada(message.guild, discord.AuditLogAction.message_delete, message.author.id,
+                                                        timeout=1.0, rest=False)
+        if entry:
+            deleter = entry.user
     except:
         pass
     
@@ -2961,7 +3931,7 @@ async def comando_painel(ctx: commands.Context):
         await ctx.send("❌ Apenas o dono pode usar este comando!")
         return
     
-    embed = CatBotUI.create_main_panel()
+    embed = CatBotUI.create_main_panel(ctx.guild.id if ctx.guild else None)
     view = MainPanelView()
     
     await ctx.send(embed=embed, view=view)
@@ -2998,6 +3968,58 @@ async def comando_backup(ctx: commands.Context):
     except Exception as e:
         await ctx.send(f"❌ Erro ao criar backup: {str(e)[:100]}")
 
+@bot.command(name='snapshots')
+async def comando_snapshots(ctx: commands.Context):
+    """Lista o histórico de backups"""
+    if ctx.author.id != OWNER_ID:
+        await ctx.send("❌ Apenas o dono pode ver os backups!")
+        return
+    
+    historico = snapshot_store.listar(ctx.guild.id if ctx.guild else None, tipo='backup')
+    
+    if not historico:
+        await ctx.send("❌ Nenhum snapshot encontrado!")
+        return
+    
+    embed = discord.Embed(
+        title="🕘 HISTÓRICO DE BACKUPS",
+        description="Use `#restaurar <id>` para restaurar um snapshot específico.",
+        color=discord.Color.blue(),
+        timestamp=datetime.utcnow()
+    )
+    
+    for snap in historico[:10]:
+        embed.add_field(
+            name=snap['id'],
+            value=f"**Data:** {datetime.fromtimestamp(snap['criado_em']).strftime('%d/%m/%Y %H:%M')}\n"
+                  f"**Objetos:** {snap['delta']['objetos']} ({snap['delta']['novos']} novos, {snap['delta']['reaproveitados']} reaproveitados)",
+            inline=False
+        )
+    
+    stats = snapshot_store.estatisticas()
+    embed.set_footer(text=f"{stats['snapshots']} snapshots • {stats['objetos']} objetos armazenados")
+    
+    await ctx.send(embed=embed)
+
+@bot.command(name='restaurar')
+async def comando_restaurar(ctx: commands.Context, snapshot_id: str):
+    """Restaura um snapshot específico do histórico"""
+    if ctx.author.id != OWNER_ID:
+        await ctx.send("❌ Apenas o dono pode restaurar backups!")
+        return
+    
+    backup_data = backup_master.carregar_backup(snapshot_id, ctx.guild.id if ctx.guild else None)
+    
+    if not backup_data:
+        await ctx.send("❌ Snapshot não encontrado! Use `#snapshots` para ver os disponíveis.")
+        return
+    
+    embed = CatBotUI.create_restore_confirmation(backup_data)
+    embed.add_field(name="🆔 Snapshot", value=f"`{snapshot_id}`", inline=False)
+    
+    view = ConfirmRestoreView(snapshot_id)
+    await ctx.send(embed=embed, view=view)
+
 @bot.command(name='whitelist')
 async def comando_whitelist(ctx: commands.Context):
     """Mostra a whitelist"""
@@ -3093,6 +4115,8 @@ async def comando_ajuda(ctx: commands.Context):
     commands_list = [
         ("#painel", "Abre o painel de controle principal"),
         ("#backup", "Cria um backup rápido do servidor"),
+        ("#snapshots", "Lista o histórico de backups"),
+        ("#restaurar <id>", "Restaura um snapshot específico"),
         ("#whitelist", "Mostra e gerencia a whitelist"),
         ("#logs", "Mostra estatísticas dos logs"),
         ("#status", "Mostra status completo do sistema"),